@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from copy import deepcopy
+from types import MappingProxyType
+from urllib.parse import urlsplit
 
 import os
+import tempfile
 
+import numpy as np
 import requests
 import bs4
 import sqlite3
+import threading
+from requests.adapters import HTTPAdapter
 
 __author__ = "Jianyang Tang"
 __email__ = "jian4yang2.tang1@gmail.com"
@@ -70,6 +84,16 @@ class Tile:
             EAST, SOUTH, WEST, NORTH     wind tile in 34-form
             BLANK, FORTUNE, CENTER       dragon tile in 34-form
             RED_MAN, RED_PIN, RED_SOU    red bonus tile in 136-form
+            <-- TYPE: numpy array ------------------------------------------->
+            his_to_34_arr     game history form --> 34-form, -1 for numbers which are no tile, e.g. 60 (drop the drawn
+                              tile)
+            his_red_arr       game history form --> whether it is a red five
+            t136_to_34_arr    136-form --> 34-form
+            t136_red_arr      136-form --> whether it is a red five
+            bns_ind_arr       bonus indicating tile in 34-form (34-36 for red fives) --> bonus tile in 34-form
+            his_to_34_list, bns_ind_list    the lookup arrays as lists, for converting short lists
+            PACK_BITS                    bits per kind of tile in the keys of pack_counts(...)
+            SUIT_KEY_MASK                mask of the key of one suit of 9 kinds in the keys of pack_counts(...)
         --------------------------------------------------------------------------------------------------------------
     """
 
@@ -96,6 +120,23 @@ class Tile:
     GREENS = [19, 20, 21, 23, 25, 32]
     RED_MAN, RED_PIN, RED_SOU = 16, 52, 88
     RED_BONUS = [16, 52, 88]
+    PACK_BITS = 3
+    SUIT_KEY_MASK = (1 << 27) - 1
+
+    his_to_34_arr = np.full(61, -1, dtype=np.int64)
+    his_to_34_arr[list(his_to_34_dic)] = list(his_to_34_dic.values())
+
+    his_red_arr = np.zeros(61, dtype=bool)
+    his_red_arr[[51, 52, 53]] = True
+
+    t136_to_34_arr = np.arange(136, dtype=np.int64) // 4
+
+    t136_red_arr = np.isin(np.arange(136), RED_BONUS)
+
+    bns_ind_arr = np.arange(1, 38, dtype=np.int64)
+    bns_ind_arr[list(bns_ind_bd_dic)] = list(bns_ind_bd_dic.values())
+
+    his_to_34_list, bns_ind_list = his_to_34_arr.tolist(), bns_ind_arr.tolist()
 
     index_to_chow = [[0, 1, 2], [1, 2, 3], [2, 3, 4], [3, 4, 5], [4, 5, 6], [5, 6, 7], [6, 7, 8],
                      [9, 10, 11], [10, 11, 12], [11, 12, 13], [12, 13, 14], [13, 14, 15], [14, 15, 16], [15, 16, 17],
@@ -125,9 +166,10 @@ class Tile:
     def t34_to_str(tiles):
         """
         Convert a list of tiles in 34-form to string description
-        :param tiles: a list of tiles in 34-form
+        :param tiles: a list of tiles in 34-form, or a Hand34
         :return: a represenation of the tiles in string
         """
+        tiles = Hand34.as_list(tiles)
         tiles.sort()
         man = [t for t in tiles if t < 9]
         pin = [t - 9 for t in tiles if 9 <= t < 18]
@@ -153,9 +195,10 @@ class Tile:
     def t34_to_grf(tiles):
         """
         Convert tiles in 34-form to unicode graph representation
-        :param tiles: a list of tiles or a single tile in 34-form
+        :param tiles: a list of tiles or a single tile in 34-form, or a Hand34
         :return: a string of the tiles' unicode graph
         """
+        tiles = Hand34.as_list(tiles)
         if isinstance(tiles, int):
             if tiles >= 0:
                 return Tile.to_graph_list[tiles]
@@ -222,6 +265,123 @@ class Tile:
         else:
             print("Wrong parameters: Tile.indicator_to_bonus(tiles60)")
 
+    @staticmethod
+    def _flatten(tiles, flat):
+        for t in tiles:
+            if isinstance(t, (list, tuple)):
+                Tile._flatten(t, flat)
+            elif isinstance(t, (int, np.integer)):
+                flat.append(t)
+
+    @staticmethod
+    def _refill(tiles, values):
+        res = []
+        for t in tiles:
+            if isinstance(t, (list, tuple)):
+                res.append(Tile._refill(t, values))
+            elif isinstance(t, (int, np.integer)):
+                res.append(next(values))
+            else:
+                res.append(t)
+        return res
+
+    @staticmethod
+    def _lookup(table, tiles):
+        """
+        Convert tiles with one indexing operation into a lookup array.
+        :param table: a 1d numpy array, indexed by the tiles
+        :param tiles: a single tile, a numpy array of tiles, or a nested list of tiles of any depth and length, in
+            which entries other than integers, e.g. the strings of called melds in game logs, are kept as they are
+        :return: a single value, a numpy array of the same shape, or a nested list of the same structure
+        """
+        if isinstance(tiles, (int, np.integer)):
+            return table[tiles].item()
+        if isinstance(tiles, np.ndarray):
+            return table[tiles]
+        flat = []
+        Tile._flatten(tiles, flat)
+        values = table[np.array(flat, dtype=np.int64)].tolist() if flat else []
+        return Tile._refill(tiles, iter(values))
+
+    @staticmethod
+    def his_to_34_np(tiles):
+        """
+        Vectorized his_to_34(...), see _lookup(...) for the accepted input. The number 60, which drops the drawn tile in
+        game logs, is converted to -1.
+        :param tiles: tiles in game log data form
+        :return: tiles in 34-form
+        """
+        return Tile._lookup(Tile.his_to_34_arr, tiles)
+
+    @staticmethod
+    def t136_to_34_np(tiles):
+        """
+        Vectorized conversion from 136-form to 34-form, see _lookup(...) for the accepted input.
+        :param tiles: tiles in 136-form
+        :return: tiles in 34-form
+        """
+        return Tile._lookup(Tile.t136_to_34_arr, tiles)
+
+    @staticmethod
+    def cal_bonus_tiles_np(bonus_indicators_34):
+        """
+        Vectorized cal_bonus_tiles(...), see _lookup(...) for the accepted input.
+        :param bonus_indicators_34: bonus indicators in 34-form
+        :return: the corresponding bonus tiles in 34-form
+        """
+        return Tile._lookup(Tile.bns_ind_arr, bonus_indicators_34)
+
+    @staticmethod
+    def t60_to_bns_np(tiles60):
+        """
+        Vectorized t60_to_bns(...), see _lookup(...) for the accepted input.
+        :param tiles60: bonus indicators in game log form
+        :return: the corresponding bonus tiles in 34-form
+        """
+        return Tile.cal_bonus_tiles_np(Tile.his_to_34_np(tiles60))
+
+    @staticmethod
+    def is_red_his_np(tiles):
+        """
+        :param tiles: tiles in game log form, see _lookup(...) for the accepted input
+        :return: booleans, whether the tiles are red fives
+        """
+        return Tile._lookup(Tile.his_red_arr, tiles)
+
+    @staticmethod
+    def is_red_136_np(tiles):
+        """
+        :param tiles: tiles in 136-form, see _lookup(...) for the accepted input
+        :return: booleans, whether the tiles are red fives
+        """
+        return Tile._lookup(Tile.t136_red_arr, tiles)
+
+    @staticmethod
+    def his_round_to_34(round_log):
+        """
+        Convert the hands, draws, discards and bonus indicators of one round of a game log to 34-form in one call.
+        :param round_log: one round of a game log, see GameLogCrawler.prt_log_format(...)
+        :return: a dict
+            "hands"       initial hands of the four players in 34-form
+            "red_fives"   the red fives of the initial hands in 34-form
+            "draws"       drawn tiles of the four players in 34-form, the strings of called melds are kept
+            "discards"    dropped tiles of the four players in 34-form, -1 for dropping the drawn tile, the strings of
+                          riichi, ankan and chakan are kept
+            "bonus_tiles" bonus tiles of the bonus indicators
+            "ura_bonus_tiles" bonus tiles of the ura bonus indicators
+        """
+        rows = [round_log[2], round_log[3]] + [round_log[(p + 1) * 3 + i] for i in (1, 2, 3) for p in range(4)]
+        # the rows are short python lists, building numpy arrays for them costs more than it saves
+        his_to_34, bns_ind = Tile.his_to_34_list, Tile.bns_ind_list
+        rows34 = [[his_to_34[t] if t.__class__ is int else t for t in row] for row in rows]
+        bonus = [bns_ind[t] for t in rows34[0] + rows34[1]]
+        return {"hands": rows34[2:6],
+                "red_fives": [[t34 for t, t34 in zip(rows[2 + p], rows34[2 + p]) if t > 50] for p in range(4)],
+                "draws": rows34[6:10],
+                "discards": rows34[10:14],
+                "bonus_tiles": bonus[:len(rows[0])],
+                "ura_bonus_tiles": bonus[len(rows[0]):]}
+
     @staticmethod
     def self_wind(dealer):
         """
@@ -242,6 +402,108 @@ class Tile:
         """
         return tile34_1 // 9 == tile34_2 // 9
 
+    @staticmethod
+    def pack_counts(counts):
+        """
+        Pack a count vector into one integer with 3 bits per kind of tile, the count of the i-th kind is stored in the
+        bits 3i to 3i+2. Counts from 0 to 7 are packed without collisions. The key of a hand splits into the keys of
+        its suits, see suit_subkeys(...), and adding a tile t to a hand adds 1 << 3t to its key.
+        :param counts: a sequence of integers, e.g. the 34 counts of a hand or the 9 counts of a suit
+        :return: an integer
+        """
+        key = 0
+        for c in reversed(counts):
+            key = (key << 3) | c
+        return key
+
+    @staticmethod
+    def pack_tiles(tiles34):
+        """
+        The same key as pack_counts(...) of the count vector of the tiles, without building the count vector.
+        :param tiles34: tiles in 34-form
+        :return: an integer
+        """
+        return sum(1 << (3 * t) for t in tiles34)
+
+    @staticmethod
+    def unpack_counts(key, size=34):
+        """
+        Inverse of pack_counts(...).
+        :param key: an integer returned by pack_counts(...)
+        :param size: the number of kinds of tiles packed in the key
+        :return: a list of size integers
+        """
+        return [(key >> (3 * i)) & 7 for i in range(size)]
+
+    @staticmethod
+    def suit_subkeys(key):
+        """
+        Split the key of a hand returned by pack_counts(...) into the keys of man, pin, suo and the character tiles.
+        :param key: an integer returned by pack_counts(...) for 34 counts
+        :return: a list of 4 integers, each equal to pack_counts(...) of the counts of one type of tiles
+        """
+        return [(key >> (27 * i)) & Tile.SUIT_KEY_MASK for i in range(3)] + [key >> 81]
+
+    @staticmethod
+    def canonical_suits(key):
+        """
+        Canonical form of a hand under the permutations of man, pin and suo, which leave the shantin, the winning
+        partitions and all yaku except 緑一色 unchanged. The suits of the canonical hand are ordered by their keys,
+        the largest first, so all hands that only differ in the order of their suits share one canonical key.
+        :param key: the key of a hand, see pack_counts(...)
+        :return: a tuple (canonical key, perm), perm is a tuple of 3 integers, the tiles of suit s are moved to suit
+            perm[s], see map_suits(...) for moving tiles forth and back
+        """
+        subkeys = Tile.suit_subkeys(key)
+        order = sorted(range(3), key=lambda s: -subkeys[s])
+        perm = [0] * 3
+        for i, s in enumerate(order):
+            perm[s] = i
+        canonical = subkeys[order[0]] | (subkeys[order[1]] << 27) | (subkeys[order[2]] << 54) | (subkeys[3] << 81)
+        return canonical, tuple(perm)
+
+    @staticmethod
+    def map_suits(tiles, perm, inverse=False):
+        """
+        Move number tiles to other suits, e.g. into the canonical form of canonical_suits(...) and back.
+        :param tiles: a single tile or a list of tiles in 34-form
+        :param perm: a tuple of 3 integers, the tiles of suit s are moved to suit perm[s]
+        :param inverse: move the tiles of suit perm[s] back to suit s instead
+        :return: a single tile or a list of tiles in 34-form
+        """
+        if inverse:
+            perm = tuple(perm.index(s) for s in range(3))
+        if isinstance(tiles, int):
+            return perm[tiles // 9] * 9 + tiles % 9 if tiles < 27 else tiles
+        return [perm[t // 9] * 9 + t % 9 if t < 27 else t for t in tiles]
+
+    @staticmethod
+    def pack_suit(suit_counts):
+        """
+        Pack the counts of one suit into the integer they form in base 5, i.e. the count of the i-th tile is the i-th
+        digit. It is shorter than pack_counts(...) and used by the agari table, counts have to be between 0 and 4.
+        :param suit_counts: a sequence of integers between 0 and 4
+        :return: an integer
+        """
+        key = 0
+        for c in reversed(suit_counts):
+            key = key * 5 + c
+        return key
+
+    @staticmethod
+    def unpack_suit(key, size=9):
+        """
+        Inverse of pack_suit(...).
+        :param key: an integer returned by pack_suit(...)
+        :param size: the number of kinds of tiles packed in the key
+        :return: a list of size integers
+        """
+        res = []
+        for _ in range(size):
+            key, c = divmod(key, 5)
+            res.append(c)
+        return res
+
 
 class Meld:
     """
@@ -313,101 +575,333 @@ class Meld:
         return Tile.t136_to_str(self.tiles)
 
 
+class Hand34:
+    """
+        Tiles in 34-form kept as a count vector of 34 slots, so that adding, removing and counting a tile is O(1).
+        All functions of Partition, HandTracker and WinWaitCal which take a list of tiles in 34-form also take a Hand34.
+        Iterating over a Hand34 yields its tiles in sorted order, len(...) is the number of tiles.
+        For example:
+            hand = Hand34([0, 0, 1, 2, 3, 14, 14, 14, 15, 27, 27, 28, 28])
+            hand.add(16)
+            hand.remove(27)
+            print(Partition.shantin_multiple_forms(hand, [], [27]))
+    """
+
+    __slots__ = ("counts", "size", "packed")
+
+    def __init__(self, tiles34=()):
+        """
+        To initialise a hand.
+        :param tiles34: a list of tiles in 34-form, or another Hand34
+        """
+        if isinstance(tiles34, Hand34):
+            self.counts, self.size, self.packed = array('b', tiles34.counts), tiles34.size, tiles34.packed
+        else:
+            self.counts, self.size, self.packed = array('b', bytes(34)), 0, 0
+            for t in tiles34:
+                self.add(t)
+
+    @staticmethod
+    def from_counts(counts):
+        """
+        :param counts: a sequence of 34 integers, the number of copies of each tile
+        :return: a new Hand34
+        """
+        hand = Hand34()
+        hand.counts = array('b', counts)
+        hand.size = sum(hand.counts)
+        hand.packed = Tile.pack_counts(hand.counts)
+        return hand
+
+    @staticmethod
+    def pack(tiles34):
+        """
+        :param tiles34: a list of tiles in 34-form or a Hand34
+        :return: the key of the tiles, see Tile.pack_counts(...)
+        """
+        return tiles34.packed if isinstance(tiles34, Hand34) else Tile.pack_tiles(tiles34)
+
+    @staticmethod
+    def as_list(tiles34):
+        """
+        :param tiles34: a list of tiles in 34-form or a Hand34
+        :return: the list itself, or the sorted tiles of the Hand34
+        """
+        return tiles34.tiles34 if isinstance(tiles34, Hand34) else tiles34
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        counts = self.counts
+        for t in range(34):
+            for _ in range(counts[t]):
+                yield t
+
+    def __contains__(self, tile):
+        return self.counts[tile] > 0
+
+    def __eq__(self, other):
+        return isinstance(other, Hand34) and self.counts == other.counts
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Hand34({})".format(Tile.t34_to_str(self.tiles34))
+
+    @property
+    def tiles34(self):
+        """
+        Getter: the tiles of the hand
+        :return: a sorted list of tiles in 34-form
+        """
+        return list(self)
+
+    @property
+    def key(self):
+        """
+        Getter: a hashable key of the hand, equal for equal hands, it is kept up to date by add(...) and remove(...)
+        :return: the integer Tile.pack_counts(...) of the 34 counts
+        """
+        return self.packed
+
+    @property
+    def suit_keys(self):
+        """
+        Getter: the keys of man, pin, suo and the character tiles, see Tile.suit_subkeys(...)
+        :return: a list of 4 integers
+        """
+        return Tile.suit_subkeys(self.packed)
+
+    def count(self, tile):
+        return self.counts[tile]
+
+    def add(self, tile):
+        """
+        Add a tile to the hand.
+        :param tile: a tile in 34-form
+        """
+        if self.counts[tile] >= 4:
+            raise ValueError("All four copies of tile {} are already in hand".format(tile))
+        self.counts[tile] += 1
+        self.size += 1
+        self.packed += 1 << (3 * tile)
+
+    def remove(self, tile):
+        """
+        Remove a tile from the hand.
+        :param tile: a tile in 34-form
+        """
+        if self.counts[tile] == 0:
+            raise ValueError("Tile {} is not in hand".format(tile))
+        self.counts[tile] -= 1
+        self.size -= 1
+        self.packed -= 1 << (3 * tile)
+
+    def suit(self, tp):
+        """
+        A view of the counts of one type of tiles, which follows later changes of the hand.
+        :param tp: 0 man, 1 pin, 2 suo, 3 character tiles
+        :return: a memoryview of the 9 (7 for character tiles) counts
+        """
+        return memoryview(self.counts)[tp * 9:min(tp * 9 + 9, 34)]
+
+    def copy(self):
+        return Hand34(self)
+
+
+class LRUCache:
+    """
+        A mapping of bounded size, which evicts the least recently used entry once the size limit is exceeded.
+        Lookups by get(...) are counted as hits and misses to show how effective the memoization is.
+    """
+
+    def __init__(self, maxsize=4096):
+        """
+        To initialise an empty cache.
+        :param maxsize: the maximal number of entries, None means unbounded
+        """
+        self.maxsize = maxsize
+        self.hits, self.misses = 0, 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Look up a key and mark it as most recently used.
+        :param key: a hashable key
+        :param default: returned if the key is not cached
+        :return: the cached value or default
+        """
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        """
+        Insert or replace an entry, and evict the least recently used entries beyond maxsize.
+        :param key: a hashable key
+        :param value: the value to be cached
+        :return: None
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        """
+        Change the size limit, the least recently used entries are evicted if the cache is too large.
+        :param maxsize: the new maximal number of entries, None means unbounded
+        :return: None
+        """
+        self.maxsize = maxsize
+        if maxsize is not None:
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit and miss counters.
+        :return: None
+        """
+        self._data.clear()
+        self.hits, self.misses = 0, 0
+
+    def info(self):
+        """
+        Statistics of the cache.
+        :return: a dict with keys "hits", "misses", "hit_rate", "size" and "maxsize"
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+
 class Partition:
+    """
+        Class attributes (Explanation):
+            suit_table      key of the count vector of one suit, see Tile.pack_counts(...) --> geo vectors of its
+                            minimal partitions, for the forms normal, no_triplets, no_19 and pure_color
+            honor_table     number of copies of one character tile --> geo vector of its partitioned component
+            form_names      names of the shantin forms, in the column order of shantin_multiple_forms_batch(...)
+            partition_cache LRUCache, key of the tiles of one suit shifted to 0-8 --> partitions of these tiles,
+                            it is shared by all shantin calculations, use partition_cache.resize(...) to change the
+                            size limit and partition_cache.info() to read the hit and miss counters
+    """
+
+    suit_table = {}
+
+    partition_cache = LRUCache(maxsize=8192)
+
+    honor_table = [(0, 0, 0, 0, 0, 0), (1, 0, 0, 0, 0, 0), (0, 0, 0, 1, 0, 0), (0, 0, 0, 0, 0, 1), (0, 0, 0, 0, 0, 0)]
+
+    form_names = ["normal______", "no_triplets_", "no_19_______", "no_sequences", "seven_pairs_", "pure_color__"]
 
     @staticmethod
     def _partition_single_type(tiles34):
         """
-        Partition tiles of one type into melds, half-finished melds and singles
+        Partition tiles of one type into melds, half-finished melds and singles.
+        Only the partitions with the least number of components are returned. They are searched depth first on the
+        count vector of the tiles, and a branch is cut as soon as it can not reach the least number found so far.
         :param tiles34: tiles of the same type
         :return: a list of multiple partition results, each partition result is a list of list, where each list in a
         partition represents a partitioned component
         """
-        len_t = len(tiles34)
-
-        # no tiles of this type
-        if len_t == 0:
+        if len(tiles34) == 0:
             return [[]]
-        # one tile, or two tile which can be parsed into an open set
-        if len_t == 1 or (len_t == 2 and abs(tiles34[0] - tiles34[1]) < 3):
-            return [[tiles34]]
-        # two separate tiles
-        if len_t == 2:
-            return [[tiles34[0:1], tiles34[1:2]]]
 
-        res = []
+        base = min(tiles34) // 9 * 9
+        counts = [0] * 11
+        for t in tiles34:
+            counts[t - base] += 1
+
+        best_len = [len(tiles34)]
+        res, found, current = [], set(), []
+
+        def take(components, pos, remaining):
+            for t in components:
+                counts[t] -= 1
+            current.append(components)
+            search(pos, remaining - len(components))
+            current.pop()
+            for t in components:
+                counts[t] += 1
+
+        def search(pos, remaining):
+            if remaining == 0:
+                if len(current) < best_len[0]:
+                    best_len[0] = len(current)
+                    del res[:]
+                    found.clear()
+                key = tuple(current)
+                if key not in found:
+                    found.add(key)
+                    res.append(key)
+                return
+            # each component holds 3 tiles at most
+            if len(current) + (remaining + 2) // 3 > best_len[0]:
+                return
+            while counts[pos] == 0:
+                pos += 1
+            if counts[pos] >= 3:
+                take((pos, pos, pos), pos, remaining)
+            if counts[pos + 1] > 0 and counts[pos + 2] > 0:
+                take((pos, pos + 1, pos + 2), pos, remaining)
+            if counts[pos + 1] > 0:
+                take((pos, pos + 1), pos, remaining)
+            if counts[pos + 2] > 0:
+                take((pos, pos + 2), pos, remaining)
+            if counts[pos] >= 2:
+                take((pos, pos), pos, remaining)
+            take((pos,), pos, remaining)
+
+        search(0, len(tiles34))
+        return [[[t + base for t in m] for m in p] for p in res]
 
-        # parse a pon meld
-        if tiles34[0] == tiles34[1] == tiles34[2]:
-            tmp_res = Partition._partition_single_type(tiles34[3:])
-            if len(tmp_res) > 0:
-                for tile_set in tmp_res:
-                    res.append([tiles34[0:3]] + tile_set)
-
-        # parse a chow meld
-        if tiles34[0] + 1 in tiles34 and tiles34[0] + 2 in tiles34:
-            rec_tiles = deepcopy(tiles34)
-            rec_tiles.remove(tiles34[0])
-            rec_tiles.remove(tiles34[0] + 1)
-            rec_tiles.remove(tiles34[0] + 2)
-            tmp_res = Partition._partition_single_type(rec_tiles)
-            if len(tmp_res) > 0:
-                for tile_set in tmp_res:
-                    res.append([[tiles34[0], tiles34[0] + 1, tiles34[0] + 2]] + tile_set)
-
-        # parse an two-headed half-finished meld
-        if tiles34[0] + 1 in tiles34:
-            rec_tiles = deepcopy(tiles34)
-            rec_tiles.remove(tiles34[0])
-            rec_tiles.remove(tiles34[0] + 1)
-            tmp_res = Partition._partition_single_type(rec_tiles)
-            if len(tmp_res) > 0:
-                for tile_set in tmp_res:
-                    res.append([[tiles34[0], tiles34[0] + 1]] + tile_set)
-
-        # parse an dead half-finished meld
-        if tiles34[0] + 2 in tiles34:
-            rec_tiles = deepcopy(tiles34)
-            rec_tiles.remove(tiles34[0])
-            rec_tiles.remove(tiles34[0] + 2)
-            tmp_res = Partition._partition_single_type(rec_tiles)
-            if len(tmp_res) > 0:
-                for tile_set in tmp_res:
-                    res.append([[tiles34[0], tiles34[0] + 2]] + tile_set)
-
-        # parse a pair
-        if tiles34[0] == tiles34[1]:
-            tmp_res = Partition._partition_single_type(tiles34[2:])
-            if len(tmp_res) > 0:
-                for tile_set in tmp_res:
-                    res.append([tiles34[0:2]] + tile_set)
-
-        tmp_res = Partition._partition_single_type(tiles34[1:])
-        if len(tmp_res) > 0:
-            for tile_set in tmp_res:
-                res.append([tiles34[0:1]] + tile_set)
-
-        tuned_res = []
-        min_len = min([len(p) for p in res])
-        for p in res:
-            if len(p) <= min_len and p not in tuned_res:
-                tuned_res.append(p)
-
-        return tuned_res
+    @staticmethod
+    def _partition_single_type_cached(tiles34):
+        """
+        Memoized version of _partition_single_type(...).
+        Tiles are sorted and shifted to 0-8 before the lookup, so that all three suits share the cached entries.
+        :param tiles34: tiles of the same type
+        :return: a new list of partition results, see _partition_single_type(...)
+        """
+        if len(tiles34) == 0:
+            return [[]]
+        base = tiles34[0] // 9 * 9
+        key = Tile.pack_tiles(t - base for t in tiles34)
+        partitions = Partition.partition_cache.get(key)
+        if partitions is None:
+            counts = Tile.unpack_counts(key, 9)
+            tiles = [t for t in range(9) for _ in range(counts[t])]
+            partitions = tuple(tuple(tuple(m) for m in p) for p in Partition._partition_single_type(tiles))
+            Partition.partition_cache.put(key, partitions)
+        return [[[t + base for t in m] for m in p] for p in partitions]
 
     @staticmethod
     def partition(tiles34):
         """
         Partition a set of tiles in 34-form into finished melds, half-finished melds and singles.
         :param tiles34:
-            a list of tiles in 34-form
+            a list of tiles in 34-form, or a Hand34
         :return:
             a list of partition results of the input tiles, each partition is a list of list,
             where each list represents a partitioned component
         """
-        p_man = Partition._partition_single_type([t for t in tiles34 if 0 <= t < 9])
-        p_pin = Partition._partition_single_type([t for t in tiles34 if 9 <= t < 18])
-        p_suo = Partition._partition_single_type([t for t in tiles34 if 18 <= t < 27])
+        tiles34 = Hand34.as_list(tiles34)
+        p_man = Partition._partition_single_type_cached([t for t in tiles34 if 0 <= t < 9])
+        p_pin = Partition._partition_single_type_cached([t for t in tiles34 if 9 <= t < 18])
+        p_suo = Partition._partition_single_type_cached([t for t in tiles34 if 18 <= t < 27])
         h_chr = [t for t in tiles34 if 27 <= t < 34]
         p_chr = [[[chr_tile] * h_chr.count(chr_tile) for chr_tile in set(h_chr)]]
         res = []
@@ -424,42 +918,216 @@ class Partition:
         hand_total_set = set(hand_total)
         res = []
 
+    @staticmethod
+    def _geo_vec_normal(p):
+        """
+        Count the components of a partition by type.
+        :param p: a partition, i.e. a list of partitioned components
+        :return: a list of 6 integers, the numbers of
+            [singles, edge/closed half-finished melds, two-sided half-finished melds, pairs, chows, pons]
+        """
+        geo_vec = [0] * 6
+
+        def incre(set_type):
+            geo_vec[set_type] += 1
+
+        for m in p:
+            len(m) == 1 and incre(0)
+            len(m) == 2 and abs(m[0] - m[1]) == 0 and incre(3)
+            len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
+            len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
+            len(m) == 3 and incre(5 if m[0] == m[1] else 4)
+
+        return geo_vec
+
+    @staticmethod
+    def _shantin_normal_geo(geo_vec, called_meld_num):
+        needed_set = (4 - called_meld_num) - geo_vec[4] - geo_vec[5]
+        if geo_vec[3] > 0:
+            if geo_vec[1] + geo_vec[2] + geo_vec[3] - 1 >= needed_set:
+                return needed_set - 1
+            else:
+                return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1
+        else:
+            if geo_vec[1] + geo_vec[2] >= needed_set:
+                return needed_set
+            else:
+                return 2 * needed_set - (geo_vec[1] + geo_vec[2])
+
     @staticmethod
     def _shantin_normal(partitions, called_meld_num):
+        return min([Partition._shantin_normal_geo(Partition._geo_vec_normal(p), called_meld_num) for p in partitions])
+
+    @staticmethod
+    def _pareto_geo_vecs(geo_vecs, projection):
+        """
+        Keep one geo vector for each projection, which is not dominated by the projection of another geo vector.
+        The shantin of a form never increases when a component of its projection increases, thus the dropped geo
+        vectors can not give a smaller shantin, neither alone nor summed up with geo vectors of other suits.
+        :param geo_vecs: an iterable of geo vectors
+        :param projection: maps a geo vector to the tuple of values the shantin of a form depends on
+        :return: a tuple of geo vectors
+        """
+        projected = {}
+        for g in geo_vecs:
+            projected.setdefault(projection(tuple(g)), tuple(g))
+        return tuple(g for k, g in projected.items()
+                     if not any(o != k and all(a >= b for a, b in zip(o, k)) for o in projected))
 
-        def geo_vec_normal(p):
-            geo_vec = [0] * 6
+    @staticmethod
+    def _suit_geo_vecs(suit_counts):
+        """
+        Look up the geo vectors of the minimal partitions of one suit in the per-suit table.
+        The table is filled on demand, see build_suit_table(...) for filling it in advance.
+        :param suit_counts: a sequence of 9 integers, the number of copies of each tile of the suit
+        :return: a tuple of the geo vectors (tuples of 6 integers) needed by the forms normal, no_triplets, no_19 and
+            pure_color, only those geo vectors that can give the least shantin of the form are kept
+        """
+        return Partition._suit_entry(Tile.pack_counts(suit_counts))
 
-            def incre(set_type):
-                geo_vec[set_type] += 1
+    @staticmethod
+    def _suit_entry(key):
+        """
+        :param key: the key of the count vector of one suit, see Tile.pack_counts(...)
+        :return: see _suit_geo_vecs(...)
+        """
+        geo_vecs = Partition.suit_table.get(key)
+        if geo_vecs is None:
+            counts = Tile.unpack_counts(key, 9)
+            tiles = [t for t in range(9) for _ in range(counts[t])]
+            partitions = Partition._partition_single_type_cached(tiles)
+            geo_n = [Partition._geo_vec_normal(p) for p in partitions]
+            geo_19 = [Partition._geo_vec_no19(p) for p in partitions]
+            geo_vecs = (Partition._pareto_geo_vecs(geo_n, lambda g: (g[4] + g[5], g[1] + g[2], g[3])),
+                        Partition._pareto_geo_vecs(geo_n, lambda g: (g[4], g[1] + g[2], min(g[2], 1), min(g[3], 1))),
+                        Partition._pareto_geo_vecs(geo_19, lambda g: (g[4] + g[5], g[1] + g[2], g[3], g[0])),
+                        Partition._pareto_geo_vecs(geo_n, lambda g: (g[4] + g[5], g[1] + g[2], g[3], g[0])))
+            Partition.suit_table[key] = geo_vecs
+        return geo_vecs
 
-            for m in p:
-                len(m) == 1 and incre(0)
-                len(m) == 2 and abs(m[0] - m[1]) == 0 and incre(3)
-                len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
-                len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
-                len(m) == 3 and incre(5 if m[0] == m[1] else 4)
+    @staticmethod
+    def build_suit_table(max_tiles=14):
+        """
+        Fill the per-suit lookup table in advance for every suit holding at most max_tiles tiles.
+        :param max_tiles: the maximal number of tiles of one suit to be covered
+        :return: the number of entries in the table
+        """
+        def fill(counts, pos, remaining):
+            if pos == 9:
+                Partition._suit_geo_vecs(counts)
+                return
+            for c in range(min(4, remaining) + 1):
+                counts[pos] = c
+                fill(counts, pos + 1, remaining - c)
+            counts[pos] = 0
 
-            return geo_vec
+        fill([0] * 9, 0, max_tiles)
+        return len(Partition.suit_table)
 
-        def shantin_n(p):
-            geo_vec = geo_vec_normal(p)
-            needed_set = (4 - called_meld_num) - geo_vec[4] - geo_vec[5]
-            if geo_vec[3] > 0:
-                if geo_vec[1] + geo_vec[2] + geo_vec[3] - 1 >= needed_set:
-                    return needed_set - 1
-                else:
-                    return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1
-            else:
-                if geo_vec[1] + geo_vec[2] >= needed_set:
-                    return needed_set
-                else:
-                    return 2 * needed_set - (geo_vec[1] + geo_vec[2])
+    @staticmethod
+    def _counts34(tiles34):
+        if isinstance(tiles34, Hand34):
+            return tiles34.counts.tolist()
+        counts = [0] * 34
+        for t in tiles34:
+            counts[t] += 1
+        return counts
+
+    @staticmethod
+    def _chr_geo_vecs(counts, bonus_chrs):
+        """
+        Geo vectors of the character tiles, which can only be partitioned in one way.
+        :param counts: count vector of the hand tiles
+        :param bonus_chrs: a list of bonus character tiles
+        :return: a tuple (geo vector for the normal forms, geo vector for the no triplets form)
+        """
+        geo_vec, geo_vec_ph = [0] * 6, [0] * 6
+        for t in range(27, 34):
+            c = counts[t]
+            for i, v in enumerate(Partition.honor_table[c]):
+                geo_vec[i] += v
+                geo_vec_ph[i] += v if (c != 2 or t not in bonus_chrs) else 0
+        return geo_vec, geo_vec_ph
+
+    @staticmethod
+    def _sum_geo_vecs(base, geo_man, geo_pin, geo_suo):
+        return [[b + m + p + s for b, m, p, s in zip(base, gm, gp, gs)]
+                for gm in geo_man for gp in geo_pin for gs in geo_suo]
+
+    @staticmethod
+    def _shantin_normal_table(tiles34, called_meld_num):
+        counts = Partition._counts34(tiles34)
+        chr_geo, _ = Partition._chr_geo_vecs(counts, [])
+        suit_geos = [Partition._suit_geo_vecs(counts[i * 9:(i + 1) * 9])[0] for i in range(3)]
+        return min(Partition._shantin_normal_geo(g, called_meld_num)
+                   for g in Partition._sum_geo_vecs(chr_geo, *suit_geos))
 
-        return min([shantin_n(p) for p in partitions])
+    @staticmethod
+    def _shantin_forms_table(counts, suit_geos, called_melds, bonus_chrs, memo=None):
+        """
+        Table driven version of shantin_multiple_forms(...).
+        :param counts: count vector of the hand tiles
+        :param suit_geos: the per-suit table entries of man, pin and suo, see _suit_geo_vecs(...)
+        :param called_melds: the ever called melds
+        :param bonus_chrs: a list of bonus character tiles
+        :param memo: optional dict shared by calls with the same called melds and bonus character tiles. The forms
+            combining table entries only depend on the entries, the character tiles and the number of tiles in each
+            suit, and hands with equal such values reuse the stored shantin.
+        :return: the same dictionary as shantin_multiple_forms(...)
+        """
+        suit_nums = [sum(counts[i * 9:(i + 1) * 9]) for i in range(3)]
+        key = None
+        geo_res = None
+        if memo is not None:
+            key = (suit_geos[0], suit_geos[1], suit_geos[2], tuple(counts[27:]), tuple(suit_nums))
+            geo_res = memo.get(key)
+        if geo_res is None:
+            geo_res = Partition._shantin_geo_forms(counts, suit_geos, suit_nums, called_melds, bonus_chrs)
+            if memo is not None:
+                memo[key] = geo_res
+
+        return {"normal______": geo_res[0],
+                "no_triplets_": geo_res[1],
+                "no_19_______": geo_res[2],
+                "no_sequences": Partition._shantin_no_sequences_counts(counts, called_melds),
+                "seven_pairs_": Partition._shantin_seven_pairs_counts(counts, called_melds),
+                "pure_color__": geo_res[3]}
 
     @staticmethod
-    def shantin_normal(tiles34, called_melds):
+    def _shantin_geo_forms(counts, suit_geos, suit_nums, called_melds, bonus_chrs):
+        """
+        :return: a tuple of the shantin of the forms normal, no_triplets, no_19 and pure_color
+        """
+        called_meld_num = len(called_melds)
+        chr_geo, chr_geo_ph = Partition._chr_geo_vecs(counts, bonus_chrs)
+        geo_man, geo_pin, geo_suo = suit_geos
+        no_chr = [0] * 6
+
+        st_normal = min(Partition._shantin_normal_geo(g, called_meld_num)
+                        for g in Partition._sum_geo_vecs(chr_geo, geo_man[0], geo_pin[0], geo_suo[0]))
+
+        if called_meld_num:
+            st_no_triplets = 10
+        else:
+            st_no_triplets = min(Partition._shantin_pinhu_geo(g)
+                                 for g in Partition._sum_geo_vecs(chr_geo_ph, geo_man[1], geo_pin[1], geo_suo[1]))
+
+        if any(tile in Tile.ONENINE for m in called_melds for tile in m):
+            st_no_19 = 10
+        else:
+            st_no_19 = min(Partition._shantin_no19_geo(g, called_meld_num)
+                           for g in Partition._sum_geo_vecs(no_chr, geo_man[2], geo_pin[2], geo_suo[2]))
+
+        qh_type = Partition._pure_color_types(suit_nums, called_melds)
+        if len(qh_type) == 0:
+            st_pure_color = 10
+        else:
+            st_pure_color = min(Partition._shantin_pure_color_geo([c + v for c, v in zip(chr_geo, g)], called_meld_num)
+                                for tp in qh_type for g in suit_geos[tp][3])
+        return st_normal, st_no_triplets, st_no_19, st_pure_color
+
+    @staticmethod
+    def shantin_normal(tiles34, called_melds, engine="partition"):
         """
         Calculate the normal shantin of a list of tiles.
         Normal shantin means that there is no any extra constraint on the winning tiles' pattern.
@@ -467,40 +1135,45 @@ class Partition:
             a list of tiles in 34-form, normally it is meant to be the tiles in hand
         :param called_melds:
             the ever called melds
+        :param engine:
+            "partition" enumerates all partitions of the hand tiles,
+            "table" combines precomputed per-suit lookup tables, both deliver the same shantin
         :return:
             the normal shantin.
         """
+        if engine == "table":
+            return Partition._shantin_normal_table(tiles34, len(called_melds))
         return Partition._shantin_normal(Partition.partition(tiles34), len(called_melds))
 
     @staticmethod
-    def _shantin_pinhu(partitions, called_meld_num, bonus_chrs):
-        if called_meld_num:
-            return 10
+    def _geo_vec_pinhu(p, bonus_chrs):
+        geo_vec = [0] * 6
 
-        def geo_vec_pinhu(p):
-            geo_vec = [0] * 6
+        def incre(set_type):
+            geo_vec[set_type] += 1
 
-            def incre(set_type):
-                geo_vec[set_type] += 1
+        for m in p:
+            len(m) == 1 and incre(0)
+            len(m) == 2 and abs(m[0] - m[1]) == 0 and m[0] not in bonus_chrs and incre(3)
+            len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
+            len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
+            len(m) == 3 and incre(5 if m[0] == m[1] else 4)
 
-            for m in p:
-                len(m) == 1 and incre(0)
-                len(m) == 2 and abs(m[0] - m[1]) == 0 and m[0] not in bonus_chrs and incre(3)
-                len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
-                len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
-                len(m) == 3 and incre(5 if m[0] == m[1] else 4)
+        return geo_vec
 
-            return geo_vec
-
-        def shantin_ph(p):
-            geo = geo_vec_pinhu(p)
-            need_chow = 4 - geo[4]
-            if geo[1] + geo[2] >= need_chow:
-                return (geo[3] == 0) + need_chow - 1 + (geo[2] == 0)
-            else:
-                return (geo[3] == 0) + need_chow - 1 + need_chow - geo[1] - geo[2]
+    @staticmethod
+    def _shantin_pinhu_geo(geo):
+        need_chow = 4 - geo[4]
+        if geo[1] + geo[2] >= need_chow:
+            return (geo[3] == 0) + need_chow - 1 + (geo[2] == 0)
+        else:
+            return (geo[3] == 0) + need_chow - 1 + need_chow - geo[1] - geo[2]
 
-        return min(shantin_ph(p) for p in partitions)
+    @staticmethod
+    def _shantin_pinhu(partitions, called_meld_num, bonus_chrs):
+        if called_meld_num:
+            return 10
+        return min(Partition._shantin_pinhu_geo(Partition._geo_vec_pinhu(p, bonus_chrs)) for p in partitions)
 
     @staticmethod
     def shantin_no_triplets(tiles34, called_melds, bonus_chrs):
@@ -523,54 +1196,53 @@ class Partition:
         return Partition._shantin_pinhu(partitions, len(called_melds), bonus_chrs)
 
     @staticmethod
-    def _shantin_no19(partitions, called_melds):
-        for m in called_melds:
-            if any(tile in Tile.ONENINE for tile in m):
-                return 10
+    def _geo_vec_no19(p):
+        geo_vec = [0] * 6
+
+        def incre(set_type):
+            geo_vec[set_type] += 1
 
-        def geo_vec_no19(p):
-            geo_vec = [0] * 6
+        for m in p:
+            if m[0] > 26:
+                continue
+            len(m) == 1 and 0 < m[0] % 9 < 8 and incre(0)
+            len(m) == 2 and abs(m[0] - m[1]) == 0 and 0 < m[0] % 9 < 8 and incre(3)
+            len(m) == 2 and abs(m[0] - m[1]) == 1 and m[0] % 9 > 1 and m[1] % 9 < 7 and incre(2)
+            len(m) == 2 and abs(m[0] - m[1]) == 1 and (m[0] % 9 == 1 or m[1] % 9 == 7) and incre(1)
+            len(m) == 2 and abs(m[0] - m[1]) == 2 and m[0] % 9 > 0 and m[1] % 9 < 8 and incre(1)
+            len(m) == 3 and m[0] == m[1] and 0 < m[0] % 9 < 8 and incre(5)
+            len(m) == 3 and m[0] != m[1] and incre(4 if m[0] % 9 > 0 and m[2] % 9 < 8 else 1)
 
-            def incre(set_type):
-                geo_vec[set_type] += 1
+        return geo_vec
 
-            for m in p:
-                if m[0] > 26:
-                    continue
-                len(m) == 1 and 0 < m[0] % 9 < 8 and incre(0)
-                len(m) == 2 and abs(m[0] - m[1]) == 0 and 0 < m[0] % 9 < 8 and incre(3)
-                len(m) == 2 and abs(m[0] - m[1]) == 1 and m[0] % 9 > 1 and m[1] % 9 < 7 and incre(2)
-                len(m) == 2 and abs(m[0] - m[1]) == 1 and (m[0] % 9 == 1 or m[1] % 9 == 7) and incre(1)
-                len(m) == 2 and abs(m[0] - m[1]) == 2 and m[0] % 9 > 0 and m[1] % 9 < 8 and incre(1)
-                len(m) == 3 and m[0] == m[1] and 0 < m[0] % 9 < 8 and incre(5)
-                len(m) == 3 and m[0] != m[1] and incre(4 if m[0] % 9 > 0 and m[2] % 9 < 8 else 1)
-
-            return geo_vec
-
-        def shantin_no19(p):
-            geo_vec = geo_vec_no19(p)
-            needed_set = (4 - len(called_melds)) - geo_vec[4] - geo_vec[5]
-            if geo_vec[3] > 0:
-                if geo_vec[1] + geo_vec[2] + geo_vec[3] - 1 >= needed_set:
-                    return needed_set - 1
+    @staticmethod
+    def _shantin_no19_geo(geo_vec, called_meld_num):
+        needed_set = (4 - called_meld_num) - geo_vec[4] - geo_vec[5]
+        if geo_vec[3] > 0:
+            if geo_vec[1] + geo_vec[2] + geo_vec[3] - 1 >= needed_set:
+                return needed_set - 1
+            else:
+                need_single = needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1)
+                if geo_vec[0] >= need_single:
+                    return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1
                 else:
-                    need_single = needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1)
-                    if geo_vec[0] >= need_single:
-                        return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1
-                    else:
-                        return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1 + need_single - geo_vec[
-                            0]
+                    return 2 * needed_set - (geo_vec[1] + geo_vec[2] + geo_vec[3] - 1) - 1 + need_single - geo_vec[0]
+        else:
+            if geo_vec[1] + geo_vec[2] >= needed_set:
+                return needed_set + (geo_vec[0] == 0)
             else:
-                if geo_vec[1] + geo_vec[2] >= needed_set:
-                    return needed_set + (geo_vec[0] == 0)
+                need_single = needed_set - (geo_vec[1] + geo_vec[2]) + 1
+                if geo_vec[0] >= need_single:
+                    return 2 * needed_set - (geo_vec[1] + geo_vec[2])
                 else:
-                    need_single = needed_set - (geo_vec[1] + geo_vec[2]) + 1
-                    if geo_vec[0] >= need_single:
-                        return 2 * needed_set - (geo_vec[1] + geo_vec[2])
-                    else:
-                        return 2 * needed_set - (geo_vec[1] + geo_vec[2]) + need_single - geo_vec[0]
+                    return 2 * needed_set - (geo_vec[1] + geo_vec[2]) + need_single - geo_vec[0]
 
-        return min(shantin_no19(p) for p in partitions)
+    @staticmethod
+    def _shantin_no19(partitions, called_melds):
+        for m in called_melds:
+            if any(tile in Tile.ONENINE for tile in m):
+                return 10
+        return min(Partition._shantin_no19_geo(Partition._geo_vec_no19(p), len(called_melds)) for p in partitions)
 
     @staticmethod
     def shantin_no_19(tiles34, called_melds):
@@ -599,10 +1271,14 @@ class Partition:
         :return:
             The shantin of pph form
         """
+        return Partition._shantin_no_sequences_counts(Partition._counts34(tiles34), called_melds)
+
+    @staticmethod
+    def _shantin_no_sequences_counts(counts, called_melds):
         if any(len(m) > 1 and m[0] != m[1] for m in called_melds):
             return 10
-        num_kezi = len([tile for tile in set(tiles34) if tiles34.count(tile) == 3])
-        num_pair = len([tile for tile in set(tiles34) if tiles34.count(tile) == 2])
+        num_kezi = counts.count(3)
+        num_pair = counts.count(2)
         need_kezi = 4 - len(called_melds) - num_kezi
         return (need_kezi - 1) if (num_pair >= need_kezi + 1) else (2 * need_kezi - num_pair)
 
@@ -618,14 +1294,24 @@ class Partition:
         :return:
             The shantin of form "Seven pairs"
         """
+        return Partition._shantin_seven_pairs_counts(Partition._counts34(tiles34), called_melds)
+
+    @staticmethod
+    def _shantin_seven_pairs_counts(counts, called_melds):
         if len(called_melds) > 0:
             return 10
         else:
-            num_pair = len([tile for tile in set(tiles34) if tiles34.count(tile) >= 2])
+            num_pair = len([c for c in counts if c >= 2])
             return 6 - num_pair
 
     @staticmethod
-    def _shantin_pure_color(tiles34, called_melds, partitions):
+    def _pure_color_types(type_geo, called_melds):
+        """
+        Decide which number type(s) a "pure color" hand should be built with.
+        :param type_geo: the numbers of man, pin and suo tiles in hand
+        :param called_melds: the ever called melds
+        :return: a list of candidate types (0 man, 1 pin, 2 suo), empty if the form is not reachable any more
+        """
         qh_type = []
 
         if len(called_melds) > 0:
@@ -636,72 +1322,76 @@ class Partition:
                 if m[0] // 9 not in meld_types:
                     meld_types.append(m[0] // 9)
             if len(meld_types) > 1:
-                return 10
+                return []
             else:
                 qh_type = meld_types
 
         if (len(qh_type) == 0 and len(called_melds) > 0) or len(called_melds) == 0:
-            type_geo = [
-                len([t for t in tiles34 if 0 <= t < 9]),
-                len([t for t in tiles34 if 9 <= t < 18]),
-                len([t for t in tiles34 if 18 <= t < 27])
-            ]
             max_num = max(type_geo)
             qh_type = [i for i in range(3) if type_geo[i] == max_num]
 
-        if len(qh_type) == 0:
-            return 10
+        return qh_type
 
-        def geo_vec_qh(p, tp):
-            allowed_types = [tp, 3]
-            geo_vec = [0] * 6
-
-            def incre(set_type):
-                geo_vec[set_type] += 1
-
-            for m in p:
-                if m[0] // 9 in allowed_types:
-                    len(m) == 1 and incre(0)
-                    len(m) == 2 and abs(m[0] - m[1]) == 0 and incre(3)
-                    len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
-                    len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
-                    len(m) == 3 and incre(5 if m[0] == m[1] else 4)
-            return geo_vec
-
-        def shantin_n(p, tp):
-            geo_vec = geo_vec_qh(p, tp)
-            # print(geo_vec)
-            s, p, o, f = geo_vec[0], geo_vec[3], geo_vec[1] + geo_vec[2], geo_vec[4] + geo_vec[5]
-            if p > 0:
-                p -= 1
-                st = 0
-                needed_set = 3 - len(called_melds) - f
-                while needed_set > 0:
-                    if o > 0:
-                        needed_set, o, st = needed_set - 1, o - 1, st + 1
-                    elif p > 0:
-                        needed_set, p, st = needed_set - 1, p - 1, st + 1
-                    elif s > 0:
-                        needed_set, st, s = needed_set - 1, st + 2, s - 1
-                    else:
-                        needed_set, st = needed_set - 1, st + 3
-                return st if (o + p) > 0 else (st + 1 if s > 0 else st + 2)
-            else:
-                st = 0
-                needed_set = 4 - len(called_melds) - f
-                while needed_set > 0:
-                    if o > 0:
-                        needed_set, o, st = needed_set - 1, o - 1, st + 1
-                    elif s > 0:
-                        needed_set, st, s = needed_set - 1, st + 2, s - 1
-                    else:
-                        needed_set, st = needed_set - 1, st + 3
-                return st if s > 0 else st + 1
+    @staticmethod
+    def _geo_vec_qh(p, tp):
+        allowed_types = [tp, 3]
+        geo_vec = [0] * 6
+
+        def incre(set_type):
+            geo_vec[set_type] += 1
 
-        def shantin_qh(p):
-            return min([shantin_n(p, t) for t in qh_type])
+        for m in p:
+            if m[0] // 9 in allowed_types:
+                len(m) == 1 and incre(0)
+                len(m) == 2 and abs(m[0] - m[1]) == 0 and incre(3)
+                len(m) == 2 and abs(m[0] - m[1]) == 1 and incre(2 if m[0] % 9 > 0 and m[1] % 9 < 8 else 1)
+                len(m) == 2 and abs(m[0] - m[1]) == 2 and incre(1)
+                len(m) == 3 and incre(5 if m[0] == m[1] else 4)
+        return geo_vec
 
-        return min([shantin_qh(p) for p in partitions])
+    @staticmethod
+    def _shantin_pure_color_geo(geo_vec, called_meld_num):
+        s, p, o, f = geo_vec[0], geo_vec[3], geo_vec[1] + geo_vec[2], geo_vec[4] + geo_vec[5]
+        if p > 0:
+            p -= 1
+            st = 0
+            needed_set = 3 - called_meld_num - f
+            while needed_set > 0:
+                if o > 0:
+                    needed_set, o, st = needed_set - 1, o - 1, st + 1
+                elif p > 0:
+                    needed_set, p, st = needed_set - 1, p - 1, st + 1
+                elif s > 0:
+                    needed_set, st, s = needed_set - 1, st + 2, s - 1
+                else:
+                    needed_set, st = needed_set - 1, st + 3
+            return st if (o + p) > 0 else (st + 1 if s > 0 else st + 2)
+        else:
+            st = 0
+            needed_set = 4 - called_meld_num - f
+            while needed_set > 0:
+                if o > 0:
+                    needed_set, o, st = needed_set - 1, o - 1, st + 1
+                elif s > 0:
+                    needed_set, st, s = needed_set - 1, st + 2, s - 1
+                else:
+                    needed_set, st = needed_set - 1, st + 3
+            return st if s > 0 else st + 1
+
+    @staticmethod
+    def _shantin_pure_color(tiles34, called_melds, partitions):
+        type_geo = [
+            len([t for t in tiles34 if 0 <= t < 9]),
+            len([t for t in tiles34 if 9 <= t < 18]),
+            len([t for t in tiles34 if 18 <= t < 27])
+        ]
+        qh_type = Partition._pure_color_types(type_geo, called_melds)
+
+        if len(qh_type) == 0:
+            return 10
+
+        return min([Partition._shantin_pure_color_geo(Partition._geo_vec_qh(p, t), len(called_melds))
+                    for p in partitions for t in qh_type])
 
     @staticmethod
     def shantin_pure_color(tiles34, called_melds):
@@ -719,7 +1409,7 @@ class Partition:
         return Partition._shantin_pure_color(tiles34, called_melds, partitions)
 
     @staticmethod
-    def shantin_multiple_forms(tiles34, called_melds, bonus_chrs):
+    def shantin_multiple_forms(tiles34, called_melds, bonus_chrs, engine="partition"):
         """
         Calculate shantin of different forms.
         It's an assemble of the various single shantin calculation function
@@ -729,9 +1419,15 @@ class Partition:
             The ever called melds
         :param bonus_chrs:
             A list of bonus character tiles
+        :param engine:
+            "partition" or "table", see shantin_normal(...)
         :return:
             A dictionary, which has the special form name as key and the corresponding shantin as value
         """
+        if engine == "table":
+            counts = Partition._counts34(tiles34)
+            suit_geos = [Partition._suit_geo_vecs(counts[i * 9:(i + 1) * 9]) for i in range(3)]
+            return Partition._shantin_forms_table(counts, suit_geos, called_melds, bonus_chrs)
         res = {}
         partitions = Partition.partition(tiles34)
         res["normal______"] = Partition._shantin_normal(partitions, len(called_melds))
@@ -742,8 +1438,815 @@ class Partition:
         res["pure_color__"] = Partition._shantin_pure_color(tiles34, called_melds, partitions)
         return res
 
+    @staticmethod
+    def ukeire(tiles34, called_melds, bonus_chrs, revealed=None):
+        """
+        Find the tiles which lower the shantin of each form, and count how many copies of them are still live.
+        See HandTracker.ukeire(...)
+        :param tiles34:
+            A list of tiles in 34-form
+        :param called_melds:
+            The ever called melds
+        :param bonus_chrs:
+            A list of bonus character tiles
+        :param revealed:
+            A list of 34 integers, the number of revealed copies of each tile, e.g. discards and called melds
+        :return:
+            A dictionary, key=form name, value=a dict {"shantin": shantin, "tiles": {tile: live copies}, "live": total}
+        """
+        return HandTracker(tiles34, called_melds, bonus_chrs).ukeire(revealed)
+
+    @staticmethod
+    def discard_evaluation(tiles34, called_melds, bonus_chrs, revealed=None):
+        """
+        Evaluate every distinct discard of a hand with 14 tiles (including the called melds) in one pass.
+        See HandTracker.discard_evaluation(...)
+        :param tiles34:
+            A list of tiles in 34-form
+        :param called_melds:
+            The ever called melds
+        :param bonus_chrs:
+            A list of bonus character tiles
+        :param revealed:
+            A list of 34 integers, the number of revealed copies of each tile, e.g. discards and called melds
+        :return:
+            A dictionary, key=discarded tile, value=the ukeire(...) result of the hand after discarding it
+        """
+        return HandTracker(tiles34, called_melds, bonus_chrs).discard_evaluation(revealed)
+
+    @staticmethod
+    def _suit_geo_arrays(suit_keys):
+        """
+        Gather the per-suit table entries of many suits into arrays.
+        :param suit_keys: 1d array of suit keys, see Tile.pack_counts(...)
+        :return: a list of 4 tuples (geo vectors, lengths) for the forms normal, no_triplets, no_19 and pure_color,
+            see _suit_geo_vecs(...). The geo vectors have the shape (len(suit_keys), K, 6), suits with less than K geo
+            vectors are padded with copies of their first one, which leaves the minima unchanged. The lengths tell
+            the number of geo vectors of each suit before padding.
+        """
+        uniq, inv = np.unique(suit_keys, return_inverse=True)
+        inv = inv.reshape(-1)
+        entries = [Partition._suit_entry(int(key)) for key in uniq]
+        arrays = []
+        for form in range(4):
+            k = max(len(e[form]) for e in entries)
+            geo = np.array([list(e[form]) + [e[form][0]] * (k - len(e[form])) for e in entries], dtype=np.int64)
+            lens = np.array([len(e[form]) for e in entries], dtype=np.int64)
+            arrays.append((geo[inv], lens[inv]))
+        return arrays
+
+    @staticmethod
+    def _shantin_pure_color_geo_np(geo, called_meld_num):
+        s, p, o, f = geo[..., 0], geo[..., 3], geo[..., 1] + geo[..., 2], geo[..., 4] + geo[..., 5]
+        # with a pair: use two-sided melds first, then pairs, then singles, each missing meld costs 3
+        needed = np.maximum(3 - called_meld_num - f, 0)
+        p1 = np.maximum(p - 1, 0)
+        use_o = np.minimum(o, needed)
+        use_p = np.minimum(p1, needed - use_o)
+        use_s = np.minimum(s, needed - use_o - use_p)
+        st = use_o + use_p + 2 * use_s + 3 * (needed - use_o - use_p - use_s)
+        with_pair = np.where((o - use_o + p1 - use_p) > 0, st, np.where(s - use_s > 0, st + 1, st + 2))
+        # without a pair
+        needed = np.maximum(4 - called_meld_num - f, 0)
+        use_o = np.minimum(o, needed)
+        use_s = np.minimum(s, needed - use_o)
+        st = use_o + 2 * use_s + 3 * (needed - use_o - use_s)
+        without_pair = np.where(s - use_s > 0, st, st + 1)
+        return np.where(p > 0, with_pair, without_pair)
+
+    @staticmethod
+    def _shantin_forms_batch_chunk(counts, called_meld_num, has_19_meld, has_chow_meld, meld_type, bonus_mask):
+        n = counts.shape[0]
+        cm = called_meld_num
+        suit_keys = (counts[:, :27].reshape(n, 3, 9) << (Tile.PACK_BITS * np.arange(9))).sum(axis=2)
+        geo_n, geo_ph, geo_19, geo_qh = [(geo.reshape(n, 3, geo.shape[1], 6), lens.reshape(n, 3))
+                                         for geo, lens in Partition._suit_geo_arrays(suit_keys.reshape(-1))]
+
+        chrs = counts[:, 27:34]
+        chr_geo = np.zeros((n, 6), dtype=np.int64)
+        chr_geo[:, 0] = (chrs == 1).sum(axis=1)
+        chr_geo[:, 3] = (chrs == 2).sum(axis=1)
+        chr_geo[:, 5] = (chrs == 3).sum(axis=1)
+        chr_geo_ph = chr_geo.copy()
+        chr_geo_ph[:, 3] = ((chrs == 2) & ~bonus_mask).sum(axis=1)
+
+        def combine_min(geo_lens, base, shantin):
+            # sum up one geo vector of each suit for all combinations, and take the least shantin of each hand,
+            # hands are grouped by their largest number of geo vectors to keep the padding small
+            geo, lens = geo_lens
+            res = np.zeros(n, dtype=np.int64)
+            k_max = lens.max(axis=1)
+            for k in np.unique(k_max):
+                rows = np.nonzero(k_max == k)[0]
+                g = geo[rows, :, :k]
+                g = g[:, 0, :, None, None, :] + g[:, 1, None, :, None, :] + g[:, 2, None, None, :, :]
+                g = g.reshape(len(rows), -1, 6) + base[rows, None, :]
+                res[rows] = shantin(g, cm[rows, None]).min(axis=1)
+            return res
+
+        def shantin_normal(g, c):
+            needed = (4 - c) - g[..., 4] - g[..., 5]
+            o, p = g[..., 1] + g[..., 2], g[..., 3]
+            return np.where(p > 0,
+                            np.where(o + p - 1 >= needed, needed - 1, 2 * needed - (o + p - 1) - 1),
+                            np.where(o >= needed, needed, 2 * needed - o))
+
+        def shantin_pinhu(g, c):
+            need_chow = 4 - g[..., 4]
+            return np.where(g[..., 1] + g[..., 2] >= need_chow,
+                            (g[..., 3] == 0) + need_chow - 1 + (g[..., 2] == 0),
+                            (g[..., 3] == 0) + need_chow - 1 + need_chow - g[..., 1] - g[..., 2])
+
+        def shantin_no19(g, c):
+            needed = (4 - c) - g[..., 4] - g[..., 5]
+            s, o, p = g[..., 0], g[..., 1] + g[..., 2], g[..., 3]
+            need_single = needed - (o + p - 1)
+            with_pair = np.where(o + p - 1 >= needed, needed - 1,
+                                 2 * needed - (o + p - 1) - 1 + np.maximum(need_single - s, 0))
+            need_single = needed - o + 1
+            without_pair = np.where(o >= needed, needed + (s == 0), 2 * needed - o + np.maximum(need_single - s, 0))
+            return np.where(p > 0, with_pair, without_pair)
+
+        res = np.zeros((n, 6), dtype=np.int64)
+        res[:, 0] = combine_min(geo_n, chr_geo, shantin_normal)
+        res[:, 1] = np.where(cm > 0, 10, combine_min(geo_ph, chr_geo_ph, shantin_pinhu))
+        res[:, 2] = np.where(has_19_meld, 10, combine_min(geo_19, np.zeros((n, 6), dtype=np.int64), shantin_no19))
+
+        need_kezi = 4 - cm - (counts == 3).sum(axis=1)
+        num_pair = (counts == 2).sum(axis=1)
+        st = np.where(num_pair >= need_kezi + 1, need_kezi - 1, 2 * need_kezi - num_pair)
+        res[:, 3] = np.where(has_chow_meld, 10, st)
+
+        res[:, 4] = np.where(cm > 0, 10, 6 - (counts >= 2).sum(axis=1))
+
+        geo, _ = geo_qh
+        st = Partition._shantin_pure_color_geo_np(geo + chr_geo[:, None, None, :], cm[:, None, None]).min(axis=2)
+        type_geo = counts[:, :27].reshape(n, 3, 9).sum(axis=2)
+        allowed = np.where((meld_type >= 0)[:, None], np.arange(3)[None, :] == meld_type[:, None],
+                           type_geo == type_geo.max(axis=1)[:, None])
+        allowed &= (meld_type != -2)[:, None]
+        res[:, 5] = np.where(allowed, st, 10).min(axis=1)
+        return res
+
+    @staticmethod
+    def shantin_multiple_forms_batch(counts, called_melds, bonus_chrs=None, chunk_size=4096):
+        """
+        Calculate shantin of different forms for many hands at once.
+        The per-suit table entries of all hands are gathered into arrays and the forms are evaluated with vectorized
+        operations, the results are the same as shantin_multiple_forms(...) for each hand.
+        :param counts:
+            An array of shape (N, 34), the count vectors of N hands
+        :param called_melds:
+            Either an array of N integers, the numbers of called melds, or a sequence of N lists of called melds.
+            If only the numbers are given, the melds are assumed not to rule out the forms no_19, no_sequences and
+            pure_color, since these forms depend on the tiles of the melds.
+        :param bonus_chrs:
+            None, a list of bonus character tiles shared by all hands, or a sequence of N such lists
+        :param chunk_size:
+            Number of hands evaluated together, bounds the memory used
+        :return:
+            An array of shape (N, 6), the columns follow Partition.form_names
+        """
+        counts = np.asarray(counts, dtype=np.int64).reshape(-1, 34)
+        n = counts.shape[0]
+        called_melds = list(called_melds) if not isinstance(called_melds, np.ndarray) else called_melds
+        has_19_meld = np.zeros(n, dtype=bool)
+        has_chow_meld = np.zeros(n, dtype=bool)
+        meld_type = np.full(n, -1, dtype=np.int64)
+        if n > 0 and not np.isscalar(called_melds[0]) and not isinstance(called_melds[0], np.integer):
+            called_meld_num = np.array([len(ms) for ms in called_melds], dtype=np.int64)
+            for i, ms in enumerate(called_melds):
+                has_19_meld[i] = any(tile in Tile.ONENINE for m in ms for tile in m)
+                has_chow_meld[i] = any(len(m) > 1 and m[0] != m[1] for m in ms)
+                types = set(m[0] // 9 for m in ms if m[0] // 9 != 3)
+                meld_type[i] = -2 if len(types) > 1 else (types.pop() if types else -1)
+        else:
+            called_meld_num = np.asarray(called_melds, dtype=np.int64).reshape(n)
+
+        bonus_mask = np.zeros((n, 7), dtype=bool)
+        if bonus_chrs is not None:
+            if len(bonus_chrs) == n and n > 0 and not np.isscalar(bonus_chrs[0]):
+                for i, bcs in enumerate(bonus_chrs):
+                    bonus_mask[i, [t - 27 for t in bcs if t >= 27]] = True
+            else:
+                bonus_mask[:, [t - 27 for t in bonus_chrs if t >= 27]] = True
+
+        res = np.zeros((n, 6), dtype=np.int64)
+        for lo in range(0, n, chunk_size):
+            hi = min(lo + chunk_size, n)
+            res[lo:hi] = Partition._shantin_forms_batch_chunk(counts[lo:hi], called_meld_num[lo:hi],
+                                                              has_19_meld[lo:hi], has_chow_meld[lo:hi],
+                                                              meld_type[lo:hi], bonus_mask[lo:hi])
+        return res
+
+
+class HandTracker:
+    """
+        Keep the shantin of all forms of Partition.shantin_multiple_forms(...) up to date, while the hand changes by one
+        tile at each step. Besides the count vector of the hand, the tracker keeps the per-suit table entries of man, pin
+        and suo, so that add(...) and remove(...) only look up the suit of the added or removed tile again.
+        For example:
+            tracker = HandTracker([0, 0, 1, 2, 3, 14, 14, 14, 15, 27, 27, 28, 28], [], [27])
+            tracker.add(16)
+            tracker.remove(27)
+            print(tracker.shantin["normal______"])
+    """
+
+    def __init__(self, tiles34=(), called_melds=(), bonus_chrs=()):
+        """
+        To initialise a tracker.
+        :param tiles34: the tiles in hand in 34-form
+        :param called_melds: the ever called melds
+        :param bonus_chrs: a list of bonus character tiles
+        """
+        self.counts = Partition._counts34(tiles34)
+        self.called_melds = [list(m) for m in called_melds]
+        self.bonus_chrs = list(bonus_chrs)
+        self.suit_keys = Tile.suit_subkeys(Tile.pack_counts(self.counts))[:3]
+        self.suit_geos = [Partition._suit_entry(k) for k in self.suit_keys]
+        self.shantin = None
+        self._update()
+
+    @property
+    def tiles34(self):
+        """
+        Getter: the tiles in hand
+        :return: a sorted list of tiles in 34-form
+        """
+        return [t for t in range(34) for _ in range(self.counts[t])]
+
+    def _update(self):
+        self.shantin = Partition._shantin_forms_table(self.counts, self.suit_geos, self.called_melds, self.bonus_chrs)
+
+    def _update_suit(self, tile, delta):
+        if tile < 27:
+            tp = tile // 9
+            self.suit_keys[tp] += delta << (3 * (tile - tp * 9))
+            self.suit_geos[tp] = Partition._suit_entry(self.suit_keys[tp])
+        self._update()
+
+    def add(self, tile):
+        """
+        Add a tile to the hand, e.g. a drawn tile.
+        :param tile: a tile in 34-form
+        :return: the updated dictionary of shantin, see Partition.shantin_multiple_forms(...)
+        """
+        if self.counts[tile] >= 4:
+            raise ValueError("All four copies of tile {} are already in hand".format(tile))
+        self.counts[tile] += 1
+        self._update_suit(tile, 1)
+        return self.shantin
+
+    def remove(self, tile):
+        """
+        Remove a tile from the hand, e.g. a discarded tile.
+        :param tile: a tile in 34-form
+        :return: the updated dictionary of shantin, see Partition.shantin_multiple_forms(...)
+        """
+        if self.counts[tile] == 0:
+            raise ValueError("Tile {} is not in hand".format(tile))
+        self.counts[tile] -= 1
+        self._update_suit(tile, -1)
+        return self.shantin
+
+    def ukeire(self, revealed=None):
+        """
+        Find the tiles which lower the shantin of each form, and count how many copies of them are still live.
+        Drawing a tile only changes the table entry of its own suit, so the entries of the other suits are shared by
+        all 34 candidate tiles.
+        :param revealed: a list of 34 integers, the number of revealed copies of each tile, e.g. discards and called
+            melds. Tiles in hand are counted by the tracker itself.
+        :return: a dict, key=form name, value=a dict
+                res[form]["shantin"] = integer, the current shantin of the form
+                res[form]["tiles"] = a dict, key=effective tile, value=number of its live copies
+                res[form]["live"] = integer, the total number of live copies of the effective tiles
+        """
+        return self._ukeire(self.shantin, revealed, {}, [], None)
+
+    def _ukeire(self, current, revealed, drawn, shared_suits, memo):
+        """
+        :param current: the current dictionary of shantin
+        :param revealed: see ukeire(...)
+        :param drawn: a dict, key=tile, value=table entry of its suit after drawing it, for tiles of shared_suits
+        :param shared_suits: the suits whose table entries after drawing a tile are read from and stored in drawn
+        :param memo: see Partition._shantin_forms_table(...)
+        :return: see ukeire(...)
+        """
+        res = {form: {"shantin": st, "tiles": {}, "live": 0} for form, st in current.items()}
+        for tile in range(34):
+            if self.counts[tile] >= 4:
+                continue
+            self.counts[tile] += 1
+            suit_geos = self.suit_geos
+            if tile < 27:
+                tp = tile // 9
+                suit_geos = list(self.suit_geos)
+                if tp in shared_suits and tile in drawn:
+                    suit_geos[tp] = drawn[tile]
+                else:
+                    suit_geos[tp] = Partition._suit_entry(self.suit_keys[tp] + (1 << (3 * (tile - tp * 9))))
+                    if tp in shared_suits:
+                        drawn[tile] = suit_geos[tp]
+            shantin = Partition._shantin_forms_table(self.counts, suit_geos, self.called_melds, self.bonus_chrs, memo)
+            self.counts[tile] -= 1
+            live = max(0, 4 - self.counts[tile] - (revealed[tile] if revealed else 0))
+            for form, st in shantin.items():
+                if st < res[form]["shantin"]:
+                    res[form]["tiles"][tile] = live
+                    res[form]["live"] += live
+        return res
+
+    def discard_evaluation(self, revealed=None):
+        """
+        Evaluate every distinct discard of the hand, usually a hand of 14 tiles right after drawing.
+        All discards share one pass: the table entries of the suits that a discard does not touch are kept, the
+        entries of a suit after drawing a tile are reused by all discards of the other suits, and the shantin of the
+        table driven forms is memoized, since many discard and draw pairs lead to equal table entries, e.g. discarding
+        either of two isolated tiles.
+        :param revealed: see ukeire(...)
+        :return: a dict, key=discarded tile, value=the ukeire(...) result of the hand after discarding it
+        """
+        res = {}
+        drawn = {}
+        memo = {}
+        full_geos = self.suit_geos
+        for tile in range(34):
+            if self.counts[tile] == 0:
+                continue
+            self.counts[tile] -= 1
+            self.suit_geos = list(full_geos)
+            shared_suits = [0, 1, 2]
+            if tile < 27:
+                tp = tile // 9
+                self.suit_keys[tp] -= 1 << (3 * (tile - tp * 9))
+                self.suit_geos[tp] = Partition._suit_entry(self.suit_keys[tp])
+                shared_suits.remove(tp)
+            current = Partition._shantin_forms_table(self.counts, self.suit_geos, self.called_melds, self.bonus_chrs,
+                                                     memo)
+            res[tile] = self._ukeire(current, revealed, drawn, shared_suits, memo)
+            self.counts[tile] += 1
+            if tile < 27:
+                self.suit_keys[tile // 9] += 1 << (3 * (tile % 9))
+        self.suit_geos = full_geos
+        return res
+
+    def set_called_melds(self, called_melds):
+        """
+        Replace the called melds, e.g. after a pon or chow. The tiles taken from hand must be removed separately.
+        :param called_melds: the ever called melds
+        :return: the updated dictionary of shantin, see Partition.shantin_multiple_forms(...)
+        """
+        self.called_melds = [list(m) for m in called_melds]
+        self._update()
+        return self.shantin
+
+
+class ScoreEntry:
+    """
+        The score of a winning hand, as an entry of WinWaitCal.score_table. Entries are shared, thus read only.
+        Attributes:
+            score       the total points paid to the winner, without benchan and Riichi sticks
+            payments    the points paid by each losing player, (discarder,) for winning by discarded tile, otherwise
+                        one value per other player, the dealer first
+            desc        the description, e.g. 満貫2000-4000点, it is only formatted when read
+    """
+
+    __slots__ = ("score", "payments", "_desc_format", "_desc_args")
+
+    def __init__(self, score, payments, desc_format, desc_args):
+        object.__setattr__(self, "score", score)
+        object.__setattr__(self, "payments", payments)
+        object.__setattr__(self, "_desc_format", desc_format)
+        object.__setattr__(self, "_desc_args", desc_args)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ScoreEntry is read only")
+
+    def __repr__(self):
+        return "ScoreEntry({}, {}, {})".format(self.score, self.payments, self.desc)
+
+    @property
+    def desc(self):
+        return self._desc_format.format(*self._desc_args)
+
+
+class ScoreResult:
+    """
+        The result of WinWaitCal.score_calculation(...) for the best partition of a winning hand. It is read only.
+        The yaku and fu are kept as integer codes into WinWaitCal.yaku_table and WinWaitCal.fu_table, the descriptions
+        are only built when read.
+        Attributes:
+            score       the final score
+            yaku        codes of the achieved yaku, only the yakuman if there is one
+            fu_codes    codes of the fu, None for yakuman
+            partition   the best partition, a tuple of tuples
+            bonus_num   the number of bonus tiles, not counted for yakuman
+            fu_round    the rounded fu, 0 for yakuman
+            entry       the ScoreEntry of the han and fu, None for yakuman
+            maxi_score  the base score of the yakuman, 0 if there is none
+    """
+
+    __slots__ = ("score", "yaku", "fu_codes", "partition", "bonus_num", "fu_round", "entry", "maxi_score")
+
+    def __init__(self, score, yaku, fu_codes, partition, bonus_num, fu_round, entry, maxi_score):
+        for name, value in zip(self.__slots__, (score, yaku, fu_codes, tuple(tuple(m) for m in partition), bonus_num,
+                                                fu_round, entry, maxi_score)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ScoreResult is read only")
+
+    def __repr__(self):
+        return "ScoreResult({}, {})".format(self.score, self.han_desc)
+
+    @property
+    def han(self):
+        """
+        :return: a dict, key=the yaku, value=the corresponding han value, including the bonus tiles
+        """
+        han = {WinWaitCal.yaku_table[c][0]: WinWaitCal.yaku_table[c][1] for c in self.yaku}
+        if self.bonus_num > 0:
+            han["(赤/裏)ドラ({}Han)".format(self.bonus_num)] = self.bonus_num
+        return han
+
+    @property
+    def han_desc(self):
+        return " ".join(self.han)
+
+    @property
+    def fu(self):
+        """
+        :return: a dict, key=fu type, value=fu value, None for yakuman
+        """
+        if self.fu_codes is None:
+            return None
+        return {WinWaitCal.fu_table[c][0]: WinWaitCal.fu_table[c][1] for c in self.fu_codes}
+
+    @property
+    def fu_desc(self):
+        return None if self.fu_codes is None else " ".join(WinWaitCal.fu_table[c][0] for c in self.fu_codes)
+
+    @property
+    def score_desc(self):
+        if self.entry is None:
+            return "役满 {}点 {}点".format(self.maxi_score, self.score)
+        han_sum = sum(WinWaitCal.yaku_table[c][1] for c in self.yaku) + self.bonus_num
+        return "{}Fu/{}Han --> {} {}点".format(self.fu_round, han_sum, self.entry.desc, self.score)
+
+    def to_dict(self):
+        """
+        :return: the dict returned by WinWaitCal.score_calculation(...) with compact=False
+        """
+        return {"score": self.score, "score_desc": self.score_desc, "han": self.han, "han_desc": self.han_desc,
+                "fu": self.fu, "fu_desc": self.fu_desc, "partition": [list(m) for m in self.partition]}
+
 
 class WinWaitCal:
+    """
+        Class attributes (Explanation):
+            agari_table         key of a complete count vector of one suit --> its decompositions into melds and at
+                                most one pair, in the order of _parse_nums(...), the tiles are shifted to 0-8. The
+                                key is the count vector read as a number in base 5, see Tile.pack_suit(...)
+            agari_table_file    the JSON file the agari table is cached in, it is built once when missing
+            agari_table_version the version of the layout of agari_table_file, a file of another version is rebuilt
+            score_table         (han, fu, is_dealer, is_zimo) --> ScoreEntry, han from 1 to 13 where 13 stands for
+                                13 or more han, it is a read only mapping built on first use
+            score_stats         counters of score_calculation(...): partitions found by win_parse(...), partitions
+                                evaluated, duplicates skipped and partitions skipped after the yakuman cap was reached
+            yaku_table          code --> (name, han value) of every yaku and yakuman, yaku_codes maps names to codes
+            fu_table            code --> (name, fu value) of every kind of fu, fu_codes maps names to codes
+            result_cache        None, or the LRUCache of score_calculation(...) and waiting_calculation(...), see
+                                enable_result_cache(...)
+            result_cache_canonical  whether the result cache is keyed by the canonical form of the hands under suit
+                                permutations, see Tile.canonical_suits(...)
+            fu_meld_table       (meld kind, tile) --> (fu, description) of a triplet or kan, the kinds are
+                                concealed_pon, open_pon (called or completed by a discarded tile), minkan and ankan
+            chow_wait_table     (first tile of a chow, final tile) --> 0 if the final tile is not in the chow, 1 for a
+                                two-sided wait, 2 for an edge or closed wait
+    """
+
+    agari_table = None
+
+    score_table = {}
+
+    score_stats = {"partitions": 0, "evaluated": 0, "duplicates": 0, "capped": 0}
+
+    result_cache = None
+
+    result_cache_canonical = True
+
+    yaku_table = [("国士無双(Maxi)", 1), ("大三元(Maxi)", 1), ("清老頭(Maxi)", 1), ("緑一色(Maxi)", 1), ("四暗刻(Maxi)", 1),
+                  ("大四喜(Maxi)", 1), ("小四喜(Maxi)", 1), ("字一色(Maxi)", 1), ("九蓮宝燈(Maxi)", 1),
+                  ("七対子(2Han)", 2), ("立直(1Han)", 1), ("門前清自摸和(1Han)", 1), ("役牌(1Han)", 1), ("自風(1Han)", 1),
+                  ("場風(1Han)", 1), ("断幺九(1Han)", 1), ("平和(1Han)", 1), ("一気通貫(2Han)", 2), ("一気通貫(1Han)", 1),
+                  ("対々和(2Han)", 2), ("小三元(2Han)", 2), ("混老頭(2Han)", 2), ("純全帯幺九(3Han)", 3),
+                  ("純全帯幺九(2Han)", 2), ("混全帯幺九(2Han)", 2), ("混全帯幺九(1Han)", 1), ("三色同刻(2Han)", 2),
+                  ("三色同順(2Han)", 2), ("三色同順(1Han)", 1), ("三槓子(2Han)", 2), ("二盃口(3Han)", 3), ("一盃口(1Han)", 1),
+                  ("清一色(6Han)", 6), ("清一色(5Han)", 5), ("混一色(3Han)", 3), ("混一色(2Han)", 2), ("三暗刻(2Han)", 2)]
+
+    yaku_codes = {name: code for code, (name, _) in enumerate(yaku_table)}
+
+    fu_table = [("七对(25Fu)", 25), ("門前清自摸和平和(20Fu)", 20), ("非门清平和荣和(30Fu)", 30), ("幺九暗刻(8Fu)", 8),
+                ("幺九明刻(4Fu)", 4), ("中张暗刻(4Fu)", 4), ("中张明刻(2Fu)", 2), ("幺九明杠(16Fu)", 16), ("中张明杠(8Fu)", 8),
+                ("幺九暗杠(32Fu)", 32), ("中张暗杠(16Fu)", 16), ("役牌雀头(2Fu)", 2), ("自风雀头(2Fu)", 2), ("场风雀头(2Fu)", 2),
+                ("单吊(2Fu)", 2), ("边张嵌张胡牌(2Fu)", 2), ("自摸(2Fu)", 2), ("门前清荣胡(10Fu)", 10)]
+
+    fu_codes = {name: code for code, (name, _) in enumerate(fu_table)}
+
+    _cache_miss = object()
+
+    fu_meld_table = {(kind, t): fu_desc[t in Tile.ONENINE]
+                     for kind, fu_desc in [("concealed_pon", ((4, "中张暗刻(4Fu)"), (8, "幺九暗刻(8Fu)"))),
+                                           ("open_pon", ((2, "中张明刻(2Fu)"), (4, "幺九明刻(4Fu)"))),
+                                           ("minkan", ((8, "中张明杠(8Fu)"), (16, "幺九明杠(16Fu)"))),
+                                           ("ankan", ((16, "中张暗杠(16Fu)"), (32, "幺九暗杠(32Fu)")))]
+                     for t in range(34)}
+
+    chow_wait_table = {(s, t): 0 if not s <= t <= s + 2 else
+                       2 if t == s + 1 or (t == s and s % 9 == 6) or (t == s + 2 and s % 9 == 0) else 1
+                       for s in range(27) if s % 9 < 7 for t in range(34)}
+
+    agari_table_version = 2
+
+    agari_table_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "agari_table.json")
+
+    class HandFeatures:
+        """
+            Features of a winning partition together with the called melds, computed in one pass over the melds.
+            All yaku of han_calculation(...) are tested on them.
+            Attributes:
+                counts              count vector of all tiles, kans included
+                suits               bitmask of the tile types in use, 1 man, 2 pin, 4 suo, 8 characters
+                chows               bitmask of the chows in hand or called, bit t stands for the chow [t, t+1, t+2]
+                pons                tiles of the triplets and kans, in the order of the melds
+                hand_pons           tiles of the triplets in hand
+                hand_chows          chows in hand
+                pairs               tiles of the pairs in hand
+                repeated_chow       whether a chow occurs twice in hand
+                two_sided_wait      whether the final tile completes a chow in hand on its open side
+                has_non_pons        whether a meld in hand or called, kans excluded, is not a pair or triplet
+                n_19_pons           number of pairs, triplets and kans of terminal and character tiles
+                n_19_melds          number of melds containing a terminal or character tile
+                n_terminal_melds    number of melds containing a terminal tile
+        """
+
+        __slots__ = ("counts", "suits", "chows", "pons", "hand_pons", "hand_chows", "pairs", "repeated_chow",
+                     "two_sided_wait", "has_non_pons", "n_19_pons", "n_19_melds", "n_terminal_melds")
+
+        ONENINE = frozenset(Tile.ONENINE)
+
+        TERMINALS = frozenset(Tile.TERMINALS)
+
+        def __init__(self, hand_partition, final_tile, melds, minkan, ankan):
+            """
+            :param hand_partition: a partition of hand tiles
+            :param final_tile: the final tile with which the observed player has won
+            :param melds: triplets and sequences melds of the observed player
+            :param minkan: minkan melds of the observed player
+            :param ankan: ankan melds of the observed player
+            """
+            self.counts = counts = [0] * 34
+            self.chows, self.pons, self.hand_pons, self.hand_chows, self.pairs = 0, [], [], [], []
+            self.repeated_chow, self.two_sided_wait, self.has_non_pons = False, False, False
+            self.n_19_pons, self.n_19_melds, self.n_terminal_melds = 0, 0, 0
+            seen_chows = set()
+            for i, m in enumerate(hand_partition + melds + minkan + ankan):
+                in_hand, no_kan = i < len(hand_partition), i < len(hand_partition) + len(melds)
+                for t in m:
+                    counts[t] += 1
+                if any(t in self.ONENINE for t in m):
+                    self.n_19_melds += 1
+                    if any(t in self.TERMINALS for t in m):
+                        self.n_terminal_melds += 1
+                if len(m) > 1 and m[0] == m[1]:
+                    if m[0] in self.ONENINE:
+                        self.n_19_pons += 1
+                    if len(m) > 2:
+                        self.pons.append(m[0])
+                    if in_hand and len(m) == 2:
+                        self.pairs.append(m[0])
+                    if in_hand and len(m) == 3:
+                        self.hand_pons.append(m[0])
+                elif len(m) > 1 and no_kan:
+                    self.has_non_pons = True
+                    if len(m) == 3 and m[1] == m[0] + 1 and m[2] == m[0] + 2:
+                        self.chows |= 1 << m[0]
+                    if in_hand:
+                        self.repeated_chow = self.repeated_chow or tuple(m) in seen_chows
+                        seen_chows.add(tuple(m))
+                        if len(m) == 3:
+                            self.hand_chows.append(m)
+                            if (m[0] == final_tile and m[0] % 9 != 6) or (m[2] == final_tile and m[2] % 9 != 2):
+                                self.two_sided_wait = True
+            self.suits = sum(1 << i for i in range(3) if any(counts[i * 9:(i + 1) * 9])) + 8 * any(counts[27:])
+
+        def in_tiles(self, tiles):
+            """
+            :param tiles: a list of tiles in 34-form
+            :return: whether all tiles of the hand are among the given tiles
+            """
+            return all(c == 0 or t in tiles for t, c in enumerate(self.counts))
+
+    @staticmethod
+    def _parse_nums(tiles):
+        """
+        Decompose sorted tiles of one suit into melds and at most one pair, so that no tile is left.
+        :param tiles: sorted tiles of the same suit in 34-form
+        :return: a list of decompositions, None if there is none
+        """
+        if len(tiles) == 0:
+            return [[[]]]
+
+        if len(tiles) == 1:
+            return None
+
+        if len(tiles) == 2:
+            return [[tiles]] if tiles[0] == tiles[1] else None
+
+        if len(tiles) == 3:
+            ismeld = tiles[0] == tiles[1] == tiles[2] or (tiles[0] + 2) == (tiles[1] + 1) == tiles[2]
+            return [[tiles]] if ismeld else None
+
+        if len(tiles) % 3 == 1:
+            return None
+
+        res = []
+
+        if len(tiles) % 3 == 2:
+            if tiles[0] == tiles[1]:
+                rec_res = WinWaitCal._parse_nums(tiles[2:])
+                if rec_res:
+                    for partition in rec_res:
+                        res.append([tiles[0:2]] + partition)
+
+        if tiles[0] == tiles[1] == tiles[2]:
+            rec_res = WinWaitCal._parse_nums(tiles[3:])
+            if rec_res:
+                for partition in rec_res:
+                    res.append([tiles[0:3]] + partition)
+
+        if (tiles[0] + 1) in tiles and (tiles[0] + 2) in tiles:
+            remain_tiles = deepcopy(tiles)
+            remain_tiles.remove(tiles[0])
+            remain_tiles.remove(tiles[0] + 1)
+            remain_tiles.remove(tiles[0] + 2)
+            rec_res = WinWaitCal._parse_nums(remain_tiles)
+            if rec_res:
+                for partition in rec_res:
+                    res.append([[tiles[0], tiles[0] + 1, tiles[0] + 2]] + partition)
+
+        return res if len(res) > 0 else None
+
+    @staticmethod
+    def build_agari_table():
+        """
+        Enumerate every complete shape of one suit, i.e. at most one pair plus at most four melds with at most four
+        copies of each tile, and decompose it with _parse_nums(...).
+        :return: the agari table, see the class attributes
+        """
+        melds = [[i] * 3 for i in range(9)] + [[i, i + 1, i + 2] for i in range(7)]
+        shapes = {(0,) * 9}
+        for pair in range(-1, 9):
+            counts = [0] * 9
+            if pair >= 0:
+                counts[pair] = 2
+            frontier = {tuple(counts)}
+            shapes |= frontier
+            for _ in range(4):
+                next_frontier = set()
+                for shape in frontier:
+                    for meld in melds:
+                        counts = list(shape)
+                        for t in meld:
+                            counts[t] += 1
+                        if max(counts) <= 4:
+                            next_frontier.add(tuple(counts))
+                shapes |= next_frontier
+                frontier = next_frontier
+
+        table = {}
+        for shape in shapes:
+            tiles = [t for t in range(9) for _ in range(shape[t])]
+            table[Tile.pack_suit(shape)] = WinWaitCal._parse_nums(tiles)
+        return table
+
+    @staticmethod
+    def load_agari_table():
+        """
+        Load the agari table from agari_table_file, or build it and save it there if the file is missing or broken.
+        It is called by the first lookup, call it directly to pay the loading time in advance.
+        :return: the agari table
+        """
+        if WinWaitCal.agari_table is None:
+            table = None
+            try:
+                with open(WinWaitCal.agari_table_file, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == WinWaitCal.agari_table_version:
+                    table = {int(k): v for k, v in data["table"].items()}
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
+            if table is None:
+                table = WinWaitCal.build_agari_table()
+                # write to a temporary file and move it into place, so that processes building the table at the same
+                # time, e.g. the workers of a process pool, never read or leave a partly written file
+                tmp_file = None
+                try:
+                    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(WinWaitCal.agari_table_file),
+                                                    prefix=".agari_table.", suffix=".tmp")
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump({"version": WinWaitCal.agari_table_version,
+                                   "table": {str(k): v for k, v in table.items()}}, f, separators=(",", ":"))
+                    os.chmod(tmp_file, 0o644)
+                    os.replace(tmp_file, WinWaitCal.agari_table_file)
+                except OSError:
+                    if tmp_file is not None and os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+            WinWaitCal.agari_table = table
+        return WinWaitCal.agari_table
+
+    @staticmethod
+    def _parse_suit(suit_counts, base):
+        """
+        Table driven version of _parse_nums(...) for one suit.
+        Counts beyond the enumerated shapes, i.e. more than 14 tiles or more than 4 copies, are parsed directly.
+        :param suit_counts: count vector of the 9 tiles of the suit
+        :param base: the first tile of the suit in 34-form, i.e. 0, 9 or 18
+        :return: the same as _parse_nums(...) for the sorted tiles of the suit
+        """
+        if sum(suit_counts) > 14 or max(suit_counts) > 4:
+            return WinWaitCal._parse_nums([t + base for t in range(9) for _ in range(suit_counts[t])])
+        table = WinWaitCal.agari_table or WinWaitCal.load_agari_table()
+        decompositions = table.get(Tile.pack_suit(suit_counts))
+        if decompositions is None:
+            return None
+        return [[[t + base for t in m] for m in p] for p in decompositions]
+
+    @staticmethod
+    def _chrs_complete(chr_counts):
+        """
+        Whether the character tiles consist of triplets and, if their number is 3n+2, exactly one pair.
+        :param chr_counts: count vector of the 7 character tiles
+        """
+        if any(c == 1 or c == 4 for c in chr_counts):
+            return False
+        return chr_counts.count(2) == (1 if sum(chr_counts) % 3 == 2 else 0)
+
+    @staticmethod
+    def winning_tiles(hand34):
+        """
+        Find the tiles which complete the hand, i.e. for which win_parse(...) finds a partition, only using the count
+        vector of the hand and the agari table. A tile of which all four copies are in hand is not a waiting tile.
+        :param hand34: tiles in hand in 34-form, without the called melds
+        :return: a sorted list of the waiting tiles in 34-form, empty if the hand is not ready
+        """
+        if len(hand34) % 3 != 1:
+            return []
+        counts = Partition._counts34(hand34)
+        waits = set()
+
+        if len(hand34) == 13 and counts.count(2) == 6 and counts.count(1) == 1:
+            waits.add(counts.index(1))
+        if sum(counts[t] for t in Tile.ONENINE) == len(hand34):
+            missing = [t for t in Tile.ONENINE if counts[t] == 0]
+            if len(missing) == 0:
+                waits.update(Tile.ONENINE)
+            elif len(missing) == 1:
+                waits.add(missing[0])
+
+        bounds = [(0, 9), (9, 18), (18, 27), (27, 34)]
+        mods = [sum(counts[lo:hi]) % 3 for lo, hi in bounds]
+        # the drawn tile goes to a group of 3n+1 tiles, or to one of two groups of 3n+2 tiles which can hold the pair
+        if sorted(mods) == [0, 0, 0, 1]:
+            draw_groups = [mods.index(1)]
+        elif sorted(mods) == [0, 0, 2, 2]:
+            draw_groups = [g for g in range(4) if mods[g] == 2]
+        else:
+            draw_groups = []
+
+        table = WinWaitCal.agari_table or WinWaitCal.load_agari_table()
+
+        def complete(group, group_counts):
+            if group == 3:
+                return WinWaitCal._chrs_complete(group_counts)
+            if sum(group_counts) > 14 or max(group_counts) > 4:
+                return WinWaitCal._parse_nums([t for t in range(9) for _ in range(group_counts[t])]) is not None
+            return table.get(Tile.pack_suit(group_counts)) is not None
+
+        for g in draw_groups:
+            if not all(complete(o, counts[lo:hi]) for o, (lo, hi) in enumerate(bounds) if o != g):
+                continue
+            lo, hi = bounds[g]
+            group_counts = counts[lo:hi]
+            for t in range(lo, hi):
+                if counts[t] >= 4 or (counts[t] == 0 and g == 3):
+                    continue
+                group_counts[t - lo] += 1
+                if complete(g, group_counts):
+                    waits.add(t)
+                group_counts[t - lo] -= 1
+
+        return sorted(waits)
 
     @staticmethod
     def score_calculation_base(han, fu, is_dealer, is_zimo):
@@ -768,57 +2271,102 @@ class WinWaitCal:
         :return:
             a tuple (integer score, string description)
         """
+        entry = WinWaitCal.score_entry(han, fu, is_dealer, is_zimo)
+        return entry.score, entry.desc
+
+    @staticmethod
+    def score_entry(han, fu, is_dealer, is_zimo):
+        """
+        Look up the score of a hand in the score table, see score_calculation_base(...) for the parameters.
+        Combinations outside of the table, e.g. an unusual fu, are calculated directly.
+        :return: a ScoreEntry
+        """
+        if not WinWaitCal.score_table:
+            WinWaitCal.score_table = MappingProxyType(WinWaitCal.build_score_table())
+        key = (min(han, 13), fu, bool(is_dealer), bool(is_zimo))
+        entry = WinWaitCal.score_table.get(key)
+        if entry is None:
+            entry = WinWaitCal._compute_score_entry(han, fu, bool(is_dealer), bool(is_zimo))
+        return entry
+
+    @staticmethod
+    def _compute_score_entry(han, fu, is_dealer, is_zimo):
         if han == 0:
-            return 0, ''
+            return ScoreEntry(0, (), "", ())
         elif han < 5:  # when han < 5, the fu has influence on the final point
             if (fu >= 40 and han >= 4) or (fu >= 70 and han >= 3):
-                if is_dealer:
-                    return 12000, "満貫4000点∀" if is_zimo else "満貫12000点"
-                else:
-                    return 8000, "満貫2000-4000点" if is_zimo else "満貫8000点"
+                return WinWaitCal._limit_score_entry("満貫", 2000, is_dealer, is_zimo)
             base_score = fu * (2 ** (han + 2))
             if is_zimo:
                 if is_dealer:
                     each = ((base_score * 2 - 1) // 100 + 1) * 100
-                    return each * 3, "{}符{}Han{}点∀".format(fu, han, each)
+                    return ScoreEntry(each * 3, (each, each, each), "{}符{}Han{}点∀", (fu, han, each))
                 else:
                     dscore = ((base_score * 2 - 1) // 100 + 1) * 100
                     xscore = ((base_score - 1) // 100 + 1) * 100
-                    return dscore + 2 * xscore, "{}符{}Han{}-{}点".format(fu, han, xscore, dscore)
+                    return ScoreEntry(dscore + 2 * xscore, (dscore, xscore, xscore), "{}符{}Han{}-{}点",
+                                      (fu, han, xscore, dscore))
             else:
                 score = ((base_score * 6 - 1) // 100 + 1) * 100 if is_dealer else ((base_score * 4 - 1) // 100 + 1) * 100
-                return score, "{}符{}Han{}点".format(fu, han, score)
-        elif han == 5: # when han >= 5, the fu does not make any difference to final score
-            if is_dealer:
-                return 12000, "満貫4000点∀" if is_zimo else "満貫12000点"
-            else:
-                return 8000, "満貫2000-4000点" if is_zimo else "満貫8000点"
+                return ScoreEntry(score, (score,), "{}符{}Han{}点", (fu, han, score))
+        elif han == 5:  # when han >= 5, the fu does not make any difference to final score
+            return WinWaitCal._limit_score_entry("満貫", 2000, is_dealer, is_zimo)
         elif 6 <= han <= 7:
-            if is_dealer:
-                return 18000, "跳满6000点∀" if is_zimo else "跳满18000点"
-            else:
-                return 12000, "跳满3000-6000点" if is_zimo else "跳满12000点"
+            return WinWaitCal._limit_score_entry("跳满", 3000, is_dealer, is_zimo)
         elif 8 <= han <= 10:
-            if is_dealer:
-                return 24000, "倍满8000点∀" if is_zimo else "倍满24000点"
-            else:
-                return 16000, "倍满4000-8000点" if is_zimo else "倍满16000点"
+            return WinWaitCal._limit_score_entry("倍满", 4000, is_dealer, is_zimo)
         elif 11 <= han <= 12:
-            if is_dealer:
-                return 36000, "三倍满12000点∀" if is_zimo else "三倍满36000点"
-            else:
-                return 24000, "三倍满6000-12000点" if is_zimo else "三倍满24000点"
+            return WinWaitCal._limit_score_entry("三倍满", 6000, is_dealer, is_zimo)
         else:
-            if is_dealer:
-                return 48000, "役满16000点∀" if is_zimo else "役满48000点"
-            else:
-                return 32000, "役满8000-16000点" if is_zimo else "役满32000点"
+            return WinWaitCal._limit_score_entry("役满", 8000, is_dealer, is_zimo)
+
+    @staticmethod
+    def _limit_score_entry(name, base_point, is_dealer, is_zimo):
+        """
+        :param name: name of the limit, e.g. 満貫
+        :param base_point: what a non-dealer pays to a non-dealer winning by self drawn tile
+        """
+        if is_dealer:
+            if is_zimo:
+                return ScoreEntry(base_point * 6, (base_point * 2,) * 3, "{}{}点∀", (name, base_point * 2))
+            return ScoreEntry(base_point * 6, (base_point * 6,), "{}{}点", (name, base_point * 6))
+        if is_zimo:
+            return ScoreEntry(base_point * 4, (base_point * 2, base_point, base_point), "{}{}-{}点",
+                              (name, base_point, base_point * 2))
+        return ScoreEntry(base_point * 4, (base_point * 4,), "{}{}点", (name, base_point * 4))
+
+    @staticmethod
+    def build_score_table():
+        """
+        Calculate the scores of all hands with 1 to 13 han, with any fu that fu_calculation(...) can deliver.
+        :return: the score table, see the class attributes
+        """
+        return {(han, fu, is_dealer, is_zimo): WinWaitCal._compute_score_entry(han, fu, is_dealer, is_zimo)
+                for han in range(1, 14) for fu in [20, 25] + list(range(30, 140, 10))
+                for is_dealer in (False, True) for is_zimo in (False, True)}
+
+    @staticmethod
+    def _chow_wait_class(chow, final_tile):
+        """
+        :param chow: a chow in 34-form
+        :param final_tile: the final tile with which the observed player has won
+        :return: 0 if the final tile is not in the chow, 1 if it completes a two-sided wait, 2 for an edge or closed wait
+        """
+        if chow[1] == chow[0] + 1 and chow[2] == chow[0] + 2:
+            return WinWaitCal.chow_wait_table[chow[0], final_tile]
+        if final_tile not in chow:
+            return 0
+        if chow[1] == final_tile or (chow[0] == final_tile and chow[2] % 9 == 8) or \
+                (chow[2] == final_tile and chow[0] % 9 == 0):
+            return 2
+        return 1
 
     @staticmethod
     def fu_calculation(hand_partition, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind):
         """
         Calculate the Fu of the winning tiles.
         Fu is sort of multiplier for the base socre, since base_score = fu * (2 ** (han + 2))
+        The fu of the melds and the wait types are looked up in fu_meld_table and chow_wait_table.
         :param hand_partition:
             List of list, it's a partition of hand tiles
         :param final_tile:
@@ -845,87 +2393,53 @@ class WinWaitCal:
         if len(hand_partition) == 7:
             return {"fu": {"七对(25Fu)": 25}, "fu_sum": 25, "fu_round": 25, "fu_desc": "七对(25Fu)"}
 
+        # wait classes of the chows in hand and called, see chow_wait_table
+        chow_waits = [WinWaitCal._chow_wait_class(m, final_tile) for m in hand_partition + melds if m[0] != m[1]]
+        final_waits = [w for w in chow_waits if w > 0]
+
         if len(hand_partition) + len(melds) == 5:
-            chows = [m for m in hand_partition + melds if m[0] != m[1]]
             pair = [m for m in hand_partition if len(m) == 2][0]
-            if len(chows) == 4 and pair[0] not in Tile.THREES + [player_wind, round_wind]:
-                chows_with_final = [chow for chow in chows if final_tile in chow]
-                if any((chw[0] == final_tile and chw[0] % 9 != 6) or (chw[2] == final_tile and chw[2] % 9 != 2)
-                           for chw in chows_with_final):
-                    if is_zimo and len(melds) == 0:
-                        return {"fu": {"門前清自摸和平和(20Fu)": 20}, "fu_sum": 20, "fu_round": 20, "fu_desc": "門前清自摸和平和(20Fu)"}
-                    if not is_zimo and len(melds) > 0:
-                        return {"fu": {"非门清平和荣和(30Fu)": 30}, "fu_sum": 30, "fu_round": 30, "fu_desc": "非门清平和荣和(30Fu)"}
+            if len(chow_waits) == 4 and pair[0] not in Tile.THREES + [player_wind, round_wind] and 1 in final_waits:
+                if is_zimo and len(melds) == 0:
+                    return {"fu": {"門前清自摸和平和(20Fu)": 20}, "fu_sum": 20, "fu_round": 20, "fu_desc": "門前清自摸和平和(20Fu)"}
+                if not is_zimo and len(melds) > 0:
+                    return {"fu": {"非门清平和荣和(30Fu)": 30}, "fu_sum": 30, "fu_round": 30, "fu_desc": "非门清平和荣和(30Fu)"}
 
         fu = {}
+        meld_table = WinWaitCal.fu_meld_table
+        pair = [m for m in hand_partition if len(m) == 2][0]
 
-        def add_base(b, b_desc):
+        for m in hand_partition:
+            if len(m) == 3 and m[0] == m[1] == m[2]:
+                b, b_desc = meld_table["concealed_pon" if is_zimo or final_tile != m[0] else "open_pon", m[0]]
+                fu[b_desc] = b
+        for m in melds:
+            if m[0] == m[1]:
+                b, b_desc = meld_table["open_pon", m[0]]
+                fu[b_desc] = b
+        for m in minkan:
+            b, b_desc = meld_table["minkan", m[0]]
+            fu[b_desc] = b
+        for m in ankan:
+            b, b_desc = meld_table["ankan", m[0]]
             fu[b_desc] = b
 
-        def check_kezi():
-            for meld in hand_partition:
-                if len(meld) == 3:
-                    if meld[0] == meld[1] == meld[2]:
-                        if meld[0] in Tile.ONENINE:
-                            if is_zimo or final_tile != meld[0]:
-                                add_base(8, "幺九暗刻(8Fu)")
-                            else:
-                                add_base(4, "幺九明刻(4Fu)")
-                        else:
-                            if is_zimo or final_tile != meld[0]:
-                                add_base(4, "中张暗刻(4Fu)")
-                            else:
-                                add_base(2, "中张明刻(2Fu)")
-
-            for meld in melds:
-                if meld[0] == meld[1]:
-                    if meld[0] in Tile.ONENINE:
-                        add_base(4, "幺九明刻(4Fu)")
-                    else:
-                        add_base(2, "中张明刻(2Fu)")
+        if pair[0] in Tile.THREES:
+            fu["役牌雀头(2Fu)"] = 2
+        if pair[0] == player_wind:
+            fu["自风雀头(2Fu)"] = 2
+        if pair[0] == round_wind:
+            fu["场风雀头(2Fu)"] = 2
 
-        def check_kans():
-            for mk in minkan:
-                if mk[0] in Tile.ONENINE:
-                    add_base(16, "幺九明杠(16Fu)")
-                else:
-                    add_base(8, "中张明杠(8Fu)")
-            for ak in ankan:
-                if ak[0] in Tile.ONENINE:
-                    add_base(32, "幺九暗杠(32Fu)")
-                else:
-                    add_base(16, "中张暗杠(16Fu)")
-
-        def check_pair(p):
-            if p[0] in Tile.THREES:
-                add_base(2, "役牌雀头(2Fu)")
-            if p[0] == player_wind:
-                add_base(2, "自风雀头(2Fu)")
-            if p[0] == round_wind:
-                add_base(2, "场风雀头(2Fu)")
-
-        def check_waiting_type(p):
-            chws = [m for m in hand_partition + melds if m[0] != m[1]]
-            chws_with_final = [chow for chow in chws if final_tile in chow]
-            if p[0] == final_tile and len(chws_with_final) == 0:
-                add_base(2, "单吊(2Fu)")
-            elif len(chws_with_final) > 0:
-                if all((chw[1] == final_tile or (chw[0] == final_tile and chw[2] % 9 == 8)
-                        or (chw[2] == final_tile and chw[0] % 9 == 0)) for chw in chws_with_final):
-                    add_base(2, "边张嵌张胡牌(2Fu)")
-
-        def check_win_type():
-            if is_zimo:
-                add_base(2, "自摸(2Fu)")
-            if not is_zimo and len(melds + minkan) == 0:
-                add_base(10, "门前清荣胡(10Fu)")
+        if pair[0] == final_tile and len(final_waits) == 0:
+            fu["单吊(2Fu)"] = 2
+        elif len(final_waits) > 0 and 1 not in final_waits:
+            fu["边张嵌张胡牌(2Fu)"] = 2
 
-        pair = [m for m in hand_partition if len(m) == 2][0]
-        check_kezi()
-        check_kans()
-        check_pair(pair)
-        check_waiting_type(pair)
-        check_win_type()
+        if is_zimo:
+            fu["自摸(2Fu)"] = 2
+        if not is_zimo and len(melds + minkan) == 0:
+            fu["门前清荣胡(10Fu)"] = 10
 
         res = dict()
         res["fu"] = fu
@@ -935,7 +2449,8 @@ class WinWaitCal:
         return res
 
     @staticmethod
-    def han_calculation(hand_partition, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach):
+    def han_calculation(hand_partition, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach,
+                        stop_at_yakuman=False):
         """
         Calculate the han value.
         Han is a unit of yaku.
@@ -946,6 +2461,7 @@ class WinWaitCal:
             |       base_score = fu * (2 ** (han + 2))        |
             ---------------------------------------------------
         See score_calculation() in this class
+        All yaku are tested on the features of the partition, see HandFeatures, the yakuman are tested first.
 
         :param hand_partition:
             List of list, it's a partition of hand tiles
@@ -965,6 +2481,8 @@ class WinWaitCal:
             Integer, indicates what is the wind tiles which ass yaku for all players at table
         :param reach:
             Boolean, whether the observed player has called Riichi
+        :param stop_at_yakuman:
+            Boolean, whether to skip the normal yaku once a yakuman is achieved, then res["han"] stays empty
         :return:
             A dict, {description of the value : value}
                 res["han"] = a dict, key=the yaku, value=the corresponding han value
@@ -974,221 +2492,96 @@ class WinWaitCal:
                 res["han_desc"] = string, all yakus that are achieved
 
         """
+        ft = WinWaitCal.HandFeatures(hand_partition, final_tile, melds, minkan, ankan)
+        counts = ft.counts
+        is_menqing = len(melds) + len(minkan) == 0
+        len_hand = len(hand_partition)
+        len_total = len(melds) + len(minkan) + len(ankan) + len_hand
         han, ykman = {}, {}
 
-        def add_han(h, h_desc):
-            han[h_desc] = h
-
-        def add_yakuman(m, m_desc):
-            ykman[m_desc] = m
-
-        all_melds = hand_partition + melds + minkan + ankan
-        all_melds_no_kan = hand_partition + melds
-        all_tiles = [tile for meld in all_melds for tile in meld]
-        is_menqing = len(melds + minkan) == 0
-        len_open = len(melds + minkan + ankan)
-        len_total = len_open + len(hand_partition)
-
-        def check_all_single_one_nine():
-            if len(hand_partition) == 13:
-                add_yakuman(1, "国士無双(Maxi)")
-
-        def check_seven_pairs():
-            if len(hand_partition) == 7:
-                add_han(2, "七対子(2Han)")
-
-        def check_win_type():
+        # yakuman first, the normal yaku can be skipped if one is achieved
+        if len_hand == 13:
+            ykman["国士無双(Maxi)"] = 1
+        threes = [min(counts[t], 3) for t in Tile.THREES]
+        if len_total == 5 and threes.count(3) == 3:
+            ykman["大三元(Maxi)"] = 1
+        all_19pons = len_total == ft.n_19_pons
+        pure_all_19 = len_total == 5 == ft.n_terminal_melds
+        if all_19pons and pure_all_19:
+            ykman["清老頭(Maxi)"] = 1
+        if ft.in_tiles(Tile.GREENS):
+            ykman["緑一色(Maxi)"] = 1
+        three_ankou = False
+        if len_total == 5:
+            pair = ft.pairs[0]
+            if len(ankan) + len(ft.hand_pons) == 4:
+                if is_zimo or final_tile == pair:
+                    ykman["四暗刻(Maxi)"] = 1
+                else:
+                    three_ankou = True
+            else:
+                three_ankou = len(ankan) + len([t for t in ft.hand_pons if is_zimo or final_tile != t]) == 3
+        winds = [min(counts[t], 3) for t in Tile.WINDS]
+        if winds.count(3) == 4:
+            ykman["大四喜(Maxi)"] = 1
+        elif winds.count(3) == 3 and winds.count(2) == 1:
+            ykman["小四喜(Maxi)"] = 1
+        if ft.in_tiles(Tile.HONORS):
+            ykman["字一色(Maxi)"] = 1
+        if is_menqing and ft.suits in (1, 2, 4):
+            i = [1, 2, 4].index(ft.suits) * 9
+            if all(counts[t] > 0 for t in range(i, i + 9)) and counts[i] > 2 and counts[i + 8] > 2:
+                ykman["九蓮宝燈(Maxi)"] = 1
+
+        if not (stop_at_yakuman and ykman):
+            if len_hand == 7:
+                han["七対子(2Han)"] = 2
             if reach:
-                add_han(1, "立直(1Han)")
+                han["立直(1Han)"] = 1
             if is_zimo and is_menqing:
-                add_han(1, "門前清自摸和(1Han)")
-
-        def check_dori():
-            for meld in all_melds:
-                if len(meld) > 2 and meld[0] == meld[1]:
-                    if meld[0] in Tile.THREES:
-                        add_han(1, "役牌(1Han)")
-                    if meld[0] == player_wind:
-                        add_han(1, "自風(1Han)")
-                    if meld[0] == round_wind:
-                        add_han(1, "場風(1Han)")
-
-        def check_no19():
-            if all(t not in all_tiles for t in Tile.ONENINE):
-                add_han(1, "断幺九(1Han)")
-
-        def check_3chows_same_color():
-            if len_total == 5:
-                chows = list()
-                for meld in all_melds_no_kan:
-                    if len(meld) == 3 and meld[0] != meld[1]:
-                        chows.append(meld)
-                if len(chows) > 2:
-                    for i in range(0, 7):
-                        if all([i + t + 0, i + t + 1, i + t + 2] in chows for t in [0, 9, 18]):
-                            if is_menqing:
-                                add_han(2, "三色同順(2Han)")
-                            else:
-                                add_han(1, "三色同順(1Han)")
-                            break
-
-        def check_flat_win():
-            if is_menqing and len(hand_partition) == 5:
-                chows = [meld for meld in hand_partition if len(meld) == 3 and meld[0] != meld[1]]
-                try:
-                    pair = [meld for meld in hand_partition if len(meld) == 2][0]
-                except:
-                    print(hand_partition)
-                    pair = [meld for meld in hand_partition if len(meld) == 2][0]
-                if len(chows) == 4 and pair[0] not in Tile.THREES + [player_wind, round_wind]:
-                    chows_with_final = [chow for chow in chows if final_tile in chow]
-                    if any((chw[0] == final_tile and chw[0] % 9 != 6) or (chw[2] == final_tile and chw[2] % 9 != 2)
-                           for chw in chows_with_final):
-                        add_han(1, "平和(1Han)")
-
-        def check_1to9():
-            if len_total == 5:
-                for i in [0, 9, 18]:
-                    if all([s + i, s + i + 1, s + i + 2] in all_melds_no_kan for s in [0, 3, 6]):
-                        if is_menqing:
-                            add_han(2, "一気通貫(2Han)")
-                        else:
-                            add_han(1, "一気通貫(1Han)")
-                        break
-
-        def check_all_pons():
-            if len_total == 5:
-                chows = [meld for meld in all_melds_no_kan if meld[0] != meld[1]]
-                if len(chows) == 0:
-                    add_han(2, "対々和(2Han)")
-
-        def check_threes():
-            if len_total == 5:
-                metrics = [all_tiles.count(t) for t in Tile.THREES]
-                metrics = [t if t < 4 else 3 for t in metrics]
-                if metrics.count(3) == 3:
-                    add_yakuman(1, "大三元(Maxi)")
-                if metrics.count(3) == 2 and metrics.count(2) == 1:
-                    add_han(2, "小三元(2Han)")
-
-        def check_all19():
-            # 混老頭(2Han)
-            all_19pons = len_total == len([m for m in all_melds if len(m) > 1 and m[0] == m[1] and m[0] in Tile.ONENINE])
-            # 純全帯幺九
-            pure_all_19 = len_total == 5 == len([m for m in all_melds if any(t in Tile.TERMINALS for t in m)])
-            # these four types can not be counted at the same time, only one of them is counted
+                han["門前清自摸和(1Han)"] = 1
+            for t in ft.pons:
+                if t in Tile.THREES:
+                    han["役牌(1Han)"] = 1
+                if t == player_wind:
+                    han["自風(1Han)"] = 1
+                if t == round_wind:
+                    han["場風(1Han)"] = 1
+            if not any(counts[t] for t in Tile.ONENINE):
+                han["断幺九(1Han)"] = 1
+            if is_menqing and len_hand == 5 and len(ft.hand_chows) == 4 and ft.pairs[0] not in Tile.THREES \
+                    and ft.pairs[0] != player_wind and ft.pairs[0] != round_wind and ft.two_sided_wait:
+                han["平和(1Han)"] = 1
+            if len_total == 5 and any((ft.chows >> i) & 0b1001001 == 0b1001001 for i in (0, 9, 18)):
+                han["一気通貫(2Han)" if is_menqing else "一気通貫(1Han)"] = 2 if is_menqing else 1
+            if len_total == 5 and not ft.has_non_pons:
+                han["対々和(2Han)"] = 2
+            if len_total == 5 and threes.count(3) == 2 and threes.count(2) == 1:
+                han["小三元(2Han)"] = 2
             if all_19pons and pure_all_19:
-                add_yakuman(1, "清老頭(Maxi)")
+                pass
             elif all_19pons:
-                add_han(2, "混老頭(2Han)")
+                han["混老頭(2Han)"] = 2
             elif pure_all_19:
-                if is_menqing:
-                    add_han(3, "純全帯幺九(3Han)")
-                else:
-                    add_han(2, "純全帯幺九(2Han)")
-            else:  # 混全帯幺九
-                if len_total == 5 or len_total == 7:
-                    if len([m for m in all_melds if any(t in Tile.ONENINE for t in m)]) == len_total:
-                        if is_menqing:
-                            add_han(2, "混全帯幺九(2Han)")
-                        else:
-                            add_han(1, "混全帯幺九(1Han)")
-
-        def check_3pons_same_color():
-            if len_total == 5:
-                for i in range(0, 9):
-                    if all([n + i] * 3 in all_melds or [n + i] * 4 in all_melds for n in [0, 9, 18]):
-                        add_han(2, "三色同刻(2Han)")
-                        break
-
-        def check_3kans():
-            if len_total == 5:
-                if len(ankan + minkan) == 3:
-                    add_han(2, "三槓子(2Han)")
-
-        def check_multiple_same_chow():
-            # 二盃口(3Han)
-            was_erbeikou = False
-            if is_menqing and len(hand_partition) == 5:
-                if all(all_tiles.count(t) == 2 for t in set(all_tiles)):
-                    was_erbeikou = True
-                    add_han(3, "二盃口(3Han)")
-            if not was_erbeikou and is_menqing and len(hand_partition + ankan):  # 一盃口
-                chows = [m for m in hand_partition if len(m) > 1 and m[0] != m[1]]
-                if any(chows.count(chw) >= 2 for chw in chows):
-                    add_han(1, "一盃口(1Han)")
-
-        def check_pure_color():
-            if any(all(typ <= t < typ + 9 for t in all_tiles) for typ in [0, 9, 18]):
-                if is_menqing:
-                    add_han(6, "清一色(6Han)")
-                else:
-                    add_han(5, "清一色(5Han)")
-            elif any(all(typ <= t < typ + 9 or 27 <= t < 34 for t in all_tiles) for typ in [0, 9, 18]):
-                if is_menqing:
-                    add_han(3, "混一色(3Han)")
-                else:
-                    add_han(2, "混一色(2Han)")
-
-        def check_pure_green():
-            if all(t in Tile.GREENS for t in all_tiles):
-                add_yakuman(1, "緑一色(Maxi)")
-
-        def check_4ankans():
-            if len_total == 5:
-                kezi = len(ankan) + len([m for m in hand_partition if len(m) == 3 and m[0] == m[1]])
-                pair = [m for m in hand_partition if len(m) == 2][0]
-                if kezi == 4:
-                    if is_zimo or final_tile == pair[0]:
-                        add_yakuman(1, "四暗刻(Maxi)")
-                    else:
-                        add_han(2, "三暗刻(2Han)")
-                else:  # 三暗刻
-                    kezi = len(ankan) + len([m for m in hand_partition
-                                             if len(m) == 3 and m[0] == m[1] and (is_zimo or final_tile != m[0])])
-                    if kezi == 3:
-                        add_han(2, "三暗刻(2Han)")
-
-        def check_four_honors():
-            metrics = [all_tiles.count(t) for t in Tile.WINDS]
-            metrics = [t if t < 4 else 3 for t in metrics]
-            if metrics.count(3) == 4:
-                add_yakuman(1, "大四喜(Maxi)")
-            elif metrics.count(3) == 3 and metrics.count(2) == 1:
-                add_yakuman(1, "小四喜(Maxi)")
-
-        def check_all_characters():
-            if all(t in Tile.HONORS for t in all_tiles):
-                add_yakuman(1, "字一色(Maxi)")
-
-        def check_9lotus():
-            if is_menqing:
-                for i in [0, 9, 18]:
-                    if all(i <= t < i + 9 for t in all_tiles) and all(t in all_tiles for t in range(i, i + 9)):
-                        if all_tiles.count(i) > 2 and all_tiles.count(i + 8) > 2:
-                            add_yakuman(1, "九蓮宝燈(Maxi)")
-                            break
-
-        check_all_single_one_nine()  # 国士無双(Maxi)
-        check_seven_pairs()  # 七対子(2Han)
-        check_win_type()  # 立直(1Han) 門前清自摸和(1Han)
-        check_dori()  # 役牌(1Han) 場風(1Han) 自風(1Han)
-        check_no19()  # 断幺九
-        check_flat_win()  # 平和(1Han)
-        check_1to9()  # 一気通貫(2/1Han)
-        check_all_pons()  # 対々和(2Han)
-        check_threes()  # 大三元(Maxi) 小三元(2Han)
-        check_all19()  # 清老頭(Maxi) 純全帯幺九(3/2Han) 混老頭(2Han) 混全帯幺九(2/1Han)
-        check_3pons_same_color()  # 三色同刻
-        check_3chows_same_color()  # 三色同順(2/1Han)
-        check_3kans()  # 三槓子
-        check_multiple_same_chow()  # 二盃口(3Han) 一盃口(1Han)
-        check_pure_color()  # 清一色(6/5Han) 混一色(3/2Han)
-        check_pure_green()  # 緑一色
-        check_4ankans()  # 四暗刻(Maxi)
-        check_four_honors()  # 小四喜(Maxi) 大四喜(Maxi)
-        check_all_characters()  # 字一色(Maxi)
-        check_9lotus()  # 九蓮宝燈(Maxi)
+                han["純全帯幺九(3Han)" if is_menqing else "純全帯幺九(2Han)"] = 3 if is_menqing else 2
+            elif (len_total == 5 or len_total == 7) and ft.n_19_melds == len_total:
+                han["混全帯幺九(2Han)" if is_menqing else "混全帯幺九(1Han)"] = 2 if is_menqing else 1
+            if len_total == 5 and any(t in ft.pons and t + 9 in ft.pons and t + 18 in ft.pons for t in range(9)):
+                han["三色同刻(2Han)"] = 2
+            if len_total == 5 and any((ft.chows >> i) & 0x40201 == 0x40201 for i in range(7)):
+                han["三色同順(2Han)" if is_menqing else "三色同順(1Han)"] = 2 if is_menqing else 1
+            if len_total == 5 and len(ankan) + len(minkan) == 3:
+                han["三槓子(2Han)"] = 2
+            if is_menqing and len_hand == 5 and all(c == 0 or c == 2 for c in counts):
+                han["二盃口(3Han)"] = 3
+            elif is_menqing and len_hand + len(ankan) and ft.repeated_chow:
+                han["一盃口(1Han)"] = 1
+            if ft.suits in (0, 1, 2, 4):
+                han["清一色(6Han)" if is_menqing else "清一色(5Han)"] = 6 if is_menqing else 5
+            elif ft.suits & 7 in (0, 1, 2, 4):
+                han["混一色(3Han)" if is_menqing else "混一色(2Han)"] = 3 if is_menqing else 2
+            if three_ankou:
+                han["三暗刻(2Han)"] = 2
 
         res = dict()
         res["han"] = han
@@ -1202,55 +2595,12 @@ class WinWaitCal:
     def win_parse(hand34, final_tile):
         """
         To parse current hand tiles into melds which satisfies winning constrains
+        The number tiles are decomposed suit by suit with lookups in the agari table, see the class attributes.
         :param hand34: tiles remaning in hand
         :param final_tile: the tile with which one finished his hand
         :return: list of list of list, different possibilities of partitioning total titles
         """
 
-        def parse_nums(tiles):
-            if len(tiles) == 0:
-                return [[[]]]
-
-            if len(tiles) == 1:
-                return None
-
-            if len(tiles) == 2:
-                return [[tiles]] if tiles[0] == tiles[1] else None
-
-            if len(tiles) == 3:
-                ismeld = tiles[0] == tiles[1] == tiles[2] or (tiles[0] + 2) == (tiles[1] + 1) == tiles[2]
-                return [[tiles]] if ismeld else None
-
-            if len(tiles) % 3 == 1:
-                return None
-
-            res = []
-
-            if len(tiles) % 3 == 2:
-                if tiles[0] == tiles[1]:
-                    rec_res = parse_nums(tiles[2:])
-                    if rec_res:
-                        for partition in rec_res:
-                            res.append([tiles[0:2]] + partition)
-
-            if tiles[0] == tiles[1] == tiles[2]:
-                rec_res = parse_nums(tiles[3:])
-                if rec_res:
-                    for partition in rec_res:
-                        res.append([tiles[0:3]] + partition)
-
-            if (tiles[0] + 1) in tiles and (tiles[0] + 2) in tiles:
-                remain_tiles = deepcopy(tiles)
-                remain_tiles.remove(tiles[0])
-                remain_tiles.remove(tiles[0] + 1)
-                remain_tiles.remove(tiles[0] + 2)
-                rec_res = parse_nums(remain_tiles)
-                if rec_res:
-                    for partition in rec_res:
-                        res.append([[tiles[0], tiles[0] + 1, tiles[0] + 2]] + partition)
-
-            return res if len(res) > 0 else None
-
         def parse_chrs(tiles):
             if len(tiles) == 0:
                 return [[]]
@@ -1263,48 +2613,73 @@ class WinWaitCal:
 
             return [partition] if len(partition) == (len(tiles) - 1) // 3 + 1 else None
 
-        hand_total = hand34 + [final_tile]
-        hand_total_set = set(hand_total)
+        counts = Partition._counts34(hand34)
+        counts[final_tile] += 1
+        total = len(hand34) + 1
         res = []
-        if all(hand_total.count(t) == 2 for t in hand_total_set) and len(hand_total) == 14:
-            res.append([[t] * 2 for t in hand_total_set])
-
-        if all(t in hand_total for t in Tile.ONENINE) and all(t in Tile.ONENINE for t in hand_total):
-            return [[[t] * hand_total.count(t) for t in Tile.ONENINE]]
-
-        hand_total.sort()
-        hand_man = [t for t in hand_total if t < 9]
-        hand_pin = [t for t in hand_total if 9 <= t < 18]
-        hand_suo = [t for t in hand_total if 18 <= t < 27]
-        hand_chr = [t for t in hand_total if 27 <= t]
-        man_parse = parse_nums(hand_man)
-        pin_parse = parse_nums(hand_pin)
-        suo_parse = parse_nums(hand_suo)
+        if total == 14 and all(c == 0 or c == 2 for c in counts):
+            res.append([[t] * 2 for t in set(Hand34.as_list(hand34) + [final_tile])])
+
+        if all(counts[t] > 0 for t in Tile.ONENINE) and sum(counts[t] for t in Tile.ONENINE) == total:
+            return [[[t] * counts[t] for t in Tile.ONENINE]]
+
+        suit_parses = []
+        for base in (0, 9, 18):
+            suit_counts = counts[base:base + 9]
+            suit_parse = WinWaitCal._parse_suit(suit_counts, base) if any(suit_counts) else [[[]]]
+            if not suit_parse:
+                return res
+            suit_parses.append(suit_parse)
+        hand_chr = [t for t in range(27, 34) for _ in range(counts[t])]
         chr_parse = parse_chrs(hand_chr)
-        if hand_man and not man_parse:
-            return res
-        if hand_pin and not pin_parse:
-            return res
-        if hand_suo and not suo_parse:
-            return res
         if hand_chr and not chr_parse:
             return res
 
+        man_parse, pin_parse, suo_parse = suit_parses
         for a in man_parse:
             for b in pin_parse:
                 for c in suo_parse:
                     res.append([m for m in a + b + c + chr_parse[0] if len(m) > 0])
         return res
 
+    @staticmethod
+    def _yakuman_capped(han_dict, hand34, final_tile, ankan):
+        """
+        Whether no other partition of the hand can achieve more yakuman than the given one.
+        Among the yakuman only 四暗刻 depends on how the tiles are partitioned, the others only depend on the tiles, the
+        called melds and the number of melds, which is the same for all partitions except 七対子 and 国士無双, and a
+        hand of those shapes can not have triplets. Thus the cap is reached unless 四暗刻 is missing and possible.
+        :param han_dict: the result of han_calculation(...) for a partition with yakuman
+        :param hand34: tiles in hand
+        :param final_tile: the final tile with which the observed player has won
+        :param ankan: the ankan melds of the observed player
+        :return: Boolean
+        """
+        if "四暗刻(Maxi)" in han_dict["ykman"]:
+            return True
+        counts = Partition._counts34(hand34)
+        counts[final_tile] += 1
+        return len(ankan) + len([c for c in counts if c >= 3]) < 4
+
+    @staticmethod
+    def reset_score_stats():
+        """
+        Set all counters of score_stats to zero.
+        """
+        for k in WinWaitCal.score_stats:
+            WinWaitCal.score_stats[k] = 0
+
     @staticmethod
     def score_calculation(hand34, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach, bonus_num,
-                          bonus_tiles, benchan, reach_stick, is_dealer):
+                          bonus_tiles, benchan, reach_stick, is_dealer, compact=False):
         """
         Calculate the final score given the hand tiles and melds.
         The method score_calculation_base() calculates only the base points.
         In this methods more components are added to deliver the final score.
         There can be different score result depending on how the tiles are partitioned.
         So, the highest possible score will be returned.
+        Partitions which only differ in the order of their melds are scored once, and no partition is scored any more
+        once a yakuman is found that no other partition can exceed. Both are counted in score_stats.
         :param hand34:
             List, hand tiles in 34-form
         :param final_tile:
@@ -1335,6 +2710,8 @@ class WinWaitCal:
             result in winning and someone has called Riichi.
         :param is_dealer:
             Boolean, whether the observed player is the dealer
+        :param compact:
+            Boolean, whether to return a ScoreResult instead of a dict, see ScoreResult.to_dict()
         :return:
             A dict, {description of the value : value}
             For example:
@@ -1348,65 +2725,220 @@ class WinWaitCal:
                  "partition": [[0, 0, 0], [11, 12, 13], [24, 25, 26], [27, 27], [28, 28, 28]]
                  }
         """
+        cache = WinWaitCal.result_cache
+        if cache is None:
+            res = WinWaitCal._score_calculation(hand34, final_tile, melds, minkan, ankan, is_zimo, player_wind,
+                                                round_wind, reach, bonus_num, bonus_tiles, benchan, reach_stick,
+                                                is_dealer)
+        else:
+            perm, c_hand, (c_final,), c_melds, c_minkan, c_ankan, c_bonus = WinWaitCal._canonical_args(
+                hand34, [final_tile], melds, minkan, ankan, bonus_tiles)
+            key = ("score", Hand34.pack(c_hand), c_final, WinWaitCal._melds_key(c_melds, c_minkan, c_ankan),
+                   bool(is_zimo), player_wind, round_wind, bool(reach), bonus_num + (c_final in c_bonus), benchan,
+                   reach_stick, bool(is_dealer))
+            res = cache.get(key, WinWaitCal._cache_miss)
+            if res is WinWaitCal._cache_miss:
+                res = WinWaitCal._score_calculation(c_hand, c_final, c_melds, c_minkan, c_ankan, is_zimo, player_wind,
+                                                    round_wind, reach, bonus_num, c_bonus, benchan, reach_stick,
+                                                    is_dealer)
+                cache.put(key, res)
+            if perm is not None and res is not None:
+                res = WinWaitCal._map_result(res, perm, hand34, final_tile, melds, minkan, ankan, is_zimo,
+                                             player_wind, round_wind)
+        if res is None or compact:
+            return res
+        return res.to_dict()
+
+    @staticmethod
+    def _score_calculation(hand34, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach, bonus_num,
+                           bonus_tiles, benchan, reach_stick, is_dealer):
+        """
+        score_calculation(...) without the result cache.
+        :return: a ScoreResult, None if the hand does not win
+        """
         win_partitions = WinWaitCal.win_parse(hand34, final_tile)
         if len(win_partitions) == 0:
             return None
-        b_score, b_score_desc, b_han, b_han_desc, b_fu, b_fu_desc, b_par = 0, None, None, None, None, None, None
+        if len(win_partitions) > 1:
+            win_partitions = sorted(win_partitions, key=WinWaitCal._tie_key(hand34))
+        b_score, b_han_dict, b_fu_dict, b_entry, b_par = 0, None, None, None, None
         bonus_num += final_tile in bonus_tiles
-        for p in win_partitions:
-            han_dict = WinWaitCal.han_calculation(p, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach)
+        stats = WinWaitCal.score_stats
+        stats["partitions"] += len(win_partitions)
+        seen = set()
+        # only the scores are compared here, the descriptions are formatted for the best partition after the loop
+        for i, p in enumerate(win_partitions):
+            key = tuple(sorted(tuple(m) for m in p))
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            if b_score > 0 and b_entry is None and WinWaitCal._yakuman_capped(b_han_dict, hand34, final_tile, ankan):
+                stats["capped"] += len(win_partitions) - i
+                break
+            stats["evaluated"] += 1
+            han_dict = WinWaitCal.han_calculation(p, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach,
+                                                  stop_at_yakuman=True)
             if han_dict["han_sum"] == han_dict["yk_sum"] == 0:
                 continue
             if han_dict["yk_sum"] > 0:
                 base_maxi_score = 48000 if is_dealer else 32000
                 final_score = base_maxi_score * han_dict["yk_sum"] + 1000 * reach_stick + benchan * 300
                 if final_score > b_score:
-                    b_score = final_score
-                    maxi_desc = han_dict["han_desc"]
-                    b_han = han_dict["ykman"]
-                    b_score_desc = "役满 {}点 {}点".format(base_maxi_score * han_dict["yk_sum"], final_score)
-                    b_han_desc = "{}".format(maxi_desc)
-                    b_fu = None
-                    b_fu_desc = None
-                    b_par = p
+                    b_score, b_han_dict, b_fu_dict, b_entry, b_par = final_score, han_dict, None, None, p
             else:
                 fu_dict = WinWaitCal.fu_calculation(p, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind)
-                fu = fu_dict["fu_round"]
-                base_point, lose_desc = WinWaitCal.score_calculation_base(han_dict["han_sum"] + bonus_num, fu, is_dealer, is_zimo)
-                final_score = base_point + 1000 * reach_stick + benchan * (300 if base_point > 0 else 0)
-                score_cal_desc = "{}Fu/{}Han --> {} {}点".format(fu, han_dict["han_sum"] + bonus_num, lose_desc, final_score)
-                han_desc = han_dict["han_desc"]
-                han_desc += " (赤/裏)ドラ({}Han)".format(bonus_num) if bonus_num > 0 else ""
+                entry = WinWaitCal.score_entry(han_dict["han_sum"] + bonus_num, fu_dict["fu_round"], is_dealer, is_zimo)
+                final_score = entry.score + 1000 * reach_stick + benchan * (300 if entry.score > 0 else 0)
                 if final_score > b_score:
-                    b_score = final_score
-                    b_score_desc = score_cal_desc
-                    b_han = han_dict["han"]
-                    if bonus_num > 0:
-                        b_han["(赤/裏)ドラ({}Han)".format(bonus_num)] = bonus_num
-                    b_han_desc = han_desc
-                    b_fu = fu_dict["fu"]
-                    b_fu_desc = fu_dict["fu_desc"]
-                    b_par = p
+                    b_score, b_han_dict, b_fu_dict, b_entry, b_par = final_score, han_dict, fu_dict, entry, p
 
         if b_score == 0:
             return None
+        if b_entry is None:
+            yaku = tuple(WinWaitCal.yaku_codes[k] for k in b_han_dict["ykman"])
+            return ScoreResult(b_score, yaku, None, b_par, 0, 0, None, (48000 if is_dealer else 32000) * len(yaku))
+        yaku = tuple(WinWaitCal.yaku_codes[k] for k in b_han_dict["han"])
+        fu = tuple(WinWaitCal.fu_codes[k] for k in b_fu_dict["fu"])
+        return ScoreResult(b_score, yaku, fu, b_par, bonus_num, b_fu_dict["fu_round"], b_entry, 0)
+
+    @staticmethod
+    def enable_result_cache(maxsize=4096, canonical=True):
+        """
+        Cache the results of score_calculation(...) and waiting_calculation(...), which are keyed by the packed hand
+        tiles, the melds and the context of the game. Callers get copies of the cached results.
+        :param maxsize: the maximal number of cached results, the least recently used are evicted
+        :param canonical: whether hands that only differ by a permutation of the suits share one entry, see
+            _canonical_args(...). The partitions of such hands are mapped back from the shared entry. Among
+            partitions with the same best score, score_calculation(...) returns the first one in the order of
+            _tie_key(...), which does not depend on the suits, so results equal those without the cache.
+        :return: the LRUCache, its info() shows the hit rate
+        """
+        WinWaitCal.result_cache = LRUCache(maxsize)
+        WinWaitCal.result_cache_canonical = canonical
+        return WinWaitCal.result_cache
+
+    @staticmethod
+    def disable_result_cache():
+        """
+        Stop caching results and drop the cache.
+        """
+        WinWaitCal.result_cache = None
+
+    @staticmethod
+    def _canonical_args(hand34, final_tiles, melds, minkan, ankan, bonus_tiles):
+        """
+        Move the tiles of the arguments of score_calculation(...) or waiting_calculation(...) into the canonical form
+        of Tile.canonical_suits(...). The arguments are kept if canonical keys are turned off, if the hand already is
+        canonical, or if all tiles are of the shapes of green tiles, since only 緑一色 depends on the suits.
+        :param final_tiles: a list of the final tile, empty for waiting_calculation(...)
+        :return: a tuple (perm, hand34, final_tiles, melds, minkan, ankan, bonus_tiles), perm is None if the arguments
+            are kept
+        """
+        hand34 = sorted(hand34)
+        args = (hand34, final_tiles, melds, minkan, ankan, bonus_tiles)
+        if not WinWaitCal.result_cache_canonical:
+            return (None,) + args
+        _, perm = Tile.canonical_suits(Hand34.pack(hand34))
+        if perm == (0, 1, 2) or all((t < 27 and t % 9 in (1, 2, 3, 5, 7)) or t == Tile.FORTUNE
+                                    for ts in (hand34, final_tiles) + tuple(melds) + tuple(minkan) + tuple(ankan)
+                                    for t in ts):
+            return (None,) + args
+        return (perm, sorted(Tile.map_suits(hand34, perm)), Tile.map_suits(final_tiles, perm),
+                [Tile.map_suits(m, perm) for m in melds], [Tile.map_suits(m, perm) for m in minkan],
+                [Tile.map_suits(m, perm) for m in ankan], Tile.map_suits(list(bonus_tiles), perm))
+
+    @staticmethod
+    def _tie_key(hand34):
+        """
+        The order in which _score_calculation(...) evaluates the partitions, the first one with the best score is
+        returned. The partitions are compared with their tiles moved into the canonical suits of
+        Tile.canonical_suits(...), so that hands which differ by a permutation of the suits choose corresponding
+        partitions, and the result cache can share one entry between them.
+        :param hand34: the hand tiles in 34-form, without the final tile
+        :return: a function mapping a partition to a comparable key
+        """
+        _, perm = Tile.canonical_suits(Hand34.pack(hand34))
+        return lambda partition: sorted(Tile.map_suits(list(m), perm) for m in partition)
+
+    @staticmethod
+    def _map_result(res, perm, hand34, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind):
+        """
+        Move the partition of a ScoreResult of the canonical hand back to the suits of the given hand. Its melds are
+        put in the order win_parse(...) gives for the hand, and the fu are listed again in the order of these melds.
+        :param res: the ScoreResult of the canonical hand
+        :param perm: the permutation returned by _canonical_args(...)
+        :return: a ScoreResult of the given hand, the other arguments are those of score_calculation(...)
+        """
+        if len(res.partition) == 7:
+            partition = [[t] * 2 for t in set(sorted(hand34) + [final_tile])]
         else:
-            res = dict()
-            res["score"] = b_score
-            res["score_desc"] = b_score_desc
-            res["han"] = b_han
-            res["han_desc"] = b_han_desc
-            res["fu"] = b_fu
-            res["fu_desc"] = b_fu_desc
-            res["partition"] = b_par
-            return res
+            partition = sorted((Tile.map_suits(list(m), perm, inverse=True) for m in res.partition),
+                               key=lambda m: m[0] // 9)
+        fu = res.fu_codes
+        if fu is not None:
+            fu_dict = WinWaitCal.fu_calculation(partition, final_tile, melds, minkan, ankan, is_zimo, player_wind,
+                                                round_wind)
+            fu = tuple(WinWaitCal.fu_codes[k] for k in fu_dict["fu"])
+        return ScoreResult(res.score, res.yaku, fu, partition, res.bonus_num, res.fu_round, res.entry, res.maxi_score)
+
+    @staticmethod
+    def _melds_key(melds, minkan, ankan):
+        return tuple(tuple(m) for m in melds), tuple(tuple(m) for m in minkan), tuple(tuple(m) for m in ankan)
+
+    @staticmethod
+    def _init_score_worker():
+        """
+        Initializer of the worker processes of score_calculation_batch(...), loads the tables once per process.
+        """
+        WinWaitCal.load_agari_table()
+        WinWaitCal.score_entry(1, 30, False, False)
+
+    @staticmethod
+    def _score_chunk(records):
+        return [WinWaitCal.score_calculation(**r) if isinstance(r, dict) else WinWaitCal.score_calculation(*r)
+                for r in records]
+
+    @staticmethod
+    def score_calculation_batch(records, workers=None, chunksize=256, max_pending=None):
+        """
+        Score many hands with score_calculation(...) in a pool of worker processes.
+        The records are sent to the workers in chunks, at most max_pending chunks are in flight at a time, so that an
+        endless iterable of records can be streamed. Each worker loads the agari table and the score table once.
+        :param records:
+            An iterable of records, each record is a tuple of the arguments of score_calculation(...) in their order,
+            or a dict of them by name
+        :param workers:
+            Integer, the number of worker processes, None for the number of CPUs
+        :param chunksize:
+            Integer, the number of records sent to a worker at once
+        :param max_pending:
+            Integer, the maximal number of chunks in flight, None for twice the number of workers
+        :return:
+            A generator of the results of score_calculation(...), in the order of the records
+        """
+        workers = workers or os.cpu_count() or 1
+        max_pending = max_pending or 2 * workers
+        records = iter(records)
+        with ProcessPoolExecutor(max_workers=workers, initializer=WinWaitCal._init_score_worker) as pool:
+            pending = deque()
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(islice(records, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(WinWaitCal._score_chunk, chunk))
+                if not pending:
+                    break
+                for res in pending.popleft().result():
+                    yield res
 
     @staticmethod
     def waiting_calculation(hand34, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach, bonus_num,
-                            bonus_tiles, benchan, reach_stick, is_dealer):
+                            bonus_tiles, benchan, reach_stick, is_dealer, compact=False):
         """
         Calculate what kinds of tiles is the player waiting, given current hand tiles and melds.
-        This function calls score_calculation(...) as subroutines.
+        The waiting tiles are found by winning_tiles(...), only they are scored by score_calculation(...).
         :param hand34:
             List, hand tiles in 34-form
         :param melds:
@@ -1435,6 +2967,8 @@ class WinWaitCal:
             result in winning and someone has called Riichi.
         :param is_dealer:
             Boolean, whether the observed player is the dealer
+        :param compact:
+            Boolean, whether the values are ScoreResult instead of dicts
         :return:
             A dict, {waiting tile : dict of the corresponding winning score calculation}
             For example:
@@ -1463,70 +2997,335 @@ class WinWaitCal:
                     ...
                 }
         """
-        waitings = {}
-        if len(hand34) == 13 and len(set(hand34)) == 7:
-            pairs = [t for t in set(hand34) if hand34.count(t) == 2]
-            single = [t for t in set(hand34) if hand34.count(t) == 1]
-            if len(pairs) == 6 and len(single) == 1:
-                waitings[single[0]] = WinWaitCal.score_calculation(hand34, single[0], melds, minkan, ankan, is_zimo,
-                                                                   player_wind, round_wind, reach, bonus_num,
-                                                                   bonus_tiles, benchan, reach_stick, is_dealer)
-        elif len(hand34) == 13 and len(set(hand34)) >= 12:
-            metrics_19 = [hand34.count(t) for t in Tile.ONENINE]
-            if metrics_19.count(1) == 13:
-                for t in Tile.ONENINE:
-                    waitings[t] = WinWaitCal.score_calculation(hand34, t, melds, minkan, ankan, is_zimo,
-                                                               player_wind, round_wind, reach, bonus_num,
-                                                               bonus_tiles, benchan, reach_stick, is_dealer)
-            elif metrics_19.count(1) == 11 and metrics_19.count(2) == 1:
-                wait = [t for t in Tile.ONENINE if t not in hand34][0]
-                waitings[wait] = WinWaitCal.score_calculation(hand34, wait, melds, minkan, ankan, is_zimo,
-                                                              player_wind, round_wind, reach, bonus_num,
-                                                              bonus_tiles, benchan, reach_stick, is_dealer)
+        cache = WinWaitCal.result_cache
+        if cache is None:
+            res = WinWaitCal._waiting_calculation(hand34, melds, minkan, ankan, is_zimo, player_wind, round_wind,
+                                                  reach, bonus_num, bonus_tiles, benchan, reach_stick, is_dealer)
         else:
-            lenman = len([t for t in hand34 if t < 9])
-            lenpin = len([t for t in hand34 if 9 <= t < 18])
-            lensuo = len([t for t in hand34 if 18 <= t < 27])
-            lenchr = len([t for t in hand34 if 27 <= t])
-            metrics = [l % 3 for l in [lenman, lenpin, lensuo, lenchr]]
-            possible_tiles = []
-            if 1 in metrics and 2 not in metrics and metrics.count(1) == 1:
-                tile_type = metrics.index(1)
-                if tile_type < 3:
-                    possible_tiles = list(range(tile_type*9, (tile_type+1)*9))
-                else:
-                    possible_tiles = list(range(27, 34))
-            elif 2 in metrics and 1 not in metrics and metrics.count(2) == 2:
-                for i in range(3):
-                    if metrics[i] == 2:
-                        possible_tiles.append(list(range(i*9, (i+1)*9)))
-                if metrics[3] == 2:
-                    possible_tiles.append(list(range(27, 34)))
-            for pt in possible_tiles:
-                score_dict = WinWaitCal.score_calculation(hand34, pt, melds, minkan, ankan, is_zimo,
-                                                          player_wind, round_wind, reach, bonus_num,
-                                                          bonus_tiles, benchan, reach_stick, is_dealer)
-                if score_dict:
-                    waitings[pt] = score_dict
-
-        return waitings
+            perm, c_hand, _, c_melds, c_minkan, c_ankan, c_bonus = WinWaitCal._canonical_args(
+                hand34, [], melds, minkan, ankan, bonus_tiles)
+            key = ("waiting", Hand34.pack(c_hand), WinWaitCal._melds_key(c_melds, c_minkan, c_ankan), bool(is_zimo),
+                   player_wind, round_wind, bool(reach), bonus_num, tuple(sorted(set(c_bonus))), benchan,
+                   reach_stick, bool(is_dealer))
+            res = cache.get(key, WinWaitCal._cache_miss)
+            if res is WinWaitCal._cache_miss:
+                res = WinWaitCal._waiting_calculation(c_hand, c_melds, c_minkan, c_ankan, is_zimo, player_wind,
+                                                      round_wind, reach, bonus_num, c_bonus, benchan, reach_stick,
+                                                      is_dealer)
+                cache.put(key, res)
+            if perm is not None:
+                waitings = []
+                for wt, score in res:
+                    wt = Tile.map_suits(wt, perm, inverse=True)
+                    waitings.append((wt, WinWaitCal._map_result(score, perm, hand34, wt, melds, minkan, ankan, is_zimo,
+                                                                player_wind, round_wind)))
+                res = sorted(waitings, key=lambda w: w[0])
+        return {wt: score if compact else score.to_dict() for wt, score in res}
+
+    @staticmethod
+    def _waiting_calculation(hand34, melds, minkan, ankan, is_zimo, player_wind, round_wind, reach, bonus_num,
+                             bonus_tiles, benchan, reach_stick, is_dealer):
+        """
+        waiting_calculation(...) without the result cache.
+        :return: a tuple of pairs (waiting tile, ScoreResult)
+        """
+        waitings = []
+        for wt in WinWaitCal.winning_tiles(hand34):
+            score = WinWaitCal.score_calculation(hand34, wt, melds, minkan, ankan, is_zimo, player_wind, round_wind,
+                                                 reach, bonus_num, bonus_tiles, benchan, reach_stick, is_dealer,
+                                                 compact=True)
+            if score:
+                waitings.append((wt, score))
+
+        return tuple(waitings)
+
+
+class TokenBucket:
+    """
+        A token bucket rate limiter for coroutines. Tokens are refilled at a constant rate up to a capacity, each
+        request takes one token and waits until one is available. A full bucket allows a burst of capacity requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        To initialise a full bucket.
+        :param rate: the number of tokens refilled per second
+        :param capacity: the maximal number of tokens, by default max(1, rate)
+        :raises ValueError: if rate is not positive or capacity is smaller than one token
+        """
+        if rate <= 0:
+            raise ValueError("The rate of a token bucket must be positive, got {}".format(rate))
+        capacity = capacity if capacity is not None else max(1, rate)
+        if capacity < 1:
+            raise ValueError("The capacity of a token bucket must be at least 1, got {}".format(capacity))
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def hold(self, seconds):
+        """
+        Empty the bucket so that no token is granted for the given time, e.g. as asked for by a Retry-After header.
+        :param seconds: the time in seconds
+        :return: None
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self):
+        """
+        Take one token, sleep until the bucket has one if it is empty. Waiting coroutines are served in order.
+        :return: None
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class HttpSession:
+    """
+        A pooled http session shared by the crawl paths. Connections to a host are kept alive and reused,
+        every request has a timeout, and connection errors, timeouts and the status codes in retry_statuses are
+        retried with exponential backoff and full jitter. The retries and the latency of requests are counted.
+        The counters are protected by a lock, so one session can be used from several threads.
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_connections=4, pool_maxsize=16, timeout=(5, 30), retries=4, backoff=0.5, backoff_max=30.0):
+        """
+        :param pool_connections: the number of hosts whose connection pools are kept
+        :param pool_maxsize: the number of connections kept alive per host
+        :param timeout: seconds to wait for the connection and for the response, a number or a tuple of both
+        :param retries: the number of retries after the first attempt
+        :param backoff: the base delay in seconds, the delay before retry n is random in [0, backoff * 2 ** n]
+        :param backoff_max: the upper bound of the delay in seconds
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff, self.backoff_max = backoff, backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @staticmethod
+    def retry_after(response):
+        """
+        The delay asked for by the Retry-After header of a response.
+        :param response: a requests.Response
+        :return: the delay in seconds, None if the header is missing or invalid
+        """
+        value = response.headers.get("Retry-After") if response is not None else None
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, retry_after=None):
+        """
+        The time to wait before a retry: the Retry-After delay of the server if there is one, else a random
+        exponential backoff.
+        :param attempt: the number of retries done so far
+        :param retry_after: the delay asked for by the server, or None
+        :return: the delay in seconds
+        """
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def send(self, url, headers=None):
+        """
+        Send a GET request once, without retrying it. The request and its latency are counted.
+        :param url: the url
+        :param headers: a dict of request headers
+        :return: the requests.Response, whatever its status
+        :raises requests.ConnectionError, requests.Timeout: if no response is received
+        """
+        start = time.monotonic()
+        try:
+            return self.session.get(url, headers=headers, timeout=self.timeout)
+        finally:
+            latency = time.monotonic() - start
+            with self._lock:
+                self.requests += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+    def get(self, url, headers=None):
+        """
+        Send a GET request, and retry it if it fails transiently.
+        :param url: the url
+        :param headers: a dict of request headers
+        :return: the requests.Response
+        :raises requests.RequestException: if the last attempt fails or the response has an error status
+        """
+        attempt = 0
+        while True:
+            try:
+                r, error = self.send(url, headers), None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                r, error = None, e
+            if (error is None and r.status_code not in self.retry_statuses) or attempt >= self.retries:
+                break
+            self.count_retry()
+            time.sleep(self.delay(attempt, self.retry_after(r)))
+            attempt += 1
+        if error is not None:
+            self.count_failure()
+            raise error
+        if r.status_code >= 400:
+            self.count_failure()
+            r.raise_for_status()
+        return r
+
+    def count_retry(self):
+        with self._lock:
+            self.retries_done += 1
+
+    def count_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def reset_stats(self):
+        """
+        Reset the counters.
+        :return: None
+        """
+        with self._lock:
+            self.requests, self.retries_done, self.failures = 0, 0, 0
+            self.latency_total, self.latency_max = 0.0, 0.0
+
+    def info(self):
+        """
+        Statistics of the session.
+        :return: a dict with keys "requests" (attempts), "retries", "failures", "latency_mean" and "latency_max"
+        """
+        with self._lock:
+            mean = self.latency_total / self.requests if self.requests else 0.0
+            return {"requests": self.requests, "retries": self.retries_done, "failures": self.failures,
+                    "latency_mean": mean, "latency_max": self.latency_max}
+
+    def close(self):
+        self.session.close()
+
+
+class TransientHttpError(Exception):
+    """
+        Raised by a transport of the asynchronous crawl mode for a failure that is worth retrying, i.e. a connection
+        error, a timeout or a status code in HttpSession.retry_statuses. retry_after is the delay in seconds asked
+        for by the server, or None.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestsTransport:
+    """
+        The default transport of the asynchronous crawl mode. A transport is any object with a coroutine
+        get(url, headers) returning the response body as bytes, and raising TransientHttpError for failures worth
+        retrying, so that another http client or a local stub can be plugged in. This one runs single
+        HttpSession.send(...) calls in a thread pool, the retries are left to the crawler, which waits for the rate
+        limiter of the host before each of them.
+    """
+
+    def __init__(self, max_workers=8, session=None):
+        """
+        :param max_workers: the number of threads, i.e. the maximal number of requests in flight
+        :param session: the HttpSession to send requests with, by default a new one with max_workers connections,
+                        which close() closes
+        """
+        self._own_session = session is None
+        self.session = HttpSession(pool_maxsize=max_workers) if self._own_session else session
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _get(self, url, headers):
+        try:
+            r = self.session.send(url, headers)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientHttpError(str(e)) from e
+        if r.status_code in self.session.retry_statuses:
+            raise TransientHttpError("{} Error for url: {}".format(r.status_code, url), HttpSession.retry_after(r))
+        r.raise_for_status()
+        return r.content
+
+    async def get(self, url, headers):
+        """
+        Fetch an url without blocking the event loop.
+        :param url: the url
+        :param headers: a dict of request headers
+        :return: the response body as bytes
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._get, url, headers)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._own_session:
+            self.session.close()
 
 
 class GameLogCrawler:
 
     seed = "Seria"
 
+    ranking_url = "http://arcturus.su/tenhou/ranking/ranking.pl?name="
+    log_url = "http://tenhou.net/5/mjlog2json.cgi?"
+    referer_url = "http://tenhou.net/5/?log="
+    agent = "Mozilla/5.0 (Macintosh; Intel ...) Gecko/20100101 Firefox/58.0"
+
     level_dict = {'新人': 0, '１級': 1, '２級': 2, '３級': 3, '４級': 4, '５級': 5, '６級': 6, '７級': 7, '８級': 8, '９級': 9,
                   '初段': 10, '二段': 11, '三段': 12, '四段': 13, '五段': 14, '六段': 15, '七段': 16, '八段': 17, '九段': 18,
                   '十段': 19, '天鳳位': 20}
 
-    def __init__(self):
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        dbfile = dir_path + "/gamelog.db"
+    insert_statements = {
+        "player": "INSERT OR IGNORE INTO player (name) VALUES (?)",
+        "refids": "INSERT OR IGNORE INTO refids VALUES (?, ?, ?, ?, ?)",
+        "logs": "INSERT OR IGNORE INTO logs VALUES (?, ?)",
+        "game_players": "INSERT OR IGNORE INTO game_players VALUES (?, ?, ?)",
+    }
+
+    schema_version = 1
+
+    fetch_size = 1000
+
+    def __init__(self, dbfile=None, http=None, batch_size=500):
+        """
+        :param dbfile: the path of the sqlite database, by default gamelog.db next to this file
+        :param http: the HttpSession used by all crawl paths, by default a new one, which close() closes
+        :param batch_size: the number of rows buffered per table before they are written in one transaction
+        """
+        self._own_http = http is None
+        self.http = HttpSession() if self._own_http else http
+        if dbfile is None:
+            dir_path = os.path.dirname(os.path.realpath(__file__))
+            dbfile = dir_path + "/gamelog.db"
         self.conn = sqlite3.connect(dbfile)
         self.cs = self.conn.cursor()
+        self.batch_size = batch_size
+        self._pending = {table: [] for table in self.insert_statements}
         self._db_create_tables_if_not_exists()
-        # self.cs.execute(f"CREATE TABLE IF NOT EXISTS ")
 
     def _db_show_table_structures(self, table_name):
         res = self.cs.execute(f"PRAGMA table_info('{table_name}');").fetchall()
@@ -1544,7 +3343,53 @@ class GameLogCrawler:
         self.cs.execute("CREATE TABLE IF NOT EXISTS player ('name' text PRIMARY KEY, 'level' text, 'pt' text, 'lv' INTEGER)")
         self.cs.execute("CREATE TABLE IF NOT EXISTS refids ('ref' text PRIMARY KEY, 'p1' text, 'p2' text, 'p3' text, 'p4' text)")
         self.cs.execute("CREATE TABLE IF NOT EXISTS logs ('refid' text PRIMARY KEY, 'log' text)")
+        self.cs.execute("CREATE TABLE IF NOT EXISTS game_players ('refid' text, 'seat' INTEGER, 'player_id' text, "
+                        "PRIMARY KEY ('refid', 'seat'))")
+        self.cs.execute("CREATE INDEX IF NOT EXISTS game_players_player_id ON game_players ('player_id', 'refid')")
+        self.cs.execute("CREATE INDEX IF NOT EXISTS player_lv ON player ('lv')")
+        self.conn.commit()
+        self._db_migrate()
+        self._game_players_rows, self._game_players_analyzed = self._db_count_game_players()
+        self._db_analyze_if_grown()
+
+    def _db_migrate(self):
+        """
+        Bring a database of an older version up to schema_version, which is stored as PRAGMA user_version.
+        Version 1: the players of a game are in TABLE game_players, one row per seat, filled from TABLE refids.
+        :return: None
+        """
+        version = self.cs.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.schema_version:
+            return
+        with self.conn:
+            if version < 1:
+                self.cs.execute("INSERT OR IGNORE INTO game_players "
+                                "SELECT ref, 0, p1 FROM refids UNION ALL SELECT ref, 1, p2 FROM refids "
+                                "UNION ALL SELECT ref, 2, p3 FROM refids UNION ALL SELECT ref, 3, p4 FROM refids")
+                if self.cs.rowcount > 0:
+                    print("    {} players of games copied into TABLE game_players".format(self.cs.rowcount))
+            self.cs.execute("PRAGMA user_version = {}".format(self.schema_version))
+
+    def _db_analyze_if_grown(self):
+        """
+        Update the statistics of the query planner once TABLE game_players has at least twice as many rows as when it
+        was analyzed last, which is also the case for a database that was never analyzed. Without statistics,
+        SQLite prefers scanning game_players in refid order over the index on player.lv, which is many times slower.
+        :return: None
+        """
+        if self._game_players_rows == 0 or self._game_players_rows < 2 * self._game_players_analyzed:
+            return
+        self.cs.execute("ANALYZE")
         self.conn.commit()
+        self._game_players_analyzed = self._game_players_rows
+
+    def _db_count_game_players(self):
+        rows = self.cs.execute("SELECT count(*) FROM game_players").fetchone()[0]
+        try:
+            stat = self.cs.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = 'game_players' LIMIT 1").fetchone()
+        except sqlite3.OperationalError:
+            stat = None
+        return rows, int(stat[0].split()[0]) if stat else 0
 
     def db_prt_players(self, rows=100):
         row_cnt_cs_obj = self.cs.execute("SELECT count(*) FROM player")
@@ -1581,6 +3426,7 @@ class GameLogCrawler:
         self._db_show_table_structures("player")
         self._db_show_table_structures("refids")
         self._db_show_table_structures("logs")
+        self._db_show_table_structures("game_players")
 
     def _db_exists_game_log(self, refid):
         has_log = self.cs.execute(f"SELECT count(*) FROM logs WHERE refid = '{refid}'")
@@ -1601,34 +3447,70 @@ class GameLogCrawler:
             return False
         return has_refid[0] != None and has_refid[0] > 0
 
+    def _db_queue(self, table, rows):
+        pending = self._pending[table]
+        pending.extend(rows)
+        if len(pending) >= self.batch_size:
+            return self._db_flush_table(table)
+        return 0
+
+    def _db_flush_table(self, table):
+        """
+        Write the buffered rows of a table in one transaction. If it fails, the rows stay buffered
+        and the error is raised, so that a later flush can write them.
+        :param table: the table name
+        :return: the number of rows written, including rows ignored as already existing
+        """
+        pending = self._pending[table]
+        if not pending:
+            return 0
+        try:
+            with self.conn:
+                cnt = self.conn.executemany(self.insert_statements[table], pending).rowcount
+        except sqlite3.Error as e:
+            print("    {} rows not inserted into TABLE {}: {}".format(len(pending), table, e))
+            raise
+        print("    {} of {} rows inserted into TABLE {}".format(cnt, len(pending), table))
+        written = len(pending)
+        pending.clear()
+        if table == "game_players":
+            self._game_players_rows += cnt
+            self._db_analyze_if_grown()
+        return written
+
+    def db_flush(self):
+        """
+        Write all buffered rows into the database, one transaction per table.
+        The batch_crawl_xxx(...) functions flush before they return.
+        :return: the number of rows written
+        :raises sqlite3.Error: if a transaction fails, its rows are kept buffered
+        """
+        return sum(self._db_flush_table(table) for table in self._pending)
+
+    def close(self):
+        """
+        Flush buffered rows and close the database connection, and the http session if the crawler created it.
+        :return: None
+        """
+        try:
+            self.db_flush()
+            self.cs.execute("PRAGMA optimize")
+            self.conn.close()
+        finally:
+            if self._own_http:
+                self.http.close()
+
     def _db_insert_names(self, players):
-        for name in players:
-            try:
-                if not self._db_exists_name(name):
-                    self.cs.execute(f'INSERT INTO player VALUES ("{name}", NULL, NULL, NULL)')
-                    print("    Player {} inserted into table player".format(name))
-            except Exception as e:
-                print(e)
-        self.conn.commit()
+        self._db_queue("player", [(name,) for name in players])
 
     def _db_insert_refid(self, refid, players):
-        try:
-            if not self._db_exists_refid(refid) and len(players) > 3:
-                self.cs.execute(f"INSERT INTO refids VALUES ('{refid}', '{players[0]}', '{players[1]}', '{players[2]}', '{players[3]}')")
-                print("   Refid {} - {} inserted into table refids".format(refid, players))
-            self.conn.commit()
-        except Exception as e:
-            print(e)
+        if len(players) > 3:
+            self._db_queue("refids", [(refid, players[0], players[1], players[2], players[3])])
+            self._db_queue("game_players", [(refid, seat, players[seat]) for seat in range(4)])
 
     def _db_insert_log(self, refid, log):
-        try:
-            if not self._db_exists_game_log(refid):
-                log = str(log).replace("'", "\"")
-                self.cs.execute(f"INSERT INTO logs VALUES ('{refid}', '{log}')")
-                print("Game log of {} crawled and inserted into TABLE logs.".format(refid))
-                self.conn.commit()
-        except Exception as e:
-            print(e)
+        print("Game log of {} crawled.".format(refid))
+        return self._db_queue("logs", [(refid, json.dumps(log, ensure_ascii=False))])
 
     def _db_update_player_level(self, name, level, pt):
         try:
@@ -1667,34 +3549,57 @@ class GameLogCrawler:
         for n in names:
             yield n[0]
 
+    def _db_stream(self, query, params=()):
+        """
+        Run a query on its own cursor and read the rows in chunks of fetch_size, so that the result is neither held
+        in memory at once nor reset by statements executed on self.cs while it is consumed.
+        :param query: the SQL query
+        :param params: the bound parameters
+        :return: a generator of rows
+        """
+        cs = self.conn.cursor()
+        try:
+            cs.execute(query, params)
+            while True:
+                rows = cs.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cs.close()
+
     def _db_select_refids_no_logs_where_players_lv_gr(self, gr_lv):
-        res = self.cs.execute(f"SELECT DISTINCT refids.ref "
-                              f"FROM player JOIN refids "
-                              f"ON (player.name = refids.p1 OR player.name = refids.p2 "
-                              f"OR player.name = refids.p3 OR player.name = refids.p4) "
-                              f"WHERE player.lv > {gr_lv} "
-                              f"ORDER BY refids.ref DESC")
-        for r in res.fetchall():
-            if not self._db_exists_game_log(r[0]):
-                yield r[0]
+        res = self._db_stream("SELECT DISTINCT game_players.refid "
+                              "FROM player JOIN game_players ON game_players.player_id = player.name "
+                              "LEFT JOIN logs ON logs.refid = game_players.refid "
+                              "WHERE player.lv > ? AND logs.refid IS NULL "
+                              "ORDER BY game_players.refid DESC", (gr_lv,))
+        for r in res:
+            yield r[0]
 
     def _db_select_refids_with_logs_where_players_lv_gr(self, gr_lv):
-        res = self.cs.execute(f"SELECT DISTINCT refids.ref "
-                              f"FROM player JOIN refids "
-                              f"ON (player.name = refids.p1 OR player.name = refids.p2 "
-                              f"OR player.name = refids.p3 OR player.name = refids.p4) "
-                              f"WHERE player.lv > {gr_lv} "
-                              f"ORDER BY refids.ref DESC")
-        for r in res.fetchall():
-            if self._db_exists_game_log(r[0]):
-                yield r[0]
-
-    @staticmethod
-    def _crawl_get_self_page(name):
-        url = "http://arcturus.su/tenhou/ranking/ranking.pl?name=" + name
-        agent = "Mozilla/5.0 (Macintosh; Intel ...) Gecko/20100101 Firefox/58.0"
-        headers = {'User-Agent': agent}
-        r = requests.get(url, headers=headers)
+        res = self._db_stream("SELECT DISTINCT game_players.refid "
+                              "FROM player JOIN game_players ON game_players.player_id = player.name "
+                              "JOIN logs ON logs.refid = game_players.refid "
+                              "WHERE player.lv > ? "
+                              "ORDER BY game_players.refid DESC", (gr_lv,))
+        for r in res:
+            yield r[0]
+
+    def _db_select_logs_where_players_lv_gr(self, gr_lv):
+        res = self._db_stream("SELECT logs.log "
+                              "FROM (SELECT DISTINCT game_players.refid AS refid "
+                              "FROM player JOIN game_players ON game_players.player_id = player.name "
+                              "WHERE player.lv > ?) AS games "
+                              "JOIN logs ON logs.refid = games.refid "
+                              "ORDER BY games.refid DESC", (gr_lv,))
+        for r in res:
+            yield r[0]
+
+    def _crawl_get_self_page(self, name):
+        url = self.ranking_url + name
+        headers = {'User-Agent': self.agent}
+        r = self.http.get(url, headers=headers)
         return r.text
 
     def _crawl_level_and_pt_by_name(self, name=None, page=None):
@@ -1702,7 +3607,7 @@ class GameLogCrawler:
             text = page
         else:
             if name:
-                text = GameLogCrawler._crawl_get_self_page(name)
+                text = self._crawl_get_self_page(name)
             else:
                 return
         pos1 = str.find(text, 'rank estimation [translateme]')
@@ -1717,7 +3622,7 @@ class GameLogCrawler:
             return level, pt
 
     def _crawl_refid_and_players_by_name(self, name):
-        r = GameLogCrawler._crawl_get_self_page(name)
+        r = self._crawl_get_self_page(name)
 
         level, pt = self._crawl_level_and_pt_by_name(page=str(r))
         if level and pt:
@@ -1731,13 +3636,14 @@ class GameLogCrawler:
                 names = [n.split('(')[0] for n in l[l.find("</abbr>") + 10:l.find("<br/>")].split(" ")]
                 yield {"ref": refid, "players": names}
 
+    def _log_request(self, refid):
+        url = self.log_url + refid
+        headers = {'User-Agent': self.agent, 'Host': urlsplit(url).netloc, 'Referer': self.referer_url + refid}
+        return url, headers
+
     def _crawl_log_by_refid(self, refid):
-        url = "http://tenhou.net/5/mjlog2json.cgi?" + refid
-        referer = "http://tenhou.net/5/?log=" + refid
-        agent = "Mozilla/5.0 (Macintosh; Intel ...) Gecko/20100101 Firefox/58.0"
-        host = "tenhou.net"
-        headers = {'User-Agent': agent, 'Host': host, 'Referer': referer}
-        response = requests.get(url, headers=headers).content
+        url, headers = self._log_request(refid)
+        response = self.http.get(url, headers=headers).content
         log = json.loads(response)
         return log
         # s = str(fixtures).replace("'", "\"")
@@ -1752,6 +3658,7 @@ class GameLogCrawler:
         :param gr_level: Indicates that crawling will be only processed on players who has a level greater than gr_level
         :param ite: number of iterations
         :return: None
+        :raises sqlite3.Error: if the refids can not be written, the player is then not marked as retrieved
         """
         names_generator = self._db_select_players_lv_gr(gr_level)
         for i in range(ite):
@@ -1761,6 +3668,7 @@ class GameLogCrawler:
                 for refid_item in refid_generator:
                     refid, names = refid_item["ref"], refid_item["players"]
                     self._db_insert_refid(refid, names)
+                self.db_flush()
                 self._db_update_retrieved(current_name)
             except StopIteration:
                 print("    There are not so many ({}) players that have levels greater than {}".format(ite, gr_level))
@@ -1796,14 +3704,111 @@ class GameLogCrawler:
         :return: None
         """
         gene = self._db_select_refids_no_logs_where_players_lv_gr(gr_lv)
-        for i in range(ite):
-            try:
-                refid = gene.__next__()
-                log = self._crawl_log_by_refid(refid)
-                self._db_insert_log(refid, log)
-            except StopIteration:
-                print("All refids have been processed!")
-                break
+        try:
+            for i in range(ite):
+                try:
+                    refid = gene.__next__()
+                    log = self._crawl_log_by_refid(refid)
+                    self._db_insert_log(refid, log)
+                except StopIteration:
+                    print("All refids have been processed!")
+                    break
+        finally:
+            self.db_flush()
+
+    def batch_crawl_logs_async(self, gr_lv, ite=1000, concurrency=8, rate=2.0, burst=None, transport=None):
+        """
+        Crawl game logs like batch_crawl_logs(...), but with concurrent requests on an asyncio event loop.
+        Requests to each host are limited by a token bucket, crawled logs are inserted by a single writer task.
+        :param gr_lv: a level number, 20 highest, 0 lowest
+        :param ite: the maximal number of game logs to crawl, None for all referal ids without log
+        :param concurrency: the number of requests in flight
+        :param rate: the number of requests per second to each host
+        :param burst: the capacity of the token buckets, by default max(1, rate)
+        :param transport: an object with a coroutine get(url, headers) returning the response body and raising
+                          TransientHttpError for failures worth retrying, by default a RequestsTransport with
+                          concurrency threads sending through self.http. Failures worth retrying are retried up to
+                          self.http.retries times, each retry waits for the token bucket of the host again, and a
+                          Retry-After delay of the server holds the bucket of the host.
+        :return: the number of game logs written into the database
+        :raises sqlite3.Error: if writing fails, the logs not yet written stay buffered for db_flush()
+        """
+        refids = list(islice(self._db_select_refids_no_logs_where_players_lv_gr(gr_lv), ite))
+        if not refids:
+            print("All refids have been processed!")
+            return 0
+        own_transport = transport is None
+        if own_transport:
+            transport = RequestsTransport(max_workers=concurrency, session=self.http)
+        try:
+            return asyncio.run(self._crawl_logs_async(refids, concurrency, rate, burst, transport))
+        finally:
+            if own_transport:
+                transport.close()
+
+    async def _crawl_logs_async(self, refids, concurrency, rate, burst, transport):
+        refid_queue = asyncio.Queue()
+        for refid in refids:
+            refid_queue.put_nowait(refid)
+        log_queue = asyncio.Queue(maxsize=2 * concurrency)
+        buckets = {}
+
+        async def fetch():
+            while not refid_queue.empty():
+                refid = refid_queue.get_nowait()
+                url, headers = self._log_request(refid)
+                host = headers['Host']
+                if host not in buckets:
+                    buckets[host] = TokenBucket(rate, burst)
+                log = await fetch_one(refid, url, headers, buckets[host])
+                if log is not None:
+                    await log_queue.put((refid, log))
+
+        async def fetch_one(refid, url, headers, bucket):
+            attempt = 0
+            while True:
+                await bucket.acquire()
+                try:
+                    return json.loads(await transport.get(url, headers))
+                except TransientHttpError as e:
+                    if attempt >= self.http.retries:
+                        error = e
+                    else:
+                        self.http.count_retry()
+                        if e.retry_after is not None:
+                            bucket.hold(e.retry_after)
+                        else:
+                            await asyncio.sleep(self.http.delay(attempt))
+                        attempt += 1
+                        continue
+                except Exception as e:
+                    error = e
+                self.http.count_failure()
+                print("    Failed to crawl game log of {}: {}".format(refid, error))
+                return None
+
+        async def write():
+            written = 0
+            while True:
+                item = await log_queue.get()
+                if item is None:
+                    written += self._db_flush_table("logs")
+                    self.db_flush()
+                    return written
+                written += self._db_insert_log(*item)
+
+        fetchers = asyncio.gather(*(fetch() for _ in range(concurrency)))
+        writer = asyncio.ensure_future(write())
+        writer.add_done_callback(lambda _: fetchers.cancel())
+        try:
+            await fetchers
+        except asyncio.CancelledError:
+            if not writer.done():
+                raise
+        finally:
+            if not writer.done():
+                await log_queue.put(None)
+        return await writer
 
     def db_get_logs_where_players_lv_gr(self, gr_lv):
         """
@@ -1811,14 +3816,11 @@ class GameLogCrawler:
         :param gr_lv: level, highest 20, lowest 0
         :return: a generator of game logs that satisfy the constraint
         """
-        gene = self._db_select_refids_with_logs_where_players_lv_gr(gr_lv)
+        gene = self._db_select_logs_where_players_lv_gr(gr_lv)
         i = 0
         while True:
             try:
-                refid = gene.__next__()
-                res = self.cs.execute(f"SELECT log FROM logs WHERE refid='{refid}'")
-                res = res.fetchone()
-                log = res[0]
+                log = gene.__next__()
                 log = json.loads(log)
                 i += 1
                 yield log
@@ -1911,10 +3913,9 @@ class PreProcessing:
             res = []
             round_num = log[0][0]
             round_scores = [0, 0, 0, 0] if len(log[16]) < 2 else log[16][1]
+            round34 = Tile.his_round_to_34(log)
             bonus_tiles, bonus_indicators, bonus_to = [], log[2], 1
-            first_indicator_34 = Tile.his_to_34(bonus_indicators[0])
-            first_bonus = Tile.bns_ind_bd_dic.get(first_indicator_34, first_indicator_34 + 1)
-            bonus_tiles.append(first_bonus)
+            bonus_tiles.append(round34["bonus_tiles"][0])
             round_wind = Tile.WINDS[round_num // 4]
             player_winds = Tile.WINDS[round_num:] + Tile.WINDS[0:round_num]
             revealed = [0] * 34
@@ -1924,8 +3925,8 @@ class PreProcessing:
             for player in range(0, 4):  # 4,7,10,13
                 base_index = (player + 1) * 3
                 initial_hand_index = base_index + 1
-                hand34 = Tile.his_to_34(log[initial_hand_index])
-                states[player].s_red_fives = [Tile.his_to_34(t) for t in log[initial_hand_index] if t > 50]
+                hand34 = round34["hands"][player]
+                states[player].s_red_fives = round34["red_fives"][player]
                 states[player].init_state(hand34, bonus_tiles, player_winds[player],
                                           round_wind, revealed, names[player], dans[player], log[1][player])
 
@@ -1950,16 +3951,16 @@ class PreProcessing:
                 is_draw_string = isinstance(draw, str)
 
                 if not is_draw_string:
-                    if states[current_player].is_winning(Tile.his_to_34(draw), True):
+                    draw34 = round34["draws"][current_player][draw_to[current_player]]
+                    if states[current_player].is_winning(draw34, True):
                         if (draw_to[current_player] + 1) == len(log[draw_index]):
-                            states[current_player].a_last_action = {"type": "draw", "tile": Tile.his_to_34(draw)}
+                            states[current_player].a_last_action = {"type": "draw", "tile": draw34}
                             final_score = round_scores[current_player:] + round_scores[0:current_player]
                             states[current_player].a_action = {"type": "zimo", "score": final_score}
                             states[current_player].a_result = {"type": "win", "score": final_score}
                             states[current_player].s_opponents = pack_opps(current_player)
                             res.append(deepcopy(states[current_player]))
                             break
-                    draw34 = Tile.his_to_34(draw)
                     states[current_player].s_hand34.append(draw34)
 
                 if is_draw_string:
@@ -2009,9 +4010,8 @@ class PreProcessing:
                         draw_to[current_player] += 1
                         drop_to[current_player] += 1
                         if bonus_to < len(bonus_indicators):
-                            indicator = Tile.his_to_34([bonus_indicators[bonus_to]])
+                            bonus_tiles.append(round34["bonus_tiles"][bonus_to])
                             bonus_to += 1
-                            bonus_tiles.append(Tile.bns_ind_bd_dic.get(indicator, indicator + 1))
                         continue
 
                 drop = log[drop_index][drop_to[current_player]]
@@ -2048,9 +4048,8 @@ class PreProcessing:
                         draw_to[current_player] += 1
                         drop_to[current_player] += 1
                         if bonus_to < len(bonus_indicators):
-                            indicator = Tile.his_to_34([bonus_indicators[bonus_to]])
+                            bonus_tiles.append(round34["bonus_tiles"][bonus_to])
                             bonus_to += 1
-                            bonus_tiles.append(Tile.bns_ind_bd_dic.get(indicator, indicator + 1))
                         continue
                     if 'k' in drop:
                         which = drop.index('k') // 2
@@ -2080,9 +4079,8 @@ class PreProcessing:
                         draw_to[current_player] += 1
                         drop_to[current_player] += 1
                         if bonus_to < len(bonus_indicators):
-                            indicator = Tile.his_to_34([bonus_indicators[bonus_to]])
+                            bonus_tiles.append(round34["bonus_tiles"][bonus_to])
                             bonus_to += 1
-                            bonus_tiles.append(Tile.bns_ind_bd_dic.get(indicator, indicator + 1))
                         continue
                     if 'r' in drop:
                         states[current_player].s_reach = True
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+Micro benchmarks of MahjongKit.
+Each benchmark compares the current implementation against the former one, which is kept here as a reference.
+Usage:
+    python benchmark.py
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from copy import deepcopy
+
+import numpy as np
+
+from MahjongKit import GameLogCrawler, Partition, Tile, WinWaitCal
+
+
+def legacy_partition_single_type(tiles34):
+    """
+    The former recursive Partition._partition_single_type(...), which enumerates all partitions.
+    """
+    len_t = len(tiles34)
+
+    if len_t == 0:
+        return [[]]
+    if len_t == 1 or (len_t == 2 and abs(tiles34[0] - tiles34[1]) < 3):
+        return [[tiles34]]
+    if len_t == 2:
+        return [[tiles34[0:1], tiles34[1:2]]]
+
+    res = []
+
+    if tiles34[0] == tiles34[1] == tiles34[2]:
+        for tile_set in legacy_partition_single_type(tiles34[3:]):
+            res.append([tiles34[0:3]] + tile_set)
+
+    if tiles34[0] + 1 in tiles34 and tiles34[0] + 2 in tiles34:
+        rec_tiles = deepcopy(tiles34)
+        rec_tiles.remove(tiles34[0])
+        rec_tiles.remove(tiles34[0] + 1)
+        rec_tiles.remove(tiles34[0] + 2)
+        for tile_set in legacy_partition_single_type(rec_tiles):
+            res.append([[tiles34[0], tiles34[0] + 1, tiles34[0] + 2]] + tile_set)
+
+    if tiles34[0] + 1 in tiles34:
+        rec_tiles = deepcopy(tiles34)
+        rec_tiles.remove(tiles34[0])
+        rec_tiles.remove(tiles34[0] + 1)
+        for tile_set in legacy_partition_single_type(rec_tiles):
+            res.append([[tiles34[0], tiles34[0] + 1]] + tile_set)
+
+    if tiles34[0] + 2 in tiles34:
+        rec_tiles = deepcopy(tiles34)
+        rec_tiles.remove(tiles34[0])
+        rec_tiles.remove(tiles34[0] + 2)
+        for tile_set in legacy_partition_single_type(rec_tiles):
+            res.append([[tiles34[0], tiles34[0] + 2]] + tile_set)
+
+    if tiles34[0] == tiles34[1]:
+        for tile_set in legacy_partition_single_type(tiles34[2:]):
+            res.append([tiles34[0:2]] + tile_set)
+
+    for tile_set in legacy_partition_single_type(tiles34[1:]):
+        res.append([tiles34[0:1]] + tile_set)
+
+    tuned_res = []
+    min_len = min([len(p) for p in res])
+    for p in res:
+        if len(p) <= min_len and p not in tuned_res:
+            tuned_res.append(p)
+
+    return tuned_res
+
+
+def legacy_fu_calculation(hand_partition, final_tile, melds, minkan, ankan, is_zimo, player_wind, round_wind):
+    """
+    The former WinWaitCal.fu_calculation(...), which rebuilds chow and pair lists for every partition.
+    """
+    if len(hand_partition) == 7:
+        return {"fu": {"七对(25Fu)": 25}, "fu_sum": 25, "fu_round": 25, "fu_desc": "七对(25Fu)"}
+
+    if len(hand_partition) + len(melds) == 5:
+        chows = [m for m in hand_partition + melds if m[0] != m[1]]
+        pair = [m for m in hand_partition if len(m) == 2][0]
+        if len(chows) == 4 and pair[0] not in Tile.THREES + [player_wind, round_wind]:
+            chows_with_final = [chow for chow in chows if final_tile in chow]
+            if any((chw[0] == final_tile and chw[0] % 9 != 6) or (chw[2] == final_tile and chw[2] % 9 != 2)
+                       for chw in chows_with_final):
+                if is_zimo and len(melds) == 0:
+                    return {"fu": {"門前清自摸和平和(20Fu)": 20}, "fu_sum": 20, "fu_round": 20, "fu_desc": "門前清自摸和平和(20Fu)"}
+                if not is_zimo and len(melds) > 0:
+                    return {"fu": {"非门清平和荣和(30Fu)": 30}, "fu_sum": 30, "fu_round": 30, "fu_desc": "非门清平和荣和(30Fu)"}
+
+    fu = {}
+
+    def add_base(b, b_desc):
+        fu[b_desc] = b
+
+    def check_kezi():
+        for meld in hand_partition:
+            if len(meld) == 3:
+                if meld[0] == meld[1] == meld[2]:
+                    if meld[0] in Tile.ONENINE:
+                        if is_zimo or final_tile != meld[0]:
+                            add_base(8, "幺九暗刻(8Fu)")
+                        else:
+                            add_base(4, "幺九明刻(4Fu)")
+                    else:
+                        if is_zimo or final_tile != meld[0]:
+                            add_base(4, "中张暗刻(4Fu)")
+                        else:
+                            add_base(2, "中张明刻(2Fu)")
+
+        for meld in melds:
+            if meld[0] == meld[1]:
+                if meld[0] in Tile.ONENINE:
+                    add_base(4, "幺九明刻(4Fu)")
+                else:
+                    add_base(2, "中张明刻(2Fu)")
+
+    def check_kans():
+        for mk in minkan:
+            if mk[0] in Tile.ONENINE:
+                add_base(16, "幺九明杠(16Fu)")
+            else:
+                add_base(8, "中张明杠(8Fu)")
+        for ak in ankan:
+            if ak[0] in Tile.ONENINE:
+                add_base(32, "幺九暗杠(32Fu)")
+            else:
+                add_base(16, "中张暗杠(16Fu)")
+
+    def check_pair(p):
+        if p[0] in Tile.THREES:
+            add_base(2, "役牌雀头(2Fu)")
+        if p[0] == player_wind:
+            add_base(2, "自风雀头(2Fu)")
+        if p[0] == round_wind:
+            add_base(2, "场风雀头(2Fu)")
+
+    def check_waiting_type(p):
+        chws = [m for m in hand_partition + melds if m[0] != m[1]]
+        chws_with_final = [chow for chow in chws if final_tile in chow]
+        if p[0] == final_tile and len(chws_with_final) == 0:
+            add_base(2, "单吊(2Fu)")
+        elif len(chws_with_final) > 0:
+            if all((chw[1] == final_tile or (chw[0] == final_tile and chw[2] % 9 == 8)
+                    or (chw[2] == final_tile and chw[0] % 9 == 0)) for chw in chws_with_final):
+                add_base(2, "边张嵌张胡牌(2Fu)")
+
+    def check_win_type():
+        if is_zimo:
+            add_base(2, "自摸(2Fu)")
+        if not is_zimo and len(melds + minkan) == 0:
+            add_base(10, "门前清荣胡(10Fu)")
+
+    pair = [m for m in hand_partition if len(m) == 2][0]
+    check_kezi()
+    check_kans()
+    check_pair(pair)
+    check_waiting_type(pair)
+    check_win_type()
+
+    res = dict()
+    res["fu"] = fu
+    res["fu_sum"] = sum([v for k, v in fu.items()])
+    res["fu_round"] = ((res["fu_sum"] - 1) // 10 + 1) * 10
+    res["fu_desc"] = " ".join([k for k, v in fu.items()])
+    return res
+
+
+def random_hands(num, size, suits, seed=0):
+    """
+    Draw random hands from a wall restricted to the first `suits` number suits plus the character tiles.
+    :param num: number of hands
+    :param size: number of tiles in each hand
+    :param suits: 1 gives pure color like hands, 3 gives ordinary hands
+    :param seed: random seed
+    :return: a list of sorted hands in 34-form
+    """
+    rng = random.Random(seed)
+    wall = [t for t in range(34) for _ in range(4) if t < suits * 9 or (suits == 3 and t >= 27)]
+    hands = []
+    for _ in range(num):
+        rng.shuffle(wall)
+        hands.append(sorted(wall[:size]))
+    return hands
+
+
+def timed(func, args_list):
+    start = time.perf_counter()
+    res = [func(*args) for args in args_list]
+    return time.perf_counter() - start, res
+
+
+def bench_partition_single_type(num=100):
+    print("Partition._partition_single_type: branch and bound vs. full enumeration")
+    for size in (13, 14):
+        for suits in (3, 1):
+            hands = random_hands(num, size, suits, seed=size)
+            args = [([t for t in h if lo <= t < lo + 9],) for h in hands for lo in (0, 9, 18)]
+            args = [a for a in args if len(a[0]) > 0]
+            t_old, res_old = timed(legacy_partition_single_type, args)
+            t_new, res_new = timed(Partition._partition_single_type, args)
+            assert res_old == res_new
+            print("    {:2d} tiles, {} suit(s): {:8.4f}s -> {:8.4f}s  x{:.1f}".format(
+                size, suits, t_old, t_new, t_old / t_new))
+
+
+def bench_shantin_batch(num=20000):
+    print("Partition.shantin_multiple_forms_batch vs. a loop over shantin_multiple_forms")
+    hands = random_hands(num, 13, 3, seed=1)
+    counts = np.zeros((num, 34), dtype=np.int64)
+    for i, h in enumerate(hands):
+        for t in h:
+            counts[i, t] += 1
+    Partition.shantin_multiple_forms_batch(counts, np.zeros(num, dtype=np.int64), [27])
+    t_old, res_old = timed(Partition.shantin_multiple_forms, [(h, [], [27]) for h in hands])
+    start = time.perf_counter()
+    res_new = Partition.shantin_multiple_forms_batch(counts, np.zeros(num, dtype=np.int64), [27])
+    t_new = time.perf_counter() - start
+    assert [[r[k] for k in Partition.form_names] for r in res_old] == res_new.tolist()
+    print("    {} hands: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(num, t_old, t_new, t_old / t_new))
+
+
+def bench_discard_evaluation(num=300):
+    print("Partition.discard_evaluation vs. ukeire after each distinct discard")
+    hands = random_hands(num, 14, 3, seed=2)
+
+    def per_discard(tiles34):
+        res = {}
+        for tile in sorted(set(tiles34)):
+            rest = list(tiles34)
+            rest.remove(tile)
+            res[tile] = Partition.ukeire(rest, [], [27])
+        return res
+
+    t_old, res_old = timed(per_discard, [(h,) for h in hands])
+    t_new, res_new = timed(Partition.discard_evaluation, [(h, [], [27]) for h in hands])
+    assert res_old == res_new
+    print("    {} hands: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(num, t_old, t_new, t_old / t_new))
+
+
+def random_winning_partitions(num, seed=0):
+    """
+    Draw random winning hands, i.e. a pair and four melds of which up to two are called, and partition them.
+    :param num: number of hands
+    :param seed: random seed
+    :return: a list of argument tuples of fu_calculation(...), one for each winning partition of the hands
+    """
+    rng = random.Random(seed)
+    args = []
+    while len(args) < num:
+        pair = rng.randrange(34)
+        melds = []
+        for _ in range(4):
+            if rng.random() < 0.4:
+                melds.append([rng.randrange(34)] * 3)
+            else:
+                start = rng.randrange(3) * 9 + rng.randrange(7)
+                melds.append([start, start + 1, start + 2])
+        tiles = [pair, pair] + [t for m in melds for t in m]
+        if any(tiles.count(t) > 4 for t in tiles):
+            continue
+        called = melds[:rng.choice([0, 0, 1, 2])]
+        hand = sorted([pair, pair] + [t for m in melds[len(called):] for t in m])
+        final_tile = rng.choice(hand)
+        hand.remove(final_tile)
+        for p in WinWaitCal.win_parse(hand, final_tile):
+            args.append((p, final_tile, called, [], [], rng.random() < 0.5, 27 + rng.randrange(4), 27))
+    return args
+
+
+def bench_fu_calculation(num=20000):
+    print("WinWaitCal.fu_calculation: table driven vs. former list scans")
+    args = random_winning_partitions(num, seed=3)
+    t_old, res_old = timed(legacy_fu_calculation, args)
+    t_new, res_new = timed(WinWaitCal.fu_calculation, args)
+    assert res_old == res_new
+    print("    {} partitions: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(len(args), t_old, t_new, t_old / t_new))
+
+
+def bench_canonical_cache(num=1000):
+    print("WinWaitCal result cache: canonical keys under suit permutations vs. plain keys")
+    rng = random.Random(4)
+    args = random_winning_partitions(num, seed=4)
+    queries = []
+    for p, final_tile, called, _, _, is_zimo, player_wind, round_wind in args:
+        hand = sorted(t for m in p for t in m)
+        hand.remove(rng.choice(hand))
+        # every hand is asked again with its suits permuted, as happens for equal shapes in different suits
+        for _ in range(3):
+            perm = tuple(rng.sample(range(3), 3))
+            queries.append((sorted(Tile.map_suits(hand, perm)), [Tile.map_suits(m, perm) for m in called], [], [],
+                            is_zimo, player_wind, round_wind, False, 0, [], 0, 0, False))
+    results = []
+    for canonical in (False, True):
+        WinWaitCal.enable_result_cache(maxsize=None, canonical=canonical)
+        tracemalloc.start()
+        start = time.perf_counter()
+        res = [WinWaitCal.waiting_calculation(*q) for q in queries]
+        elapsed = time.perf_counter() - start
+        info = WinWaitCal.result_cache.info()
+        memory = tracemalloc.get_traced_memory()[0]
+        WinWaitCal.result_cache.clear()
+        memory -= tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(res)
+        print("    canonical={!s:5}: {} entries, hit rate {:.2f}, {:7.1f} KiB, {:8.4f}s".format(
+            canonical, info["size"], info["hit_rate"], memory / 1024, elapsed))
+    WinWaitCal.disable_result_cache()
+    assert results[0] == results[1]
+
+
+def random_rounds(num, seed=0):
+    """
+    Draw random rounds in game log form, with the hands, draws, discards and bonus indicators of a real round.
+    :param num: number of rounds
+    :param seed: random seed
+    :return: a list of rounds, see GameLogCrawler.prt_log_format(...)
+    """
+    rng = random.Random(seed)
+    his = sorted(Tile.his_to_34_dic)
+    rounds = []
+    for _ in range(num):
+        log = [[0, 0, 0], [25000] * 4, [rng.choice(his)], [rng.choice(his)]]
+        for _ in range(4):
+            log.append(sorted(rng.choice(his) for _ in range(13)))
+            log.append([rng.choice(his) for _ in range(18)])
+            log.append([rng.choice(his + [60]) for _ in range(18)])
+        rounds.append(log)
+    return rounds
+
+
+def bench_round_conversion(num=2000):
+    print("Tile.his_to_34_np vs. per tile conversions")
+
+    def per_tile(log):
+        conv = [[Tile.his_to_34(t) if t != 60 else -1 for t in log[(p + 1) * 3 + i]] for i in (1, 2, 3) for p in range(4)]
+        red = [[Tile.his_to_34(t) for t in log[(p + 1) * 3 + 1] if t > 50] for p in range(4)]
+        return conv, red, Tile.t60_to_bns(log[2]), Tile.t60_to_bns(log[3])
+
+    def one_lookup(log):
+        res = Tile.his_round_to_34(log)
+        return (res["hands"] + res["draws"] + res["discards"], res["red_fives"], res["bonus_tiles"],
+                res["ura_bonus_tiles"])
+
+    # his_round_to_34 is a convenience function, a round is too short for numpy to pay off, so only its result is
+    # checked here
+    rounds = [(log,) for log in random_rounds(num, seed=5)]
+    assert [per_tile(*args) for args in rounds] == [one_lookup(*args) for args in rounds]
+
+    tiles = np.array([t for (log,) in rounds for row in log[4:16] for t in row if t != 60], dtype=np.int64)
+    t_old, res_old = timed(lambda: [Tile.his_to_34(t) for t in tiles.tolist()], [()])
+    t_new, res_new = timed(Tile.his_to_34_np, [(tiles,)])
+    assert res_old[0] == res_new[0].tolist()
+    print("    {} tiles as array: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(len(tiles), t_old, t_new, t_old / t_new))
+
+
+def legacy_insert_log(conn, cs, refid, log):
+    """
+    The former GameLogCrawler._db_insert_log(...): an existence check, an f-string insert and a commit per row.
+    """
+    try:
+        has_log = cs.execute(f"SELECT count(*) FROM logs WHERE refid = '{refid}'").fetchone()
+        if not has_log[0]:
+            log = str(log).replace("'", "\"")
+            cs.execute(f"INSERT INTO logs VALUES ('{refid}', '{log}')")
+            conn.commit()
+    except Exception as e:
+        print(e)
+
+
+def bench_db_inserts(num=2000):
+    print("GameLogCrawler._db_insert_log: batched executemany vs. one commit per row")
+    rounds = random_rounds(8, seed=7)
+    logs = [("2018102720gm-00a9-0000-{:08x}".format(i), {"ref": i, "log": rounds}) for i in range(num)]
+    with tempfile.TemporaryDirectory() as tmp:
+        glc = GameLogCrawler(dbfile=os.path.join(tmp, "legacy.db"))
+        t_old, _ = timed(lambda refid, log: legacy_insert_log(glc.conn, glc.cs, refid, log), logs)
+        glc.close()
+        for batch_size in (100, 1000):
+            glc = GameLogCrawler(dbfile=os.path.join(tmp, "batch{}.db".format(batch_size)), batch_size=batch_size)
+            with contextlib.redirect_stdout(io.StringIO()):
+                t_new, _ = timed(lambda refid, log: glc._db_insert_log(refid, log), logs)
+                start = time.perf_counter()
+                glc.db_flush()
+                t_new += time.perf_counter() - start
+            assert glc.cs.execute("SELECT count(*) FROM logs").fetchone()[0] == num
+            assert json.loads(glc.cs.execute("SELECT log FROM logs").fetchone()[0]) == logs[0][1]
+            glc.close()
+            print("    {} logs, batch_size {:4d}: {:8.0f} rows/s -> {:8.0f} rows/s  x{:.1f}".format(
+                num, batch_size, num / t_old, num / t_new, t_old / t_new))
+
+
+def legacy_gamelog_db(path, num_refids, num_players=7500, seed=0):
+    """
+    A database of the former schema, in which the four players of a game are the columns p1 to p4 of TABLE refids.
+    """
+    rng = random.Random(seed)
+    names = ["player{}".format(i) for i in range(num_players * 3)]
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE player ('name' text PRIMARY KEY, 'level' text, 'pt' text, 'lv' INTEGER)")
+    conn.execute("CREATE TABLE refids ('ref' text PRIMARY KEY, 'p1' text, 'p2' text, 'p3' text, 'p4' text)")
+    conn.execute("CREATE TABLE logs ('refid' text PRIMARY KEY, 'log' text)")
+    conn.executemany("INSERT INTO player VALUES (?, NULL, NULL, ?)",
+                     [(name, rng.randrange(21)) for name in names[:num_players]])
+    conn.executemany("INSERT INTO refids VALUES (?, ?, ?, ?, ?)",
+                     [("ref{:06d}".format(i), *rng.sample(names, 4)) for i in range(num_refids)])
+    conn.commit()
+    conn.close()
+
+
+def bench_level_query(num=75000):
+    print("Refids of players above a level: TABLE game_players vs. the four-way OR join on TABLE refids")
+    legacy_query = ("SELECT DISTINCT refids.ref FROM player JOIN refids "
+                    "ON (player.name = refids.p1 OR player.name = refids.p2 "
+                    "OR player.name = refids.p3 OR player.name = refids.p4) "
+                    "WHERE player.lv > ? ORDER BY refids.ref DESC")
+    query = ("SELECT DISTINCT game_players.refid FROM player JOIN game_players "
+             "ON game_players.player_id = player.name "
+             "WHERE player.lv > ? ORDER BY game_players.refid DESC")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "gamelog.db")
+        legacy_gamelog_db(path, num)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            glc = GameLogCrawler(dbfile=path)
+        print("    migration of {} refids: {:8.4f}s".format(num, time.perf_counter() - start))
+        for lv in (18, 15, 10):
+            t_old, res_old = timed(lambda: [r[0] for r in glc.cs.execute(legacy_query, (lv,))], [()])
+            t_new, res_new = timed(lambda: [r[0] for r in glc.cs.execute(query, (lv,))], [()])
+            assert res_old == res_new == [list(glc._db_select_refids_no_logs_where_players_lv_gr(lv))]
+            print("    lv > {}, {:5d} refids: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(
+                lv, len(res_new[0]), t_old, t_new, t_old / t_new))
+        glc.conn.close()
+
+
+def legacy_select_logs(glc, gr_lv):
+    """
+    The former selection of refids without and with logs and of the logs: one existence check per refid,
+    and one more SELECT per log.
+    """
+    res = glc.cs.execute("SELECT DISTINCT game_players.refid FROM player JOIN game_players "
+                         "ON game_players.player_id = player.name "
+                         "WHERE player.lv > ? ORDER BY game_players.refid DESC", (gr_lv,)).fetchall()
+    has_log = [(r[0], glc.cs.execute(f"SELECT count(*) FROM logs WHERE refid = '{r[0]}'").fetchone()[0]) for r in res]
+    no_logs = [refid for refid, cnt in has_log if not cnt]
+    logs = [glc.cs.execute(f"SELECT log FROM logs WHERE refid='{refid}'").fetchone()[0] for refid, cnt in has_log if cnt]
+    return no_logs, logs
+
+
+def bench_log_selection(num=75000):
+    print("Refids without logs and logs of players above a level: anti-join and join vs. one query per refid")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "gamelog.db")
+        legacy_gamelog_db(path, num)
+        with contextlib.redirect_stdout(io.StringIO()):
+            glc = GameLogCrawler(dbfile=path)
+        glc.conn.executemany("INSERT INTO logs VALUES (?, ?)",
+                             [("ref{:06d}".format(i), json.dumps({"ref": i})) for i in range(0, num, 5)])
+        glc.conn.commit()
+
+        def streamed(gr_lv):
+            return (list(glc._db_select_refids_no_logs_where_players_lv_gr(gr_lv)),
+                    list(glc._db_select_logs_where_players_lv_gr(gr_lv)))
+
+        for lv in (18, 15, 10):
+            t_old, res_old = timed(legacy_select_logs, [(glc, lv)])
+            t_new, res_new = timed(streamed, [(lv,)])
+            assert res_old == res_new
+            print("    lv > {}, {:5d} refids, {:5d} logs: {:8.4f}s -> {:8.4f}s  x{:.1f}".format(
+                lv, len(res_new[0][0]), len(res_new[0][1]), t_old, t_new, t_old / t_new))
+        glc.conn.close()
+
+
+def main():
+    bench_partition_single_type()
+    bench_shantin_batch()
+    bench_discard_evaluation()
+    bench_fu_calculation()
+    bench_canonical_cache()
+    bench_round_conversion()
+    bench_db_inserts()
+    bench_level_query()
+    bench_log_selection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Offline tests of the asynchronous crawl mode of GameLogCrawler, against stub transports and a local stub server.
+Usage:
+    python -m unittest test_crawler
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from MahjongKit import GameLogCrawler, HttpSession, TokenBucket, TransientHttpError
+
+
+class StubTransport:
+    """
+        Returns a game log for every refid after a short delay, and records the number of requests in flight.
+        failures maps a refid to the list of exceptions raised by its first requests.
+    """
+
+    def __init__(self, failures=None, latency=0.01):
+        self.failures = failures or {}
+        self.latency = latency
+        self.in_flight, self.max_in_flight = 0, 0
+        self.calls = []
+
+    async def get(self, url, headers):
+        refid = url.split("?", 1)[1]
+        self.calls.append((time.monotonic(), refid))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.failures.get(refid):
+                raise self.failures[refid].pop(0)
+            return json.dumps({"ref": refid, "name": ["a'b", "c", "d", "e"]}).encode()
+        finally:
+            self.in_flight -= 1
+
+
+def make_crawler(num_refids, dbfile=":memory:"):
+    glc = GameLogCrawler(dbfile=dbfile, http=HttpSession(backoff=0.01, retries=2))
+    glc.cs.execute("INSERT INTO player VALUES ('p', '十段', '2000pt', 19)")
+    glc.conn.commit()
+    for i in range(num_refids):
+        glc._db_insert_refid("ref{:03d}".format(i), ["p", "x", "y", "z"])
+    glc.db_flush()
+    return glc
+
+
+def logged_refids(glc):
+    return sorted(r[0] for r in glc.cs.execute("SELECT refid FROM logs"))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_invalid_settings(self):
+        for rate, capacity in ((0, None), (-1, None), (1, 0.5), (1, 0)):
+            with self.assertRaises(ValueError):
+                TokenBucket(rate, capacity)
+
+    def test_rate(self):
+        async def take(bucket, n):
+            start = time.monotonic()
+            for _ in range(n):
+                await bucket.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(take(TokenBucket(20, 5), 15)), 0.45)
+
+    def test_hold(self):
+        async def held(bucket):
+            await bucket.acquire()
+            bucket.hold(0.3)
+            start = time.monotonic()
+            await bucket.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(held(TokenBucket(100, 10))), 0.3)
+
+
+class TestAsyncCrawl(unittest.TestCase):
+
+    def test_concurrency(self):
+        glc = make_crawler(30)
+        transport = StubTransport()
+        written = glc.batch_crawl_logs_async(17, ite=None, concurrency=4, rate=1000, transport=transport)
+        self.assertEqual(written, 30)
+        self.assertEqual(transport.max_in_flight, 4)
+        self.assertEqual(len(logged_refids(glc)), 30)
+        log = json.loads(glc.cs.execute("SELECT log FROM logs WHERE refid = 'ref000'").fetchone()[0])
+        self.assertEqual(log["name"][0], "a'b")
+
+    def test_failures(self):
+        glc = make_crawler(5)
+        transport = StubTransport(failures={
+            "ref000": [TransientHttpError("503")],
+            "ref001": [TransientHttpError("429", retry_after=0.3)],
+            "ref002": [TransientHttpError("503")] * 3,
+            "ref003": [ValueError("not a log")],
+        })
+        written = glc.batch_crawl_logs_async(17, concurrency=5, rate=1000, transport=transport)
+        self.assertEqual(written, 3)
+        self.assertEqual(logged_refids(glc), ["ref000", "ref001", "ref004"])
+        info = glc.http.info()
+        self.assertEqual((info["retries"], info["failures"]), (4, 2))
+        # the retry after a Retry-After delay waits for the token bucket of the host
+        times = [t for t, refid in transport.calls]
+        retry = [t for t, refid in transport.calls if refid == "ref001"][1]
+        self.assertGreaterEqual(retry - times[0], 0.3)
+        self.assertEqual(glc.batch_crawl_logs_async(17, transport=StubTransport()), 2)
+
+    def test_writer_failure(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "gamelog.db")
+            glc = make_crawler(5, dbfile=path)
+            glc.conn.execute("PRAGMA busy_timeout = 100")
+            other = sqlite3.connect(path)
+            other.execute("BEGIN IMMEDIATE")
+            with self.assertRaises(sqlite3.OperationalError):
+                glc.batch_crawl_logs_async(17, concurrency=2, rate=1000, transport=StubTransport())
+            self.assertEqual(len(glc._pending["logs"]), 5)
+            other.rollback()
+            other.close()
+            self.assertEqual(glc.db_flush(), 5)
+            self.assertEqual(len(logged_refids(glc)), 5)
+            glc.close()
+
+
+class StubServer(BaseHTTPRequestHandler):
+    """
+        Answers the first request of a refid ending with 'throttled' with 429 and Retry-After: 1,
+        refids ending with 'missing' with 404, and all others with a game log.
+    """
+    protocol_version = "HTTP/1.1"
+    seen = set()
+
+    def do_GET(self):
+        refid = self.path.split("?", 1)[1]
+        if refid.endswith("throttled") and refid not in self.seen:
+            self.seen.add(refid)
+            self.reply(429, b"", {"Retry-After": "1"})
+        elif refid.endswith("missing"):
+            self.reply(404, b"")
+        else:
+            self.reply(200, json.dumps({"ref": refid}).encode())
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRequestsTransport(unittest.TestCase):
+
+    def test_stub_server(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            glc = make_crawler(0)
+            for refid in ("ref-ok", "ref-throttled", "ref-missing"):
+                glc._db_insert_refid(refid, ["p", "x", "y", "z"])
+            glc.db_flush()
+            glc.log_url = "http://127.0.0.1:{}/5/mjlog2json.cgi?".format(server.server_port)
+            start = time.monotonic()
+            self.assertEqual(glc.batch_crawl_logs_async(17, concurrency=3, rate=100), 2)
+            self.assertGreaterEqual(time.monotonic() - start, 1.0)
+            self.assertEqual(logged_refids(glc), ["ref-ok", "ref-throttled"])
+            info = glc.http.info()
+            self.assertEqual((info["requests"], info["retries"], info["failures"]), (4, 1, 1))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()